@@ -2,15 +2,50 @@
 Cliente API Bling com retry, rate limiting e tratamento de erros
 """
 
+import multiprocessing
+import re
 import requests
+import threading
 import time
 from collections import deque
 from datetime import datetime, timedelta
 from bling_logger import log
+from bling_metrics import get_registry
+
+metrics = get_registry()
+api_requests = metrics.counter(
+    "bling_api_requests_total", "Requisições à API Bling por endpoint e status HTTP"
+)
+api_latency = metrics.histogram(
+    "bling_api_request_seconds", "Latência das requisições à API Bling por endpoint"
+)
+rate_limiter_wait = metrics.histogram(
+    "bling_rate_limiter_wait_seconds",
+    "Tempo aguardando vaga no rate limiter (inclui espera pelo lock)",
+)
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def endpoint_label(endpoint):
+    """Normaliza o endpoint para uso como label ("/produtos/123" -> "/produtos/{id}")."""
+    return _ID_SEGMENT.sub("/{id}", "/" + endpoint.lstrip("/"))
+
+
+class RetryableAPIError(Exception):
+    """
+    Falha temporária (429, 5xx, timeout, limite diário) no modo não bloqueante:
+    quem chamou decide quando tentar de novo, em vez de dormir na thread.
+    """
+
+    def __init__(self, message, retry_after=None, status=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
 
 
 class RateLimiter:
-    """Controla rate limit de 3 req/s e 120k/dia."""
+    """Controla rate limit de 3 req/s e 120k/dia (compartilhado entre threads)."""
 
     def __init__(self, requests_per_second=3, requests_per_day=120000):
         self.rps = requests_per_second
@@ -19,12 +54,28 @@ class RateLimiter:
         # Janela deslizante para req/s
         self.second_window = deque()
 
-        # Contador diário
+        # Contador diário e total desde o início do processo
         self.daily_count = 0
+        self.total_count = 0
         self.daily_reset = datetime.now() + timedelta(days=1)
 
-    def wait_if_needed(self):
-        """Aguarda se necessário para respeitar limites."""
+        # Serializa a reserva de vagas entre workers
+        self._lock = threading.Lock()
+
+    def wait_if_needed(self, block=True):
+        """
+        Aguarda se necessário para respeitar limites.
+
+        Args:
+            block: Se False, o limite diário esgotado levanta RetryableAPIError
+                em vez de dormir até o reset (o ritmo por segundo sempre aguarda)
+        """
+        started = time.perf_counter()
+        with self._lock:
+            self._wait_if_needed(block)
+        rate_limiter_wait.observe(time.perf_counter() - started)
+
+    def _wait_if_needed(self, block=True):
         now = time.time()
 
         # Reset contador diário se necessário
@@ -36,6 +87,10 @@ class RateLimiter:
         # Verifica limite diário
         if self.daily_count >= self.rpd:
             wait_seconds = (self.daily_reset - datetime.now()).total_seconds()
+            if not block:
+                raise RetryableAPIError(
+                    "Limite diário de requisições atingido", retry_after=wait_seconds
+                )
             log.warning(
                 f"⚠️ Limite diário atingido! Aguardando {wait_seconds / 3600:.1f} horas..."
             )
@@ -55,6 +110,85 @@ class RateLimiter:
         # Registra requisição
         self.second_window.append(time.time())
         self.daily_count += 1
+        self.total_count += 1
+
+    def daily_quota(self):
+        """(Requisições restantes na cota diária, segundos até o reset)."""
+        reset_in = (self.daily_reset - datetime.now()).total_seconds()
+        return max(self.rpd - self.daily_count, 0), max(reset_in, 0.0)
+
+
+class SharedRateLimiter:
+    """
+    Mesmos limites do RateLimiter, com o estado em memória compartilhada: um
+    único orçamento de req/s e de cota diária para vários processos.
+
+    A janela por segundo é um anel com os horários das últimas `rps`
+    requisições; a próxima espera até a mais antiga ter mais de 1s.
+    Criado no processo coordenador e passado aos workers ao iniciá-los.
+    """
+
+    def __init__(self, requests_per_second=3, requests_per_day=120000, context=None):
+        ctx = context or multiprocessing.get_context()
+        self.rps = requests_per_second
+        self.rpd = requests_per_day
+        self._window = ctx.Array("d", self.rps, lock=False)
+        self._daily = ctx.Value("q", 0, lock=False)
+        self._total = ctx.Value("q", 0, lock=False)
+        self._daily_reset = ctx.Value("d", time.time() + 86400, lock=False)
+        self._lock = ctx.Lock()
+        # Requisições deste processo (cada processo tem sua cópia do atributo)
+        self.process_count = 0
+
+    @property
+    def daily_count(self):
+        return self._daily.value
+
+    @property
+    def total_count(self):
+        return self._total.value
+
+    def daily_quota(self):
+        """(Requisições restantes na cota diária, segundos até o reset)."""
+        reset_in = self._daily_reset.value - time.time()
+        return max(self.rpd - self._daily.value, 0), max(reset_in, 0.0)
+
+    def wait_if_needed(self, block=True):
+        """Aguarda se necessário para respeitar limites (ver RateLimiter)."""
+        started = time.perf_counter()
+        with self._lock:
+            self._wait_if_needed(block)
+        rate_limiter_wait.observe(time.perf_counter() - started)
+
+    def _wait_if_needed(self, block=True):
+        if time.time() >= self._daily_reset.value:
+            self._daily.value = 0
+            self._daily_reset.value = time.time() + 86400
+            log.info("📊 Rate limit diário resetado")
+
+        if self._daily.value >= self.rpd:
+            wait_seconds = self._daily_reset.value - time.time()
+            if not block:
+                raise RetryableAPIError(
+                    "Limite diário de requisições atingido", retry_after=wait_seconds
+                )
+            log.warning(
+                f"⚠️ Limite diário atingido! Aguardando {wait_seconds / 3600:.1f} horas..."
+            )
+            time.sleep(max(wait_seconds, 0))
+            self._daily.value = 0
+            self._daily_reset.value = time.time() + 86400
+
+        # Posição no anel = requisição mais antiga da janela
+        slot = self._total.value % self.rps
+        sleep_time = 1 - (time.time() - self._window[slot])
+        if sleep_time > 0:
+            time.sleep(sleep_time)
+
+        self._window[slot] = time.time()
+        self._daily.value += 1
+        self._total.value += 1
+        self.process_count += 1
 
 
 class BlingAPI:
@@ -62,21 +196,52 @@ class BlingAPI:
 
     BASE_URL = "https://api.bling.com.br/Api/v3"
 
-    def __init__(self, get_token_func):
+    def __init__(self, get_token_func, blocking_retries=True, rate_limiter=None):
         """
         Args:
             get_token_func: Função que retorna access token válido
+            blocking_retries: Se False, 429/5xx/timeout levantam RetryableAPIError
+                na primeira ocorrência em vez de aguardar na própria thread
+                (usado pelos workers de webhook, que reagendam o evento)
+            rate_limiter: Limitador compartilhado (ex.: SharedRateLimiter entre
+                processos); padrão: um RateLimiter próprio
         """
         self.get_token = get_token_func
-        self.rate_limiter = RateLimiter()
-
-    def _headers(self):
+        self.blocking_retries = blocking_retries
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self._refresh_lock = threading.Lock()
+        self._local = threading.local()
+        # Requisições deste cliente (o limitador pode ser compartilhado)
+        self.call_count = 0
+        self._count_lock = threading.Lock()
+
+    def thread_call_count(self):
+        """Requisições HTTP feitas pela thread atual (para medir chamadas por evento)."""
+        return getattr(self._local, "calls", 0)
+
+    def _record_call(self, method, endpoint, status, elapsed):
+        self._local.calls = self.thread_call_count() + 1
+        label = endpoint_label(endpoint)
+        api_requests.inc(method=method, endpoint=label, status=status)
+        api_latency.observe(elapsed, endpoint=label)
+
+    def _headers(self, token=None):
         """Retorna headers com token atual."""
         return {
-            "Authorization": f"Bearer {self.get_token()}",
+            "Authorization": f"Bearer {token or self.get_token()}",
             "Content-Type": "application/json",
         }
 
+    def _refresh_token(self, failed_token):
+        """Renova o token uma única vez mesmo com vários workers recebendo 401."""
+        from bling_auth import refresh_access_token
+
+        with self._refresh_lock:
+            # Outro worker já renovou enquanto esperávamos o lock
+            if self.get_token() != failed_token:
+                return
+            refresh_access_token()
+
     def _request(self, method, endpoint, max_retries=3, **kwargs):
         """
         Faz requisição com retry automático e exponential backoff.
@@ -92,32 +257,59 @@ class BlingAPI:
         for attempt in range(max_retries):
             try:
                 # Rate limiting
-                self.rate_limiter.wait_if_needed()
+                self.rate_limiter.wait_if_needed(block=self.blocking_retries)
+                with self._count_lock:
+                    self.call_count += 1
 
                 # Fazer requisição
-                response = requests.request(
-                    method, url, headers=self._headers(), timeout=30, **kwargs
+                token = self.get_token()
+                started = time.perf_counter()
+                try:
+                    response = requests.request(
+                        method, url, headers=self._headers(token), timeout=30, **kwargs
+                    )
+                except requests.exceptions.Timeout:
+                    self._record_call(
+                        method, endpoint, "timeout", time.perf_counter() - started
+                    )
+                    raise
+                except requests.exceptions.RequestException:
+                    self._record_call(
+                        method, endpoint, "error", time.perf_counter() - started
+                    )
+                    raise
+                self._record_call(
+                    method, endpoint, response.status_code, time.perf_counter() - started
                 )
 
                 # Tratar erros HTTP
                 if response.status_code == 401:
                     # Token expirado, força refresh e tenta de novo
                     log.warning("⚠️ Token expirado (401), tentando refresh...")
-                    from bling_auth import refresh_access_token
-
-                    refresh_access_token()
+                    self._refresh_token(token)
                     # Retry com novo token (não conta como tentativa)
                     continue
 
                 elif response.status_code == 429:
                     # Rate limit excedido
                     retry_after = int(response.headers.get("Retry-After", 60))
+                    if not self.blocking_retries:
+                        raise RetryableAPIError(
+                            f"Rate limit (429) em {endpoint}",
+                            retry_after=retry_after,
+                            status=429,
+                        )
                     log.warning(f"⏳ Rate limit (429). Aguardando {retry_after}s...")
                     time.sleep(retry_after)
                     continue
 
                 elif response.status_code >= 500:
                     # Erro do servidor, retry com backoff
+                    if not self.blocking_retries:
+                        raise RetryableAPIError(
+                            f"Erro de servidor {response.status_code} em {endpoint}",
+                            status=response.status_code,
+                        )
                     if attempt < max_retries - 1:
                         wait = 2**attempt  # 1s, 2s, 4s
                         log.warning(
@@ -133,6 +325,8 @@ class BlingAPI:
                 return response.json() if response.content else {}
 
             except requests.exceptions.Timeout:
+                if not self.blocking_retries:
+                    raise RetryableAPIError(f"Timeout em {endpoint}")
                 if attempt < max_retries - 1:
                     wait = 2**attempt
                     log.warning(
@@ -144,6 +338,11 @@ class BlingAPI:
                 raise
 
             except requests.exceptions.RequestException as e:
+                if not self.blocking_retries:
+                    # 4xx é definitivo; só falhas de rede são retentáveis
+                    if isinstance(e, requests.exceptions.HTTPError):
+                        raise
+                    raise RetryableAPIError(f"Erro de rede em {endpoint}: {e}")
                 if attempt < max_retries - 1:
                     wait = 2**attempt
                     log.warning(
@@ -194,6 +393,10 @@ class BlingAPI:
         params = {"pagina": page, "limite": limit}
         return self._request("GET", "/categorias/produtos", params=params)
 
+    def get_category(self, category_id):
+        """Obtém uma categoria por ID."""
+        return self._request("GET", f"/categorias/produtos/{category_id}")
+
     def get_all_categories(self):
         """Obtém todas as categorias (auto-paginação)."""
         all_cats = {}
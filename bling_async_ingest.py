@@ -0,0 +1,297 @@
+"""
+Front-end asyncio para recepção de webhooks.
+
+Um único event loop aceita as conexões, faz o parse HTTP/1.1 e a validação
+barata (HMAC + JSON) sem tocar em disco. A parte que acessa o SQLite
+(idempotência + gravação na fila durável) é entregue por um canal limitado
+(asyncio.Queue) a um pool de threads; a resposta só sai depois do COMMIT.
+Com o canal cheio o servidor responde 503 + Retry-After imediatamente.
+
+Rotas que não são o webhook (/health etc.) são repassadas ao app Flask via
+test_client, também fora do event loop.
+"""
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import urlsplit
+
+from bling_logger import log
+from bling_metrics import get_registry
+
+WEBHOOK_PATH = "/webhook/bling"
+SIGNATURE_HEADER = "x-bling-signature-256"
+
+metrics = get_registry()
+ingest_latency = metrics.histogram(
+    "bling_webhook_ingest_seconds",
+    "Tempo entre o recebimento do webhook e o envio da resposta",
+)
+ingest_requests = metrics.counter(
+    "bling_webhook_requests_total", "Requisições de webhook por status HTTP"
+)
+
+
+class _BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncIngestServer:
+    """Servidor HTTP mínimo em asyncio para o endpoint de webhooks."""
+
+    def __init__(
+        self,
+        parse,
+        accept,
+        fallback_app,
+        host="0.0.0.0",
+        port=5000,
+        channel_size=1000,
+        ack_workers=16,
+        retry_after=30,
+        max_body=1024 * 1024,
+        keepalive_timeout=15,
+    ):
+        """
+        Args:
+            parse: Callable(body, signature) -> (payload, erro); roda no event loop
+            accept: Callable(payload) -> (status, corpo, headers); roda em thread
+            fallback_app: App Flask para as demais rotas
+            channel_size: Limite do canal entre recepção e gravação
+            ack_workers: Threads que gravam na fila durável
+            retry_after: Valor do Retry-After quando o canal está cheio
+            max_body: Tamanho máximo do corpo aceito (bytes)
+            keepalive_timeout: Tempo (s) de espera por nova requisição na conexão
+        """
+        self.parse = parse
+        self.accept = accept
+        self.fallback_app = fallback_app
+        self.host = host
+        self.port = port
+        self.channel_size = channel_size
+        self.ack_workers = max(1, ack_workers)
+        self.retry_after = retry_after
+        self.max_body = max_body
+        self.keepalive_timeout = keepalive_timeout
+
+        self._channel = None
+        self._executor = None
+        self._server = None
+        self.connections = 0
+        self.rejected = 0
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+
+    def run(self):
+        """Executa o servidor até Ctrl+C (bloqueante)."""
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            log.info("🛑 Servidor asyncio encerrado")
+
+    async def serve_forever(self):
+        self._channel = asyncio.Queue(maxsize=self.channel_size)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.ack_workers, thread_name_prefix="ingest-ack"
+        )
+        consumers = [
+            asyncio.create_task(self._consume()) for _ in range(self.ack_workers)
+        ]
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port
+        )
+        log.info(
+            f"⚡ Recepção asyncio em {self.host}:{self.port} "
+            f"(canal: {self.channel_size}, gravadores: {self.ack_workers})"
+        )
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            for task in consumers:
+                task.cancel()
+            self._executor.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            "frontend": "asyncio",
+            "connections": self.connections,
+            "channel_size": self._channel.qsize() if self._channel else 0,
+            "channel_limit": self.channel_size,
+            "rejected": self.rejected,
+            "ingest_seconds": ingest_latency.summary(frontend="asyncio"),
+        }
+
+    # ------------------------------------------------------------------
+    # Canal limitado: recepção -> gravação durável
+    # ------------------------------------------------------------------
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            payload, future = await self._channel.get()
+            try:
+                result = await loop.run_in_executor(
+                    self._executor, self.accept, payload
+                )
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                log.error(f"❌ Erro ao gravar webhook na fila: {e}")
+                if not future.done():
+                    future.set_result((500, {"error": "Internal error"}, {}))
+            finally:
+                self._channel.task_done()
+
+    async def _ingest(self, body, headers):
+        payload, error = self.parse(body, headers.get(SIGNATURE_HEADER, ""))
+        if error:
+            return error
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._channel.put_nowait((payload, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            log.warning(f"⏳ Canal de recepção cheio, webhook recusado: {payload['event']}")
+            return (
+                503,
+                {"status": "overloaded", "reason": "ingest_channel_full"},
+                {"Retry-After": str(self.retry_after)},
+            )
+        return await future
+
+    # ------------------------------------------------------------------
+    # HTTP/1.1
+    # ------------------------------------------------------------------
+
+    async def _handle_connection(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(
+                        self._read_request(reader), self.keepalive_timeout
+                    )
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                except _BadRequest as e:
+                    await self._send(
+                        writer, e.status, json.dumps({"error": str(e)}).encode(), {}, False
+                    )
+                    break
+
+                if request is None:
+                    break
+                method, target, headers, body, keep_alive = request
+                received = time.monotonic()
+
+                status, data, extra = await self._dispatch(method, target, headers, body)
+                await self._send(writer, status, data, extra, keep_alive)
+
+                if urlsplit(target).path == WEBHOOK_PATH:
+                    ingest_latency.observe(
+                        time.monotonic() - received, frontend="asyncio"
+                    )
+                    ingest_requests.inc(frontend="asyncio", status=status)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise
+        except asyncio.LimitOverrunError:
+            raise _BadRequest(431, "Headers too large")
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise _BadRequest(400, "Malformed request line")
+
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise _BadRequest(411, "Content-Length required")
+
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise _BadRequest(400, "Invalid Content-Length")
+        if length > self.max_body:
+            raise _BadRequest(413, "Payload too large")
+
+        body = await reader.readexactly(length) if length else b""
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = (
+            connection != "close"
+            if version == "HTTP/1.1"
+            else connection == "keep-alive"
+        )
+        return method.upper(), target, headers, body, keep_alive
+
+    async def _dispatch(self, method, target, headers, body):
+        """Retorna (status, corpo em bytes, headers extras)."""
+        if urlsplit(target).path == WEBHOOK_PATH and method == "POST":
+            status, data, extra = await self._ingest(body, headers)
+            return status, json.dumps(data).encode("utf-8"), extra
+
+        # Demais rotas: app Flask fora do event loop
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._call_flask, method, target, headers, body
+        )
+
+    def _call_flask(self, method, target, headers, body):
+        parts = urlsplit(target)
+        with self.fallback_app.test_client() as client:
+            response = client.open(
+                parts.path,
+                method=method,
+                query_string=parts.query,
+                headers=list(headers.items()),
+                data=body,
+            )
+            extra = {
+                name: value
+                for name, value in response.headers.items()
+                if name.lower() not in ("content-length", "connection")
+            }
+            return response.status_code, response.get_data(), extra
+
+    async def _send(self, writer, status, data, extra, keep_alive):
+        try:
+            reason = HTTPStatus(status).phrase
+        except ValueError:
+            reason = ""
+
+        headers = {"Content-Type": "application/json"}
+        headers.update(extra)
+        headers["Content-Length"] = str(len(data))
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+
+        head = f"HTTP/1.1 {status} {reason}\r\n" + "".join(
+            f"{name}: {value}\r\n" for name, value in headers.items()
+        )
+        writer.write(head.encode("latin-1") + b"\r\n" + data)
+        await writer.drain()
@@ -6,6 +6,7 @@ import requests
 import base64
 import json
 import os
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -32,14 +33,51 @@ def get_basic_auth_header():
 
 
 def save_tokens(tokens):
-    """Saves access and refresh tokens to a file."""
+    """Saves access and refresh tokens to a file (atomically: temp file + rename)."""
     global _tokens
     _tokens = tokens
-    with open(TOKEN_FILE, 'w') as f:
+    tmp_file = f"{TOKEN_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
         json.dump(tokens, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    # Readers in other processes see either the old or the new file, never a partial one
+    os.replace(tmp_file, TOKEN_FILE)
     print("✅ Tokens saved successfully.")
 
 
+@contextmanager
+def _refresh_lock():
+    """
+    Exclusive lock across processes (webhook server, monitor, sharded scan
+    workers) around a refresh: Bling rotates the refresh token, so two
+    concurrent refreshes with the same one would invalidate each other.
+    """
+    with open(f"{TOKEN_FILE}.lock", 'a+') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ~10s; keep waiting for the holder
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
 def load_tokens():
     """Loads tokens from a file if it exists."""
     global _tokens
@@ -71,14 +109,23 @@ def get_initial_token(auth_code):
 
 def refresh_access_token():
     """Refreshes the access token using the stored refresh token."""
+    with _refresh_lock():
+        return _refresh_access_token()
+
+
+def _refresh_access_token():
     global _tokens
     
-    if not _tokens:
-        _tokens = load_tokens()
+    current = _tokens
+    _tokens = load_tokens() or current
     
     if not _tokens or 'refresh_token' not in _tokens:
         raise ValueError("No refresh token available. Run with AUTH_CODE first.")
     
+    # Another process refreshed while we waited for the lock: reuse its token
+    if current and _tokens.get('access_token') != current.get('access_token'):
+        return _tokens
+    
     print("🔄 Refreshing access token...")
     data = {
         "grant_type": "refresh_token",
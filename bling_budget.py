@@ -0,0 +1,149 @@
+"""
+Orçamento de tempo e de requisições para execuções em lote.
+
+A execução admite trabalho enquanto houver orçamento; ao esgotar, para de
+admitir, deixa o que já está em andamento terminar e o restante fica para a
+próxima execução. O custo dos itens em andamento é estimado pela média de
+requisições por item observada até ali, para não estourar o limite.
+
+Com um SharedRateLimiter (varredura em shards), o limite vale para a soma
+dos processos; a estimativa considera só os itens em andamento do próprio
+processo, então o total pode passar um pouco do limite.
+"""
+
+import threading
+import time
+
+# Requisições esperadas por item antes de haver média (detalhes + uma escrita)
+DEFAULT_CALLS_PER_ITEM = 2.0
+
+
+class RunBudget:
+    """Limites de tempo (s) e de requisições à API de uma execução."""
+
+    def __init__(self, seconds=None, api_calls=None, rate_limiter=None):
+        """
+        Args:
+            seconds: Tempo máximo para admitir trabalho (None/0 = ilimitado)
+            api_calls: Requisições máximas (None/0 = ilimitado)
+            rate_limiter: RateLimiter da BlingAPI (fonte da contagem de requisições)
+        """
+        self.seconds = seconds or None
+        self.api_calls = api_calls or None
+        self.rate_limiter = rate_limiter
+        self.started_at = None
+        self.exhausted_reason = None
+        self._calls_at_start = 0
+        self._own_at_start = 0
+        self._admitted = 0
+        self._completed = 0
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+
+    @property
+    def limited(self):
+        return self.seconds is not None or self.api_calls is not None
+
+    def start(self, calls_at_start=None):
+        """
+        Args:
+            calls_at_start: Contagem do limitador que corresponde ao início do
+                orçamento (padrão: a atual)
+        """
+        self.started_at = time.monotonic()
+        if calls_at_start is None:
+            calls_at_start = self._total_calls()
+        self._calls_at_start = calls_at_start
+        self._own_at_start = self._own_calls()
+        return self
+
+    def _total_calls(self):
+        return self.rate_limiter.total_count if self.rate_limiter else 0
+
+    def _own_calls(self):
+        """Requisições deste processo (base da média por item)."""
+        if self.rate_limiter is None:
+            return 0
+        return getattr(self.rate_limiter, "process_count", self.rate_limiter.total_count)
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at if self.started_at else 0.0
+
+    def calls_used(self):
+        return self._total_calls() - self._calls_at_start
+
+    def used_fraction(self):
+        """Maior fração já consumida entre os limites (0 sem limites)."""
+        fractions = [0.0]
+        if self.seconds is not None:
+            fractions.append(self.elapsed() / self.seconds)
+        if self.api_calls is not None:
+            fractions.append(self.calls_used() / self.api_calls)
+        return max(fractions)
+
+    def exceeded(self):
+        """Algum limite já foi atingido (sem reservar nada)."""
+        with self._lock:
+            return self._check_limits()
+
+    def _check_limits(self):
+        if self.exhausted_reason:
+            return True
+        if self.seconds is not None and self.elapsed() >= self.seconds:
+            self.exhausted_reason = f"tempo ({self.seconds / 60:g} min)"
+        elif self.api_calls is not None and self.calls_used() >= self.api_calls:
+            self.exhausted_reason = f"requisições ({self.api_calls})"
+        return self.exhausted_reason is not None
+
+    def admit(self):
+        """
+        Reserva orçamento para mais um item.
+
+        Returns:
+            True se o item pode ser processado; False quando esgotado
+            (o motivo fica em exhausted_reason)
+        """
+        with self._done:
+            while True:
+                if self._check_limits():
+                    return False
+                if self.api_calls is None or self._fits():
+                    self._admitted += 1
+                    return True
+                # Perto do limite: espera os itens em andamento para decidir
+                # com o custo real; sem nenhum em andamento, acabou
+                if self._admitted == self._completed:
+                    self.exhausted_reason = f"requisições ({self.api_calls})"
+                    return False
+                self._done.wait(timeout=1.0)
+
+    def _fits(self):
+        """
+        Cabe mais um item, contando os em andamento pelo custo médio inteiro?
+
+        A estimativa é pessimista (parte do custo deles já está em used); perto
+        do limite, admit() espera que terminem e decide com o custo real.
+        """
+        used = self.calls_used()
+        in_flight = self._admitted - self._completed
+        if self._completed:
+            per_item = (self._own_calls() - self._own_at_start) / self._completed
+        else:
+            per_item = DEFAULT_CALLS_PER_ITEM
+        return used + (in_flight + 1) * per_item <= self.api_calls
+
+    def done(self):
+        """Um item admitido terminou (todas as suas requisições já foram feitas)."""
+        with self._done:
+            self._completed += 1
+            self._done.notify_all()
+
+    def stats(self):
+        return {
+            "seconds_limit": self.seconds,
+            "api_calls_limit": self.api_calls,
+            "elapsed_seconds": round(self.elapsed(), 1),
+            "api_calls_used": self.calls_used(),
+            "admitted": self._admitted,
+            "exhausted": self.exhausted_reason,
+        }
@@ -0,0 +1,178 @@
+"""
+Índice de candidatos com estoque zerado ou negativo (monitor de desativação).
+
+Em vez de varrer o catálogo a cada ciclo, o monitor avalia só os produtos do
+índice (tabela stock_candidates). O índice é alimentado pelos webhooks
+stock.updated (saldo <= 0 entra, saldo > 0 sai) e corrigido por uma
+reconciliação periódica que percorre a listagem inteira: cobre webhooks
+perdidos e remove produtos que não existem mais. Produtos inativos (já
+desativados, pelo monitor ou à mão) não são candidatos e saem do índice.
+"""
+
+import os
+import time
+
+from bling_incremental import DECISION_ERROR
+from bling_logger import log
+from bling_metrics import get_registry
+
+metrics = get_registry()
+candidates_gauge = metrics.gauge(
+    "bling_stock_candidates", "Produtos no índice de candidatos com estoque zerado"
+)
+reconcile_seconds = metrics.histogram(
+    "bling_candidate_reconcile_seconds", "Duração das reconciliações do índice",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800),
+)
+reconcile_calls = metrics.counter(
+    "bling_candidate_reconcile_calls_total", "Requisições feitas nas reconciliações"
+)
+
+SCAN_SCOPE = "candidates"
+
+
+def summary_stock(product):
+    """Saldo do produto (listagem ou detalhe); sem informação, conta como zero."""
+    if product.get("estoqueAtual") is not None:
+        return product["estoqueAtual"]
+    return (product.get("estoque") or {}).get("saldoVirtualTotal", 0) or 0
+
+
+def is_inactive(product):
+    """Produto inativo (situacao "I") não é candidato à desativação."""
+    return product.get("situacao") == "I"
+
+
+class StockCandidateIndex:
+    """Candidatos à desativação por estoque zerado, persistidos no SQLite."""
+
+    def __init__(self, db, reconcile_hours=None, reevaluate_hours=None):
+        """
+        Args:
+            db: Instância de BlingDatabase
+            reconcile_hours: Intervalo entre reconciliações; 0 = a cada ciclo
+                (padrão: env CANDIDATE_RECONCILE_HOURS ou 24)
+            reevaluate_hours: Reavalia candidatos já decididos após este
+                intervalo, mesmo sem mudança de saldo (padrão: env
+                FULL_SWEEP_HOURS ou 24)
+        """
+        self.db = db
+        if reconcile_hours is None:
+            reconcile_hours = float(os.getenv("CANDIDATE_RECONCILE_HOURS", 24))
+        if reevaluate_hours is None:
+            reevaluate_hours = float(os.getenv("FULL_SWEEP_HOURS", 24))
+        self.reconcile_hours = reconcile_hours
+        self.reevaluate_hours = reevaluate_hours
+        self.last_reconcile = None
+
+    # === Alimentação ===
+
+    def observe(self, product_id, stock, source="webhook"):
+        """Saldo observado de um produto (ex.: webhook stock.updated)."""
+        self.db.save_stock_levels([(product_id, stock)], source)
+
+    def observe_products(self, products, source):
+        """Saldos de vários produtos (listagem ou detalhes); inativos saem do índice."""
+        inactive = [p["id"] for p in products if is_inactive(p)]
+        self.db.save_stock_levels(
+            [(p["id"], summary_stock(p)) for p in products if not is_inactive(p)],
+            source,
+        )
+        self.db.delete_stock_candidates(inactive)
+
+    def forget(self, product_id):
+        """Tira um produto do índice (inativo ou acabou de ser desativado)."""
+        self.db.delete_stock_candidates([product_id])
+
+    def record(self, product_id, decision):
+        """Decisão do monitor para um candidato (pula até o saldo mudar)."""
+        self.db.save_candidate_decisions([(product_id, decision)])
+
+    # === Reconciliação ===
+
+    def reconcile_reason(self, force=False):
+        """Motivo para reconciliar agora (None se não for preciso)."""
+        last = self.db.get_scan_state(SCAN_SCOPE)["last_full_sweep_at"]
+        if force:
+            return "solicitada"
+        if last is None:
+            return "índice nunca reconciliado"
+        if self.reconcile_hours <= 0:
+            return "reconciliação a cada ciclo"
+        if time.time() - last >= self.reconcile_hours * 3600:
+            return f"última há {(time.time() - last) / 3600:.1f}h"
+        return None
+
+    def reconcile(self, api, page_size=100):
+        """
+        Percorre a listagem inteira e acerta o índice.
+
+        Returns:
+            Dict com o custo (páginas, requisições, segundos) e o efeito
+            (produtos vistos, candidatos antes/depois, removidos)
+        """
+        started = time.time()
+        calls_before = api.call_count
+        before = self.db.count_stock_candidates()
+        page = 1
+        seen = 0
+        zero = 0
+
+        while True:
+            products = api.get_products(page=page, limit=page_size).get("data", [])
+            if not products:
+                break
+            self.observe_products(products, "reconcile")
+            seen += len(products)
+            zero += sum(1 for p in products if summary_stock(p) <= 0)
+            page += 1
+
+        # Não observados desde o início: fora da listagem (ex.: excluídos)
+        pruned = self.db.prune_stock_candidates(observed_before=started)
+        self.db.mark_scan_run(SCAN_SCOPE, full_sweep=True)
+
+        elapsed = time.time() - started
+        calls = api.call_count - calls_before
+        reconcile_seconds.observe(elapsed)
+        reconcile_calls.inc(calls)
+
+        after = self.refresh_gauge()
+        self.last_reconcile = {
+            "pages": page - 1,
+            "api_calls": calls,
+            "seconds": round(elapsed, 1),
+            "products_seen": seen,
+            "zero_stock_seen": zero,
+            "candidates_before": before,
+            "candidates_after": after,
+            "pruned": pruned,
+        }
+        log.info(
+            f"🔄 Índice reconciliado: {seen} produtos em {page - 1} páginas, "
+            f"{calls} requisições, {elapsed:.1f}s; candidatos {before} → {after}"
+        )
+        return self.last_reconcile
+
+    # === Consulta ===
+
+    def due(self):
+        """
+        Candidatos a avaliar neste ciclo: sem decisão (novos ou com saldo
+        alterado), com erro, ou decididos há mais de reevaluate_hours.
+
+        Returns:
+            (a avaliar, total de candidatos)
+        """
+        candidates = self.db.get_stock_candidates()
+        stale_before = time.time() - self.reevaluate_hours * 3600
+        due = [
+            c for c in candidates
+            if c["decision"] in (None, DECISION_ERROR)
+            or (c["evaluated_at"] or 0) < stale_before
+        ]
+        return due, len(candidates)
+
+    def refresh_gauge(self):
+        count = self.db.count_stock_candidates()
+        candidates_gauge.set(count)
+        return count
@@ -2,22 +2,221 @@
 Módulo de persistência SQLite para contadores de código e cache
 """
 
+import os
+import re
 import sqlite3
 import json
-from datetime import datetime
+import time
+import zlib
+from datetime import datetime, timedelta
 from contextlib import contextmanager
 
+from bling_logger import log
+from bling_writer import WriteBehindWriter, db_op_hist, op_name
+
+# Formato compacto de payloads de ordens: 1 byte de versão + zlib com
+# dicionário pré-definido (chaves mais comuns dos JSONs de ordens do Bling)
+PAYLOAD_FORMAT_V1 = b"\x01"
+PAYLOAD_ZDICT = (
+    b'"observacoes":"","vendas":[],"deposito":{"idDestino":,"idOrigem":},'
+    b'"fornecedor":{"id":},"contato":{"id":,"nome":""},"dataPrevista":"0000-00-00",'
+    b'"totalProdutos":,"total":,"dataPrevisaoInicio":"20","dataPrevisaoFinal":"20",'
+    b'"dataInicio":"20","dataFim":"20","responsavel":"","situacao":{"id":,"valor":,'
+    b'"nome":"Finalizado"},"itens":[{"produto":{"id":,"nome":"","codigo":""},'
+    b'"quantidade":1,"valor":}],{"id":,"numero":,"data":"20'
+)
+
+
+def encode_order_payload(order, fields=None):
+    """
+    Serializa uma ordem no formato compacto (JSON minificado + zlib).
+
+    Args:
+        order: Dicionário da ordem
+        fields: Projeção opcional de campos de topo a manter ("id" sempre mantido)
+
+    Returns:
+        bytes no formato PAYLOAD_FORMAT_V1
+    """
+    if fields:
+        order = {k: v for k, v in order.items() if k in fields or k == "id"}
+
+    raw = json.dumps(order, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    compressor = zlib.compressobj(
+        9, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY, PAYLOAD_ZDICT
+    )
+    return PAYLOAD_FORMAT_V1 + compressor.compress(raw) + compressor.flush()
+
+
+def decode_order_payload(value):
+    """
+    Decodifica o payload de uma ordem, aceitando o formato compacto ou o
+    JSON em texto das versões anteriores.
+    """
+    if value is None:
+        return None
+
+    if isinstance(value, (bytes, memoryview)):
+        value = bytes(value)
+        if value[:1] == PAYLOAD_FORMAT_V1:
+            decompressor = zlib.decompressobj(15, PAYLOAD_ZDICT)
+            raw = decompressor.decompress(value[1:]) + decompressor.flush()
+            return json.loads(raw)
+        return json.loads(value.decode("utf-8"))
+
+    return json.loads(value)
+
+
+def _valid_date(value):
+    """Descarta datas vazias/placeholder do Bling ("0000-00-00")."""
+    if not value or value.startswith("0000"):
+        return None
+    return value
+
+
+def build_order_attrs(table, order):
+    """
+    Extrai os atributos consultáveis de uma ordem em um JSON plano pequeno
+    (coluna "attrs"), base das colunas geradas e indexadas.
+    """
+    situacao = order.get("situacao") or {}
+    itens = order.get("itens") or []
+
+    if table == "production_orders":
+        attrs = {
+            "situacao_id": situacao.get("id"),
+            "situacao_valor": situacao.get("valor"),
+            "date_start": _valid_date(
+                order.get("dataInicio") or order.get("dataPrevisaoInicio")
+            ),
+            "date_end": _valid_date(
+                order.get("dataFim") or order.get("dataPrevisaoFinal")
+            ),
+            "responsavel": order.get("responsavel"),
+            "fornecedor_id": None,
+        }
+    else:
+        fornecedor = order.get("fornecedor") or order.get("contato") or {}
+        attrs = {
+            "situacao_id": situacao.get("id"),
+            "situacao_valor": situacao.get("valor"),
+            "date_start": _valid_date(order.get("data")),
+            "date_end": _valid_date(order.get("dataPrevista")),
+            "responsavel": None,
+            "fornecedor_id": fornecedor.get("id"),
+        }
+
+    attrs["item_names"] = " | ".join(
+        (item.get("produto") or {}).get("nome") or item.get("descricao") or ""
+        for item in itens
+    ) or None
+    return json.dumps(attrs, ensure_ascii=False, separators=(",", ":"))
+
 
 class BlingDatabase:
-    def __init__(self, db_path="bling_data.db"):
+    # Tabelas de ordens com coluna "data" (payload JSON)
+    ORDER_TABLES = ("production_orders", "purchase_orders")
+
+    # Tabela de itens de cada tabela de ordens
+    ORDER_ITEM_TABLES = {
+        "production_orders": "production_items",
+        "purchase_orders": "purchase_items",
+    }
+
+    # Colunas geradas (VIRTUAL) sobre "attrs": nome -> (tipo, indexada)
+    ORDER_ATTR_COLUMNS = {
+        "situacao_id": ("INTEGER", True),
+        "situacao_valor": ("INTEGER", True),
+        "date_start": ("TEXT", True),
+        "date_end": ("TEXT", True),
+        "responsavel": ("TEXT", True),
+        "fornecedor_id": ("INTEGER", True),
+        "item_names": ("TEXT", False),
+    }
+
+    # Tabelas movidas para o banco de arquivo -> coluna de data usada no corte
+    ARCHIVE_TABLES = {
+        "production_orders": "order_date",
+        "purchase_orders": "order_date",
+        "processed_events": "processed_at",
+    }
+
+    # Migrações versionadas (PRAGMA user_version): (versão, descrição, método)
+    MIGRATIONS = (
+        (1, "Schema inicial (tabelas e índices)", "_migration_001_base_schema"),
+        (2, "Colunas geradas indexadas sobre ordens", "_migration_002_order_attrs"),
+        (3, "Payloads de ordens no formato compacto", "_migration_003_compact_payloads"),
+        (4, "Fila durável de eventos webhook", "_migration_004_event_queue"),
+        (5, "Coalescência e estado aplicado por produto", "_migration_005_coalescing"),
+        (6, "Faixas de prioridade na fila de eventos", "_migration_006_queue_lanes"),
+        (7, "Cache persistente de categorias", "_migration_007_categories"),
+        (8, "Origem da resolução de cada evento", "_migration_008_event_resolution"),
+        (9, "Dead letters da fila de eventos", "_migration_009_dead_letters"),
+        (10, "Estado por produto entre varreduras", "_migration_010_product_state"),
+        (11, "Execuções em lote e diário de retomada", "_migration_011_run_journal"),
+        (12, "Índice de candidatos com estoque zerado", "_migration_012_stock_candidates"),
+        (13, "Agenda e lease dos ciclos periódicos", "_migration_013_scheduler_state"),
+        (14, "Último registro detalhado por produto", "_migration_014_product_snapshots"),
+    )
+    SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+    def __init__(
+        self,
+        db_path="bling_data.db",
+        order_data_fields=None,
+        archive_path=None,
+        archive_horizon_days=None,
+    ):
+        """
+        Args:
+            db_path: Caminho do arquivo SQLite
+            order_data_fields: Projeção de campos salvos no payload das ordens
+                (padrão: env ORDER_DATA_FIELDS, separado por vírgula; vazio = todos)
+            archive_path: Banco de arquivo para linhas antigas
+                (padrão: env ARCHIVE_DATABASE_PATH ou <db>_archive.db)
+            archive_horizon_days: Idade (dias) a partir da qual linhas são
+                arquivadas (padrão: env ARCHIVE_HORIZON_DAYS ou 365)
+        """
         self.db_path = db_path
+        self.writer = None  # Escritor write-behind (opcional)
+
+        root, ext = os.path.splitext(db_path)
+        self.archive_path = archive_path or os.getenv(
+            "ARCHIVE_DATABASE_PATH", f"{root}_archive{ext or '.db'}"
+        )
+        self.archive_horizon_days = int(
+            archive_horizon_days or os.getenv("ARCHIVE_HORIZON_DAYS", 365)
+        )
+
+        if order_data_fields is None:
+            env_fields = os.getenv("ORDER_DATA_FIELDS", "")
+            order_data_fields = [f.strip() for f in env_fields.split(",") if f.strip()]
+        self.order_data_fields = set(order_data_fields) or None
+
         self._init_db()
 
-    @contextmanager
-    def _get_connection(self):
-        """Context manager para conexões SQLite."""
-        conn = sqlite3.connect(self.db_path)
+    def _connect(self):
+        """Abre uma nova conexão SQLite."""
+        conn = sqlite3.connect(self.db_path, timeout=30)
         conn.row_factory = sqlite3.Row  # Permite acessar colunas por nome
+        return conn
+
+    def has_archive(self):
+        """Verifica se o banco de arquivo já existe."""
+        return os.path.exists(self.archive_path)
+
+    @contextmanager
+    def _get_connection(self, attach_archive=False):
+        """
+        Context manager para conexões SQLite.
+
+        Args:
+            attach_archive: Anexa o banco de arquivo como schema "archive"
+                (somente se ele existir; criado por archive_old_rows)
+        """
+        conn = self._connect()
+        if attach_archive and self.has_archive():
+            conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
         try:
             yield conn
             conn.commit()
@@ -28,162 +227,520 @@ class BlingDatabase:
             conn.close()
 
     def _init_db(self):
-        """Inicializa tabelas do banco de dados."""
+        """
+        Aplica migrações pendentes. Com o schema já na versão atual, o custo é
+        apenas a leitura de PRAGMA user_version.
+        """
         with self._get_connection() as conn:
-            cursor = conn.cursor()
+            self.schema_version = conn.execute("PRAGMA user_version").fetchone()[0]
 
-            # Tabela de contadores de código
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS code_counters (
-                    prefix TEXT PRIMARY KEY,
-                    last_value INTEGER NOT NULL DEFAULT 0,
-                    category_id INTEGER,
-                    category_name TEXT,
-                    updated_at TEXT NOT NULL
-                )
-            """)
+        if self.schema_version < self.SCHEMA_VERSION:
+            self.migrate()
 
-            # Tabela de eventos processados (idempotência webhook)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS processed_events (
-                    event_id TEXT PRIMARY KEY,
-                    event_type TEXT NOT NULL,
-                    product_id INTEGER,
-                    processed_at TEXT NOT NULL,
-                    payload TEXT
-                )
-            """)
+    def migrate(self):
+        """
+        Executa, em ordem, as migrações com versão maior que PRAGMA user_version.
+        Cada migração roda em sua própria transação (BEGIN IMMEDIATE, o que
+        serializa processos iniciando ao mesmo tempo) junto com a atualização
+        de user_version e do histórico em schema_migrations.
 
-            # Ordens de Produção
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS production_orders (
-                    order_id INTEGER PRIMARY KEY,
-                    order_number TEXT NOT NULL,
-                    order_date TEXT NOT NULL,
-                    status TEXT,
-                    supplier_id INTEGER,
-                    supplier_name TEXT,
-                    created_at TEXT NOT NULL,
-                    data TEXT
-                )
-            """)
+        Returns:
+            Lista de (versão, descrição, duração em ms) aplicadas
+        """
+        applied = []
+        conn = self._connect()
+        conn.isolation_level = None  # Controle explícito de transação
 
-            # Itens de Produção
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS production_items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    order_id INTEGER NOT NULL,
-                    product_id INTEGER NOT NULL,
-                    product_code TEXT,
-                    quantity REAL NOT NULL,
-                    unit_price REAL,
-                    FOREIGN KEY (order_id) REFERENCES production_orders(order_id)
-                )
-            """)
+        try:
+            for version, description, method in self.MIGRATIONS:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    current = conn.execute("PRAGMA user_version").fetchone()[0]
+                    if version <= current:
+                        conn.execute("COMMIT")
+                        continue
 
-            # Pedidos de Compra
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS purchase_orders (
-                    order_id INTEGER PRIMARY KEY,
-                    order_number TEXT NOT NULL,
-                    order_date TEXT NOT NULL,
-                    status TEXT,
-                    supplier_id INTEGER,
-                    supplier_name TEXT,
-                    total_value REAL,
-                    created_at TEXT NOT NULL,
-                    data TEXT
-                )
-            """)
+                    started = time.perf_counter()
+                    getattr(self, method)(conn)
+                    elapsed_ms = (time.perf_counter() - started) * 1000
 
-            # Itens de Compra
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS purchase_items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    order_id INTEGER NOT NULL,
-                    product_id INTEGER NOT NULL,
-                    product_code TEXT,
-                    quantity REAL NOT NULL,
-                    unit_price REAL,
-                    FOREIGN KEY (order_id) REFERENCES purchase_orders(order_id)
-                )
-            """)
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS schema_migrations (
+                            version INTEGER PRIMARY KEY,
+                            description TEXT NOT NULL,
+                            applied_at TEXT NOT NULL,
+                            duration_ms REAL
+                        )
+                    """)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO schema_migrations VALUES (?, ?, ?, ?)",
+                        (version, description, datetime.now().isoformat(), elapsed_ms),
+                    )
+                    conn.execute(f"PRAGMA user_version = {int(version)}")
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    log.error(f"❌ Falha na migração {version}: {description}")
+                    raise
 
-            # Controle de Sincronização
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS sync_control (
-                    sync_type TEXT PRIMARY KEY,
-                    last_sync_date TEXT,
-                    last_order_date TEXT,
-                    total_orders INTEGER DEFAULT 0,
-                    updated_at TEXT NOT NULL
+                applied.append((version, description, elapsed_ms))
+                log.info(
+                    f"🧱 Migração {version} aplicada em {elapsed_ms:.0f}ms: {description}"
                 )
-            """)
 
-            # Índices
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_events_product 
-                ON processed_events(product_id)
-            """)
+            self.schema_version = conn.execute("PRAGMA user_version").fetchone()[0]
+        finally:
+            conn.close()
 
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_events_type 
-                ON processed_events(event_type)
-            """)
+        return applied
 
-            # Índices para purchase_items
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_purch_product ON purchase_items(product_id)"
+    # === Migrações ===
+
+    def _migration_001_base_schema(self, conn):
+        """Tabelas e índices originais (idempotente para bancos pré-versionamento)."""
+        cursor = conn.cursor()
+
+        # Tabela de contadores de código
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS code_counters (
+                prefix TEXT PRIMARY KEY,
+                last_value INTEGER NOT NULL DEFAULT 0,
+                category_id INTEGER,
+                category_name TEXT,
+                updated_at TEXT NOT NULL
             )
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_purch_order ON purchase_items(order_id)"
+        """)
+
+        # Tabela de eventos processados (idempotência webhook)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS processed_events (
+                event_id TEXT PRIMARY KEY,
+                event_type TEXT NOT NULL,
+                product_id INTEGER,
+                processed_at TEXT NOT NULL,
+                payload TEXT
             )
+        """)
 
-            # Índices para production_items
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_prod_product ON production_items(product_id)"
+        # Ordens de Produção
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS production_orders (
+                order_id INTEGER PRIMARY KEY,
+                order_number TEXT NOT NULL,
+                order_date TEXT NOT NULL,
+                status TEXT,
+                supplier_id INTEGER,
+                supplier_name TEXT,
+                created_at TEXT NOT NULL,
+                data TEXT
             )
-            cursor.execute(
-                "CREATE INDEX IF NOT EXISTS idx_prod_order ON production_items(order_id)"
+        """)
+
+        # Itens de Produção
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS production_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                product_code TEXT,
+                quantity REAL NOT NULL,
+                unit_price REAL,
+                FOREIGN KEY (order_id) REFERENCES production_orders(order_id)
+            )
+        """)
+
+        # Pedidos de Compra
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS purchase_orders (
+                order_id INTEGER PRIMARY KEY,
+                order_number TEXT NOT NULL,
+                order_date TEXT NOT NULL,
+                status TEXT,
+                supplier_id INTEGER,
+                supplier_name TEXT,
+                total_value REAL,
+                created_at TEXT NOT NULL,
+                data TEXT
             )
+        """)
+
+        # Itens de Compra
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS purchase_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                product_code TEXT,
+                quantity REAL NOT NULL,
+                unit_price REAL,
+                FOREIGN KEY (order_id) REFERENCES purchase_orders(order_id)
+            )
+        """)
+
+        # Controle de Sincronização
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sync_control (
+                sync_type TEXT PRIMARY KEY,
+                last_sync_date TEXT,
+                last_order_date TEXT,
+                total_orders INTEGER DEFAULT 0,
+                updated_at TEXT NOT NULL
+            )
+        """)
+
+        # Índices
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_events_product 
+            ON processed_events(product_id)
+        """)
+
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_events_type 
+            ON processed_events(event_type)
+        """)
+
+        # Índices para purchase_items
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_purch_product ON purchase_items(product_id)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_purch_order ON purchase_items(order_id)"
+        )
+
+        # Índices para production_items
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_prod_product ON production_items(product_id)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_prod_order ON production_items(order_id)"
+        )
+
+    def _migration_002_order_attrs(self, conn):
+        """Coluna attrs + colunas geradas indexadas sobre os payloads das ordens."""
+        self._ensure_order_attr_columns(conn)
+
+    def _migration_003_compact_payloads(self, conn):
+        """Converte payloads de ordens em JSON texto para o formato compacto."""
+        report = {"rows": 0, "bytes_before": 0, "bytes_after": 0}
+        self._compact_payloads(conn, report)
+        if report["rows"]:
+            log.info(
+                f"🗜️  {report['rows']} payloads compactados "
+                f"({report['bytes_before'] / 1024:.0f} KB -> "
+                f"{report['bytes_after'] / 1024:.0f} KB); "
+                "espaço liberado no próximo vacuum da manutenção"
+            )
+
+    def _migration_004_event_queue(self, conn):
+        """Fila persistente de eventos com lease/ack (entrega at-least-once)."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS event_queue (
+                event_id TEXT PRIMARY KEY,
+                event_type TEXT NOT NULL,
+                product_id INTEGER,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                enqueued_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                lease_until REAL,
+                last_error TEXT
+            )
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_event_queue_ready "
+            "ON event_queue(status, available_at)"
+        )
+
+    def _migration_005_coalescing(self, conn):
+        """Chave de coalescência/data do evento na fila + último estado aplicado."""
+        conn.execute("ALTER TABLE event_queue ADD COLUMN coalesce_key TEXT")
+        conn.execute("ALTER TABLE event_queue ADD COLUMN event_ts REAL")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_event_queue_coalesce "
+            "ON event_queue(coalesce_key, status)"
+        )
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS product_event_state (
+                product_id INTEGER NOT NULL,
+                family TEXT NOT NULL,
+                applied_ts REAL NOT NULL,
+                PRIMARY KEY (product_id, family)
+            )
+        """)
+
+    def _migration_006_queue_lanes(self, conn):
+        """Faixa (lane) de prioridade de cada evento da fila."""
+        conn.execute(
+            "ALTER TABLE event_queue ADD COLUMN lane TEXT NOT NULL DEFAULT 'normal'"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_event_queue_lane "
+            "ON event_queue(status, lane, available_at)"
+        )
+
+    def _migration_007_categories(self, conn):
+        """Árvore de categorias persistida (warm start do CategoryCache)."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS categories (
+                category_id INTEGER PRIMARY KEY,
+                name TEXT,
+                parent_id INTEGER,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        """)
+
+    def _migration_008_event_resolution(self, conn):
+        """Registra se o evento foi resolvido pelo payload/cache ("local") ou pela API."""
+        conn.execute("ALTER TABLE processed_events ADD COLUMN resolution TEXT")
+
+    def _migration_009_dead_letters(self, conn):
+        """Eventos que esgotaram as tentativas (inspeção e replay manual)."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                event_id TEXT PRIMARY KEY,
+                event_type TEXT NOT NULL,
+                product_id INTEGER,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                last_error TEXT,
+                enqueued_at REAL,
+                failed_at REAL NOT NULL
+            )
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_dead_letters_type "
+            "ON dead_letters(event_type, failed_at)"
+        )
+
+    def _migration_010_product_state(self, conn):
+        """Última impressão/decisão por produto e última varredura completa (por escopo)."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS product_state (
+                scope TEXT NOT NULL,
+                product_id INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL,
+                decision TEXT,
+                stock REAL,
+                evaluated_at REAL NOT NULL,
+                PRIMARY KEY (scope, product_id)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS scan_state (
+                scope TEXT PRIMARY KEY,
+                last_full_sweep_at REAL,
+                last_run_at REAL
+            )
+        """)
+
+    def _migration_011_run_journal(self, conn):
+        """Execuções de varredura e diário de páginas/produtos/ações (retomada)."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS batch_runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scope TEXT NOT NULL,
+                status TEXT NOT NULL,
+                started_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                finished_at REAL,
+                dump_path TEXT,
+                dump_offset INTEGER,
+                stats TEXT
+            )
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_batch_runs_scope "
+            "ON batch_runs(scope, status)"
+        )
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS run_journal (
+                run_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                ref INTEGER NOT NULL,
+                detail TEXT,
+                recorded_at REAL NOT NULL,
+                PRIMARY KEY (run_id, kind, ref)
+            ) WITHOUT ROWID
+        """)
+
+    def _migration_012_stock_candidates(self, conn):
+        """Produtos com estoque zerado/negativo a avaliar pelo monitor."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stock_candidates (
+                product_id INTEGER PRIMARY KEY,
+                stock REAL,
+                source TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                decision TEXT,
+                evaluated_at REAL
+            ) WITHOUT ROWID
+        """)
+
+    def _migration_013_scheduler_state(self, conn):
+        """Próxima execução publicada e lease (um ciclo por vez) de cada agenda."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS scheduler_state (
+                name TEXT PRIMARY KEY,
+                owner TEXT,
+                lease_until REAL,
+                next_run_at REAL,
+                reason TEXT,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    def _migration_014_product_snapshots(self, conn):
+        """Registro do dump (detalhe, zlib) de cada produto, reusado quando ele é pulado."""
+        conn.execute("ALTER TABLE product_state ADD COLUMN snapshot BLOB")
+
+    def _ensure_order_attr_columns(self, conn):
+        """
+        Adiciona a coluna "attrs" e as colunas geradas indexadas às tabelas de
+        ordens (se ainda não existirem) e preenche "attrs" das linhas antigas.
+        """
+        for table in self.ORDER_TABLES:
+            existing = {
+                row["name"] for row in conn.execute(f"PRAGMA table_xinfo({table})")
+            }
+
+            if "attrs" not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN attrs TEXT")
+
+            for column, (col_type, indexed) in self.ORDER_ATTR_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(
+                        f"ALTER TABLE {table} ADD COLUMN {column} {col_type} "
+                        f"GENERATED ALWAYS AS (json_extract(attrs, '$.{column}')) VIRTUAL"
+                    )
+                if indexed:
+                    # order_date no índice evita ordenação temporária em find_orders
+                    conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} "
+                        f"ON {table}({column}, order_date)"
+                    )
+
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_order_date "
+                f"ON {table}(order_date)"
+            )
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_status "
+                f"ON {table}(status, order_date)"
+            )
+
+            # Preencher attrs de linhas gravadas antes das colunas geradas
+            pending = conn.execute(
+                f"SELECT order_id, data FROM {table} WHERE attrs IS NULL"
+            ).fetchall()
+            if pending:
+                updates = []
+                for row in pending:
+                    order = decode_order_payload(row["data"]) or {}
+                    updates.append((build_order_attrs(table, order), row["order_id"]))
+                conn.executemany(
+                    f"UPDATE {table} SET attrs = ? WHERE order_id = ?", updates
+                )
+                log.info(f"🔎 attrs preenchido para {len(pending)} linhas de {table}")
+
+    def start_write_behind(self, max_batch_size=100, max_delay=0.05):
+        """
+        Ativa o escritor write-behind: escritas do caminho de webhook passam a
+        ser agrupadas em transações por uma única thread.
+
+        Returns:
+            WriteBehindWriter em execução
+        """
+        if self.writer is None:
+            self.writer = WriteBehindWriter(
+                self, max_batch_size=max_batch_size, max_delay=max_delay
+            )
+        self.writer.start()
+        return self.writer
+
+    def stop_write_behind(self, timeout=5):
+        """Confirma escritas pendentes e encerra o escritor write-behind."""
+        if self.writer is not None:
+            self.writer.stop(timeout)
+
+    def _write(self, operation, *args, key=None, wait=True):
+        """
+        Executa uma operação de escrita, via write-behind se estiver ativo.
+
+        Args:
+            operation: Callable(conn, *args)
+            key: Chave para consulta de escritas pendentes
+            wait: Aguarda COMMIT (durabilidade) antes de retornar
+        """
+        if self.writer is not None and self.writer.is_running():
+            return self.writer.submit(operation, *args, key=key, wait=wait)
+
+        started = time.perf_counter()
+        with self._get_connection() as conn:
+            result = operation(conn, *args)
+        db_op_hist.observe(time.perf_counter() - started, op=op_name(operation))
+        return result
 
     def get_next_code(self, prefix, category_id=None, category_name=None):
         """
         Obtém o próximo código sequencial para um prefixo.
-        Thread-safe via transação SQLite.
+        Thread-safe via transação SQLite (ou via escritor único, se ativo).
         """
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
+        return self._write(self._next_code_op, prefix, category_id, category_name)
+
+    @staticmethod
+    def _next_code_op(conn, prefix, category_id, category_name):
+        """Incrementa o contador do prefixo dentro da transação recebida."""
+        cursor = conn.cursor()
+
+        # Tenta incrementar existente
+        cursor.execute(
+            """
+            UPDATE code_counters 
+            SET last_value = last_value + 1,
+                updated_at = ?
+            WHERE prefix = ?
+        """,
+            (datetime.now().isoformat(), prefix),
+        )
 
-            # Tenta incrementar existente
+        # Se não existia, cria
+        if cursor.rowcount == 0:
             cursor.execute(
                 """
-                UPDATE code_counters 
-                SET last_value = last_value + 1,
-                    updated_at = ?
-                WHERE prefix = ?
+                INSERT INTO code_counters 
+                (prefix, last_value, category_id, category_name, updated_at)
+                VALUES (?, 1, ?, ?, ?)
             """,
-                (datetime.now().isoformat(), prefix),
+                (prefix, category_id, category_name, datetime.now().isoformat()),
             )
+            return f"{prefix}00001"
 
-            # Se não existia, cria
-            if cursor.rowcount == 0:
-                cursor.execute(
-                    """
-                    INSERT INTO code_counters 
-                    (prefix, last_value, category_id, category_name, updated_at)
-                    VALUES (?, 1, ?, ?, ?)
-                """,
-                    (prefix, category_id, category_name, datetime.now().isoformat()),
-                )
-                return f"{prefix}00001"
+        # Busca valor atualizado
+        cursor.execute(
+            "SELECT last_value FROM code_counters WHERE prefix = ?", (prefix,)
+        )
+        row = cursor.fetchone()
+        return f"{prefix}{row['last_value']:05d}"
 
-            # Busca valor atualizado
-            cursor.execute(
-                "SELECT last_value FROM code_counters WHERE prefix = ?", (prefix,)
-            )
-            row = cursor.fetchone()
-            return f"{prefix}{row['last_value']:05d}"
+    def get_next_codes(self, requests):
+        """
+        Reserva vários códigos em uma única transação.
+
+        Args:
+            requests: Lista de (prefix, category_id, category_name)
+
+        Returns:
+            Lista de códigos na ordem dos pedidos
+        """
+        if not requests:
+            return []
+        return self._write(self._next_codes_op, list(requests))
+
+    @classmethod
+    def _next_codes_op(cls, conn, requests):
+        return [cls._next_code_op(conn, *request) for request in requests]
 
     def get_last_code_value(self, prefix):
         """Retorna o último valor usado para um prefixo."""
@@ -196,32 +753,71 @@ class BlingDatabase:
             return row["last_value"] if row else 0
 
     def is_event_processed(self, event_id):
-        """Verifica se um evento webhook já foi processado."""
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT 1 FROM processed_events WHERE event_id = ? LIMIT 1", (event_id,)
-            )
-            return cursor.fetchone() is not None
+        """
+        Verifica se um evento webhook já foi processado.
+
+        Consulta primeiro o banco quente e, se nada for encontrado, o banco de
+        arquivo (archive_old_rows move processed_events antigos para lá; uma
+        reentrega tardia não pode ser processada de novo).
+        """
+        # Escrita ainda na fila do write-behind conta como processada
+        if self.writer is not None and self.writer.is_pending(("event", event_id)):
+            return True
 
-    def mark_event_processed(self, event_id, event_type, product_id=None, payload=None):
-        """Marca um evento como processado."""
+        started = time.perf_counter()
         with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT OR IGNORE INTO processed_events 
-                (event_id, event_type, product_id, processed_at, payload)
-                VALUES (?, ?, ?, ?, ?)
-            """,
-                (
-                    event_id,
-                    event_type,
-                    product_id,
-                    datetime.now().isoformat(),
-                    json.dumps(payload) if payload else None,
-                ),
-            )
+            found = self._event_in_schema(conn, "main", event_id)
+        if not found and self.has_archive():
+            with self._get_connection(attach_archive=True) as conn:
+                found = self._archive_attached(conn) and self._event_in_schema(
+                    conn, "archive", event_id
+                )
+        db_op_hist.observe(time.perf_counter() - started, op="is_event_processed")
+        return found
+
+    @staticmethod
+    def _event_in_schema(conn, schema, event_id):
+        cursor = conn.execute(
+            f"SELECT 1 FROM {schema}.processed_events WHERE event_id = ? LIMIT 1",
+            (event_id,),
+        )
+        return cursor.fetchone() is not None
+
+    def mark_event_processed(
+        self, event_id, event_type, product_id=None, payload=None, wait=True
+    ):
+        """
+        Marca um evento como processado.
+
+        Com o write-behind ativo e wait=False, retorna imediatamente um
+        WriteTicket; a linha é gravada no próximo lote.
+        """
+        return self._write(
+            self._mark_event_processed_op,
+            event_id,
+            event_type,
+            product_id,
+            json.dumps(payload) if payload else None,
+            key=("event", event_id),
+            wait=wait,
+        )
+
+    @staticmethod
+    def _mark_event_processed_op(conn, event_id, event_type, product_id, payload_json):
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO processed_events 
+            (event_id, event_type, product_id, processed_at, payload)
+            VALUES (?, ?, ?, ?, ?)
+        """,
+            (
+                event_id,
+                event_type,
+                product_id,
+                datetime.now().isoformat(),
+                payload_json,
+            ),
+        )
 
     def get_stats(self):
         """Retorna estatísticas do banco."""
@@ -280,8 +876,8 @@ class BlingDatabase:
                     """
                     INSERT OR REPLACE INTO production_orders 
                     (order_id, order_number, order_date, status, 
-                    supplier_id, supplier_name, created_at, data)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    supplier_id, supplier_name, created_at, data, attrs)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
                     (
                         order.get("id"),
@@ -291,7 +887,8 @@ class BlingDatabase:
                         None,  # Sem supplier_id em produção
                         order.get("responsavel"),
                         datetime.now().isoformat(),
-                        json.dumps(order),
+                        encode_order_payload(order, self.order_data_fields),
+                        build_order_attrs("production_orders", order),
                     ),
                 )
 
@@ -324,8 +921,8 @@ class BlingDatabase:
                     """
                     INSERT OR REPLACE INTO purchase_orders 
                     (order_id, order_number, order_date, status,
-                     supplier_id, supplier_name, total_value, created_at, data)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                     supplier_id, supplier_name, total_value, created_at, data, attrs)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
                     (
                         order.get("id"),
@@ -336,7 +933,8 @@ class BlingDatabase:
                         order.get("contato", {}).get("nome"),
                         order.get("total"),
                         datetime.now().isoformat(),
-                        json.dumps(order),
+                        encode_order_payload(order, self.order_data_fields),
+                        build_order_attrs("purchase_orders", order),
                     ),
                 )
 
@@ -376,45 +974,858 @@ class BlingDatabase:
                 ),
             )
 
-    def product_has_entry(self, product_id):
-        """Verifica se produto tem entrada no banco local."""
+    # === Estado por produto (varreduras incrementais) ===
+
+    def get_product_states(self, scope, product_ids):
+        """
+        Estado gravado de vários produtos.
+
+        Returns:
+            Dict product_id -> {"fingerprint", "decision", "stock", "evaluated_at",
+            "snapshot"}
+        """
+        ids = [int(product_id) for product_id in product_ids]
+        states = {}
         with self._get_connection() as conn:
-            cursor = conn.cursor()
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"""
+                    SELECT product_id, fingerprint, decision, stock, evaluated_at,
+                           snapshot
+                    FROM product_state
+                    WHERE scope = ? AND product_id IN ({placeholders})
+                """,
+                    (scope, *chunk),
+                ).fetchall()
+                for row in rows:
+                    states[row["product_id"]] = dict(row)
+        return states
 
-            # Verificar em produção
-            cursor.execute(
-                """
-                SELECT po.order_number, po.order_date, pi.quantity, 
-                    po.supplier_name as responsible, 'production' as source
-                FROM production_items pi
-                JOIN production_orders po ON pi.order_id = po.order_id
-                WHERE pi.product_id = ?
-                ORDER BY po.order_date DESC
-                LIMIT 1
-            """,
-                (product_id,),
-            )
+    def save_product_states(self, scope, rows):
+        """
+        Grava o estado de vários produtos em uma transação.
 
-            row = cursor.fetchone()
-            if row:
-                return True, dict(row)
+        Args:
+            rows: Lista de (product_id, fingerprint, decision, stock, snapshot)
+        """
+        if not rows:
+            return
+        now = time.time()
+        values = [
+            (scope, int(product_id), fingerprint, decision, stock, now, snapshot)
+            for product_id, fingerprint, decision, stock, snapshot in rows
+        ]
+        return self._write(self._save_product_states_op, values)
 
-            # Verificar em compras (mantém igual)
-            cursor.execute(
-                """
-                SELECT po.order_number, po.order_date, pi.quantity, 
-                    po.supplier_name, 'purchase' as source
-                FROM purchase_items pi
-                JOIN purchase_orders po ON pi.order_id = po.order_id
-                WHERE pi.product_id = ?
-                ORDER BY po.order_date DESC
-                LIMIT 1
-            """,
-                (product_id,),
+    @staticmethod
+    def _save_product_states_op(conn, values):
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO product_state
+            (scope, product_id, fingerprint, decision, stock, evaluated_at, snapshot)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+            values,
+        )
+
+    def get_scan_state(self, scope):
+        """Horários (epoch) da última varredura completa e da última execução."""
+        with self._get_connection() as conn:
+            row = conn.execute(
+                "SELECT last_full_sweep_at, last_run_at FROM scan_state WHERE scope = ?",
+                (scope,),
+            ).fetchone()
+        return dict(row) if row else {"last_full_sweep_at": None, "last_run_at": None}
+
+    def mark_scan_run(self, scope, full_sweep=False):
+        """Registra o fim de uma execução (e da varredura completa, se for o caso)."""
+        return self._write(self._mark_scan_run_op, scope, time.time(), full_sweep)
+
+    @staticmethod
+    def _mark_scan_run_op(conn, scope, now, full_sweep):
+        conn.execute(
+            """
+            INSERT INTO scan_state (scope, last_full_sweep_at, last_run_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(scope) DO UPDATE SET
+                last_run_at = excluded.last_run_at,
+                last_full_sweep_at = COALESCE(
+                    excluded.last_full_sweep_at, scan_state.last_full_sweep_at
+                )
+        """,
+            (scope, now if full_sweep else None, now),
+        )
+
+    # === Candidatos com estoque zerado (monitor) ===
+
+    def save_stock_levels(self, rows, source, observed_at=None):
+        """
+        Atualiza o índice de candidatos com saldos observados: saldo <= 0 entra
+        (ou continua), saldo > 0 sai. Um saldo diferente do gravado apaga a
+        decisão anterior, para o produto ser reavaliado.
+
+        Args:
+            rows: Lista de (product_id, saldo)
+            source: Origem ("webhook", "reconcile", "monitor")
+            observed_at: Horário (epoch) da observação (padrão: agora)
+        """
+        if not rows:
+            return
+        rows = [(int(product_id), stock) for product_id, stock in rows]
+        return self._write(
+            self._stock_levels_op, rows, source, observed_at or time.time()
+        )
+
+    @staticmethod
+    def _stock_levels_op(conn, rows, source, now):
+        zero = [(pid, stock, source, now) for pid, stock in rows if stock <= 0]
+        positive = [(pid,) for pid, stock in rows if stock > 0]
+        conn.executemany(
+            """
+            INSERT INTO stock_candidates (product_id, stock, source, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(product_id) DO UPDATE SET
+                decision = CASE WHEN stock_candidates.stock IS excluded.stock
+                           THEN stock_candidates.decision END,
+                stock = excluded.stock,
+                source = excluded.source,
+                updated_at = excluded.updated_at
+        """,
+            zero,
+        )
+        conn.executemany("DELETE FROM stock_candidates WHERE product_id = ?", positive)
+
+    def get_stock_candidates(self):
+        """Todos os candidatos (dicts com as colunas de stock_candidates)."""
+        with self._get_connection() as conn:
+            rows = conn.execute(
+                "SELECT * FROM stock_candidates ORDER BY updated_at"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_stock_candidates(self):
+        with self._get_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM stock_candidates").fetchone()[0]
+
+    def save_candidate_decisions(self, rows):
+        """
+        Registra a avaliação dos candidatos.
+
+        Args:
+            rows: Lista de (product_id, decisão)
+        """
+        if not rows:
+            return
+        values = [(decision, time.time(), int(pid)) for pid, decision in rows]
+        return self._write(self._candidate_decisions_op, values)
+
+    @staticmethod
+    def _candidate_decisions_op(conn, values):
+        conn.executemany(
+            """
+            UPDATE stock_candidates SET decision = ?, evaluated_at = ?
+            WHERE product_id = ?
+        """,
+            values,
+        )
+
+    def delete_stock_candidates(self, product_ids):
+        """
+        Remove produtos do índice (ex.: inativos ou desativados pelo monitor).
+
+        Returns:
+            Número de candidatos removidos
+        """
+        if not product_ids:
+            return 0
+        return self._write(
+            self._delete_candidates_op, [(int(pid),) for pid in product_ids]
+        )
+
+    @staticmethod
+    def _delete_candidates_op(conn, rows):
+        cursor = conn.executemany(
+            "DELETE FROM stock_candidates WHERE product_id = ?", rows
+        )
+        return cursor.rowcount
+
+    def prune_stock_candidates(self, observed_before):
+        """
+        Fim da reconciliação: remove candidatos que a listagem não confirmou
+        (não observados desde o início dela, ex.: produtos excluídos).
+        Webhooks recebidos durante a varredura também contam como observação.
+
+        Returns:
+            Número de candidatos removidos
+        """
+        return self._write(self._prune_candidates_op, observed_before)
+
+    @staticmethod
+    def _prune_candidates_op(conn, observed_before):
+        cursor = conn.execute(
+            "DELETE FROM stock_candidates WHERE updated_at < ?", (observed_before,)
+        )
+        return cursor.rowcount
+
+    # === Agendas (ciclos periódicos) ===
+
+    def acquire_schedule_lease(self, name, owner, seconds):
+        """
+        Reserva a execução de um ciclo da agenda (entre processos).
+
+        Returns:
+            True se o lease é deste owner; False se outro processo o detém
+        """
+        return self._write(self._acquire_lease_op, name, owner, time.time(), seconds)
+
+    @staticmethod
+    def _acquire_lease_op(conn, name, owner, now, seconds):
+        conn.execute(
+            "INSERT OR IGNORE INTO scheduler_state (name, updated_at) VALUES (?, ?)",
+            (name, now),
+        )
+        cursor = conn.execute(
+            """
+            UPDATE scheduler_state SET owner = ?, lease_until = ?, updated_at = ?
+            WHERE name = ?
+              AND (owner IS NULL OR owner = ? OR lease_until IS NULL OR lease_until < ?)
+        """,
+            (owner, now + seconds, now, name, owner, now),
+        )
+        return cursor.rowcount == 1
+
+    def release_schedule_lease(self, name, owner):
+        return self._write(self._release_lease_op, name, owner, time.time())
+
+    @staticmethod
+    def _release_lease_op(conn, name, owner, now):
+        conn.execute(
+            """
+            UPDATE scheduler_state SET owner = NULL, lease_until = NULL, updated_at = ?
+            WHERE name = ? AND owner = ?
+        """,
+            (now, name, owner),
+        )
+
+    def publish_schedule(self, name, next_run_at, reason):
+        """Grava a próxima execução da agenda e o motivo do intervalo escolhido."""
+        return self._write(self._publish_schedule_op, name, next_run_at, reason, time.time())
+
+    @staticmethod
+    def _publish_schedule_op(conn, name, next_run_at, reason, now):
+        conn.execute(
+            """
+            INSERT INTO scheduler_state (name, next_run_at, reason, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                next_run_at = excluded.next_run_at,
+                reason = excluded.reason,
+                updated_at = excluded.updated_at
+        """,
+            (name, next_run_at, reason, now),
+        )
+
+    def get_schedule(self, name):
+        """Estado publicado da agenda (None se nunca executou)."""
+        with self._get_connection() as conn:
+            row = conn.execute(
+                "SELECT * FROM scheduler_state WHERE name = ?", (name,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    # === Categorias ===
+
+    def load_categories(self):
+        """
+        Categorias persistidas para warm start do cache.
+
+        Returns:
+            (dict ID -> categoria, fetched_at da carga mais antiga ou None)
+        """
+        with self._get_connection() as conn:
+            rows = conn.execute(
+                "SELECT category_id, data, fetched_at FROM categories"
+            ).fetchall()
+
+        categories = {row["category_id"]: json.loads(row["data"]) for row in rows}
+        fetched_at = min((row["fetched_at"] for row in rows), default=None)
+        return categories, fetched_at
+
+    def save_categories(self, categories, replace=False):
+        """
+        Grava categorias (dict ID -> categoria).
+
+        Args:
+            replace: Substitui a tabela inteira (carga completa da API)
+        """
+        now = time.time()
+        rows = [
+            (
+                int(category_id),
+                category.get("descricao") or category.get("nome"),
+                (category.get("categoriaPai") or {}).get("id"),
+                json.dumps(category, ensure_ascii=False),
+                now,
             )
+            for category_id, category in categories.items()
+        ]
+        return self._write(self._save_categories_op, rows, replace)
 
-            row = cursor.fetchone()
-            if row:
-                return True, dict(row)
+    @staticmethod
+    def _save_categories_op(conn, rows, replace):
+        if replace:
+            conn.execute("DELETE FROM categories")
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO categories
+            (category_id, name, parent_id, data, fetched_at)
+            VALUES (?, ?, ?, ?, ?)
+        """,
+            rows,
+        )
+
+    def delete_category(self, category_id):
+        """Remove uma categoria persistida."""
+        return self._write(self._delete_category_op, int(category_id))
+
+    @staticmethod
+    def _delete_category_op(conn, category_id):
+        conn.execute("DELETE FROM categories WHERE category_id = ?", (category_id,))
+
+    def product_has_entry(self, product_id, include_archive=True):
+        """
+        Verifica se produto tem entrada no banco local.
+
+        Consulta primeiro o banco quente e, se nada for encontrado, o banco de
+        arquivo (ordens mais antigas que o horizonte de arquivamento).
+        """
+        with self._get_connection(attach_archive=include_archive) as conn:
+            schemas = ["main"]
+            if include_archive and self._archive_attached(conn):
+                schemas.append("archive")
+
+            for schema in schemas:
+                found, details = self._product_entry_in_schema(conn, schema, product_id)
+                if found:
+                    return True, details
 
             return False, {}
+
+    @staticmethod
+    def _archive_attached(conn):
+        databases = conn.execute("PRAGMA database_list").fetchall()
+        return any(row["name"] == "archive" for row in databases)
+
+    @staticmethod
+    def _product_entry_in_schema(conn, schema, product_id):
+        """Busca a entrada mais recente do produto em um schema (main/archive)."""
+        cursor = conn.cursor()
+
+        # Verificar em produção
+        cursor.execute(
+            f"""
+            SELECT po.order_number, po.order_date, pi.quantity, 
+                po.supplier_name as responsible, 'production' as source
+            FROM {schema}.production_items pi
+            JOIN {schema}.production_orders po ON pi.order_id = po.order_id
+            WHERE pi.product_id = ?
+            ORDER BY po.order_date DESC
+            LIMIT 1
+        """,
+            (product_id,),
+        )
+
+        row = cursor.fetchone()
+        if row:
+            return True, dict(row)
+
+        # Verificar em compras (mantém igual)
+        cursor.execute(
+            f"""
+            SELECT po.order_number, po.order_date, pi.quantity, 
+                po.supplier_name, 'purchase' as source
+            FROM {schema}.purchase_items pi
+            JOIN {schema}.purchase_orders po ON pi.order_id = po.order_id
+            WHERE pi.product_id = ?
+            ORDER BY po.order_date DESC
+            LIMIT 1
+        """,
+            (product_id,),
+        )
+
+        row = cursor.fetchone()
+        if row:
+            return True, dict(row)
+
+        return False, {}
+
+    def get_order(self, table, order_id):
+        """
+        Obtém uma ordem com o payload já decodificado.
+
+        Args:
+            table: "production_orders" ou "purchase_orders"
+            order_id: ID da ordem
+
+        Returns:
+            dict com as colunas da ordem ("data" como dict) ou None
+        """
+        if table not in self.ORDER_TABLES:
+            raise ValueError(f"Tabela de ordens inválida: {table}")
+
+        with self._get_connection() as conn:
+            row = conn.execute(
+                f"SELECT * FROM {table} WHERE order_id = ?", (order_id,)
+            ).fetchone()
+
+        if not row:
+            return None
+
+        order = dict(row)
+        order["data"] = decode_order_payload(order["data"])
+        return order
+
+    def get_production_order(self, order_id):
+        """Obtém uma ordem de produção (payload decodificado)."""
+        return self.get_order("production_orders", order_id)
+
+    def get_purchase_order(self, order_id):
+        """Obtém um pedido de compra (payload decodificado)."""
+        return self.get_order("purchase_orders", order_id)
+
+    def _build_order_query(
+        self,
+        table,
+        status=None,
+        situation_id=None,
+        date_from=None,
+        date_to=None,
+        supplier_id=None,
+        responsible=None,
+        product_id=None,
+        limit=None,
+        with_data=False,
+        include_archive=False,
+    ):
+        """Monta SQL + parâmetros de find_orders (filtros sobre colunas indexadas)."""
+        if table not in self.ORDER_TABLES:
+            raise ValueError(f"Tabela de ordens inválida: {table}")
+
+        columns = (
+            "order_id, order_number, order_date, status, supplier_id, supplier_name, "
+            + ", ".join(self.ORDER_ATTR_COLUMNS)
+        )
+        if with_data:
+            columns += ", data"
+
+        schemas = ["main"]
+        if include_archive and self.has_archive():
+            schemas.append("archive")
+
+        selects = []
+        params = []
+        for schema in schemas:
+            where = []
+
+            if status is not None:
+                where.append("status = ?")
+                params.append(status)
+            if situation_id is not None:
+                where.append("situacao_id = ?")
+                params.append(situation_id)
+            if date_from:
+                where.append("order_date >= ?")
+                params.append(date_from)
+            if date_to:
+                where.append("order_date <= ?")
+                params.append(date_to)
+            if supplier_id is not None:
+                where.append("fornecedor_id = ?")
+                params.append(supplier_id)
+            if responsible is not None:
+                where.append("responsavel = ?")
+                params.append(responsible)
+            if product_id is not None:
+                item_table = f"{schema}.{self.ORDER_ITEM_TABLES[table]}"
+                where.append(
+                    f"order_id IN (SELECT order_id FROM {item_table} "
+                    f"WHERE product_id = ?)"
+                )
+                params.append(product_id)
+
+            select = f"SELECT {columns} FROM {schema}.{table}"
+            if where:
+                select += " WHERE " + " AND ".join(where)
+            selects.append(select)
+
+        sql = " UNION ALL ".join(selects) + " ORDER BY order_date DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        return sql, params
+
+    def find_orders(self, table, **filters):
+        """
+        Consulta ordens por status, situação, período, fornecedor, responsável
+        ou produto, usando os índices das colunas geradas (sem parsear JSON).
+
+        Args:
+            table: "production_orders" ou "purchase_orders"
+            **filters: status, situation_id, date_from, date_to (YYYY-MM-DD),
+                supplier_id, responsible, product_id, limit, with_data,
+                include_archive (lê também o banco de arquivo)
+
+        Returns:
+            Lista de dicts (com "data" decodificado se with_data=True)
+        """
+        sql, params = self._build_order_query(table, **filters)
+
+        with self._get_connection(attach_archive=filters.get("include_archive")) as conn:
+            rows = [dict(row) for row in conn.execute(sql, params)]
+
+        if filters.get("with_data"):
+            for row in rows:
+                row["data"] = decode_order_payload(row["data"])
+        return rows
+
+    def find_production_orders(self, **filters):
+        """Atalho de find_orders para ordens de produção."""
+        return self.find_orders("production_orders", **filters)
+
+    def find_purchase_orders(self, **filters):
+        """Atalho de find_orders para pedidos de compra."""
+        return self.find_orders("purchase_orders", **filters)
+
+    def explain_order_query(self, table, **filters):
+        """Retorna o plano (EXPLAIN QUERY PLAN) da consulta de find_orders."""
+        sql, params = self._build_order_query(table, **filters)
+
+        with self._get_connection(attach_archive=filters.get("include_archive")) as conn:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        return [row["detail"] for row in plan]
+
+    def compact_order_payloads(self, vacuum=True, batch_size=500, project=False):
+        """
+        Migra payloads de ordens em JSON texto para o formato compacto e,
+        opcionalmente, executa VACUUM para devolver o espaço ao disco.
+
+        Args:
+            project: Também aplica ORDER_DATA_FIELDS às ordens já gravadas
+                (inclusive as já compactadas). APAGA definitivamente os
+                campos fora da lista; sem isso, a projeção vale só para
+                gravações novas.
+
+        Returns:
+            dict com bytes economizados e vazão de leitura/escrita
+        """
+        fields = self.order_data_fields if project else None
+        if fields:
+            log.warning(
+                "⚠️  Projeção de payloads: campos fora de ORDER_DATA_FIELDS "
+                f"({', '.join(sorted(fields))}) serão apagados das ordens gravadas"
+            )
+        report = {
+            "rows": 0,
+            "bytes_before": 0,
+            "bytes_after": 0,
+            "file_before": os.path.getsize(self.db_path),
+        }
+
+        with self._get_connection() as conn:
+            write_seconds = self._compact_payloads(conn, report, batch_size, fields)
+
+        if vacuum and report["rows"]:
+            with self._get_connection() as conn:
+                conn.isolation_level = None  # VACUUM não roda dentro de transação
+                conn.execute("VACUUM")
+
+        report.update(self._measure_payload_reads())
+        report["file_after"] = os.path.getsize(self.db_path)
+        report["bytes_saved"] = report["bytes_before"] - report["bytes_after"]
+        report["write_rows_per_sec"] = (
+            report["rows"] / write_seconds if write_seconds else None
+        )
+        report["write_mb_per_sec"] = (
+            report["bytes_before"] / write_seconds / 1e6 if write_seconds else None
+        )
+
+        log.info(
+            f"🗜️  Payloads compactados: {report['rows']} ordens, "
+            f"{report['bytes_before'] / 1024:.0f} KB -> {report['bytes_after'] / 1024:.0f} KB "
+            f"(arquivo {report['file_before'] / 1024:.0f} KB -> {report['file_after'] / 1024:.0f} KB)"
+        )
+        return report
+
+    def _compact_payloads(self, conn, report, batch_size=500, fields=None):
+        """
+        Regrava no formato compacto os payloads ainda em JSON texto, com o
+        payload inteiro (a migração nunca descarta campos).
+
+        Args:
+            fields: Projeção a aplicar (compact_order_payloads(project=True));
+                com ela, todas as ordens são regravadas
+
+        Returns:
+            Tempo (s) gasto em codificação + escrita
+        """
+        write_seconds = 0.0
+        where = "" if fields else " WHERE typeof(data) = 'text'"
+
+        for table in self.ORDER_TABLES:
+            rows = conn.execute(f"SELECT order_id, data FROM {table}{where}").fetchall()
+
+            for start in range(0, len(rows), batch_size):
+                chunk = rows[start : start + batch_size]
+                started = time.perf_counter()
+                updates = []
+                for row in chunk:
+                    encoded = encode_order_payload(
+                        decode_order_payload(row["data"]), fields
+                    )
+                    stored = row["data"]
+                    if isinstance(stored, str):
+                        stored = stored.encode("utf-8")
+                    report["bytes_before"] += len(stored)
+                    report["bytes_after"] += len(encoded)
+                    updates.append((encoded, row["order_id"]))
+
+                conn.executemany(
+                    f"UPDATE {table} SET data = ? WHERE order_id = ?", updates
+                )
+                write_seconds += time.perf_counter() - started
+                report["rows"] += len(chunk)
+
+        return write_seconds
+
+    def _measure_payload_reads(self):
+        """Mede a vazão de leitura + decodificação dos payloads de ordens."""
+        rows = 0
+        decoded_bytes = 0
+        started = time.perf_counter()
+
+        with self._get_connection() as conn:
+            for table in self.ORDER_TABLES:
+                for row in conn.execute(f"SELECT data FROM {table}"):
+                    order = decode_order_payload(row["data"])
+                    if order is not None:
+                        rows += 1
+                        decoded_bytes += len(json.dumps(order))
+
+        elapsed = time.perf_counter() - started
+        return {
+            "read_rows": rows,
+            "read_rows_per_sec": rows / elapsed if elapsed else None,
+            "read_mb_per_sec": decoded_bytes / elapsed / 1e6 if elapsed else None,
+        }
+
+    # === Arquivamento e manutenção ===
+
+    def _ensure_archive_schema(self, conn):
+        """Cria no banco de arquivo as tabelas arquivadas (mesmo DDL do banco quente)."""
+        tables = list(self.ARCHIVE_TABLES) + list(self.ORDER_ITEM_TABLES.values())
+
+        for table in tables:
+            row = conn.execute(
+                "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                (table,),
+            ).fetchone()
+            ddl = re.sub(
+                rf'^CREATE TABLE\s+"?{table}"?',
+                f"CREATE TABLE IF NOT EXISTS archive.{table}",
+                row["sql"],
+            )
+            conn.execute(ddl)
+
+        for orders_table, items_table in self.ORDER_ITEM_TABLES.items():
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS archive.idx_{items_table}_product "
+                f"ON {items_table}(product_id)"
+            )
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS archive.idx_{items_table}_order "
+                f"ON {items_table}(order_id)"
+            )
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS archive.idx_{orders_table}_order_date "
+                f"ON {orders_table}(order_date)"
+            )
+
+    @staticmethod
+    def _move_rows(conn, table, condition, params):
+        """Copia para archive.<table> as linhas da condição e as remove do main."""
+        main_cols = [r["name"] for r in conn.execute(f"PRAGMA main.table_info({table})")]
+        archive_cols = {
+            r["name"] for r in conn.execute(f"PRAGMA archive.table_info({table})")
+        }
+        columns = ", ".join(c for c in main_cols if c in archive_cols)
+
+        conn.execute(
+            f"INSERT OR REPLACE INTO archive.{table} ({columns}) "
+            f"SELECT {columns} FROM main.{table} WHERE {condition}",
+            params,
+        )
+        deleted = conn.execute(f"DELETE FROM main.{table} WHERE {condition}", params)
+        return deleted.rowcount
+
+    def archive_old_rows(self, horizon_days=None):
+        """
+        Move ordens (com itens) e eventos processados mais antigos que o
+        horizonte para o banco de arquivo, numa única transação.
+
+        Returns:
+            dict tabela -> linhas movidas
+        """
+        horizon_days = horizon_days or self.archive_horizon_days
+        cutoff = (datetime.now() - timedelta(days=horizon_days)).strftime("%Y-%m-%d")
+        moved = {}
+
+        with self._get_connection() as conn:
+            conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+            self._ensure_archive_schema(conn)
+
+            for orders_table, items_table in self.ORDER_ITEM_TABLES.items():
+                date_column = self.ARCHIVE_TABLES[orders_table]
+                old_orders = (
+                    f"order_id IN (SELECT order_id FROM main.{orders_table} "
+                    f"WHERE {date_column} < ?)"
+                )
+                moved[items_table] = self._move_rows(
+                    conn, items_table, old_orders, (cutoff,)
+                )
+                moved[orders_table] = self._move_rows(
+                    conn, orders_table, f"{date_column} < ?", (cutoff,)
+                )
+
+            moved["processed_events"] = self._move_rows(
+                conn, "processed_events", "processed_at < ?", (cutoff,)
+            )
+
+        total = sum(moved.values())
+        if total:
+            log.info(f"🗄️  {total} linhas anteriores a {cutoff} movidas para {self.archive_path}")
+        return moved
+
+    def check_query_plans(self):
+        """
+        Verifica o plano das consultas críticas e sinaliza varreduras completas.
+
+        Returns:
+            dict nome -> {"plan": [...], "full_scan": bool}
+        """
+        queries = {
+            "product_has_entry": (
+                "SELECT po.order_number FROM production_items pi "
+                "JOIN production_orders po ON pi.order_id = po.order_id "
+                "WHERE pi.product_id = ? ORDER BY po.order_date DESC LIMIT 1",
+                (0,),
+            ),
+            "is_event_processed": (
+                "SELECT 1 FROM processed_events WHERE event_id = ? LIMIT 1",
+                ("",),
+            ),
+            "get_next_code": (
+                "SELECT last_value FROM code_counters WHERE prefix = ?",
+                ("",),
+            ),
+        }
+        for table in self.ORDER_TABLES:
+            queries[f"find_orders_{table}"] = self._build_order_query(
+                table, date_from="2000-01-01", limit=10
+            )
+
+        report = {}
+        with self._get_connection() as conn:
+            for name, (sql, params) in queries.items():
+                plan = [
+                    row["detail"]
+                    for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                ]
+                full_scan = any(
+                    step.startswith("SCAN ") and "USING" not in step for step in plan
+                )
+                report[name] = {"plan": plan, "full_scan": full_scan}
+        return report
+
+    def run_maintenance(self, archive=True, integrity="quick"):
+        """
+        Manutenção periódica: arquivamento, ANALYZE, vacuum incremental e
+        verificação de integridade.
+
+        Args:
+            archive: Executa archive_old_rows antes da manutenção
+            integrity: "quick" (quick_check), "full" (integrity_check) ou None
+
+        Returns:
+            dict com tamanhos de arquivo, integridade e saúde dos planos
+        """
+        started = time.perf_counter()
+        report = {"file_size_before": os.path.getsize(self.db_path)}
+
+        if archive:
+            report["archived"] = self.archive_old_rows()
+
+        # VACUUM/PRAGMAs de espaço precisam rodar fora de transação
+        conn = self._connect()
+        conn.isolation_level = None
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                # Conversão única para auto_vacuum incremental (exige VACUUM completo)
+                log.info("🧹 Ativando auto_vacuum incremental (VACUUM completo)...")
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+            else:
+                conn.execute("PRAGMA incremental_vacuum")
+
+            conn.execute("ANALYZE")
+
+            if integrity:
+                pragma = "integrity_check" if integrity == "full" else "quick_check"
+                result = [row[0] for row in conn.execute(f"PRAGMA {pragma}")]
+                report["integrity"] = "ok" if result == ["ok"] else result
+
+            report["page_count"] = conn.execute("PRAGMA page_count").fetchone()[0]
+            report["freelist_count"] = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        finally:
+            conn.close()
+
+        report["file_size"] = os.path.getsize(self.db_path)
+        report["archive_size"] = (
+            os.path.getsize(self.archive_path) if self.has_archive() else 0
+        )
+        report["query_plans"] = self.check_query_plans()
+        report["full_scans"] = [
+            name for name, info in report["query_plans"].items() if info["full_scan"]
+        ]
+        report["duration_s"] = round(time.perf_counter() - started, 3)
+
+        log.info(
+            f"🧹 Manutenção concluída em {report['duration_s']}s: "
+            f"{report['file_size_before'] / 1024:.0f} KB -> {report['file_size'] / 1024:.0f} KB, "
+            f"arquivo {report['archive_size'] / 1024:.0f} KB, "
+            f"integridade: {report.get('integrity', 'n/a')}"
+        )
+        if report["full_scans"]:
+            log.warning(f"⚠️  Consultas com varredura completa: {report['full_scans']}")
+        return report
+
+
+if __name__ == "__main__":
+    import sys
+
+    commands = {
+        "compact": lambda db: db.compact_order_payloads(),
+        # Apaga os campos fora de ORDER_DATA_FIELDS das ordens já gravadas
+        "project": lambda db: db.compact_order_payloads(project=True),
+        "archive": lambda db: db.archive_old_rows(),
+        "maintenance": lambda db: db.run_maintenance(),
+    }
+
+    if len(sys.argv) > 1 and sys.argv[1] in commands:
+        result = commands[sys.argv[1]](BlingDatabase())
+        for key, value in result.items():
+            log.info(f"   {key}: {value}")
+    else:
+        print("Uso: python bling_db.py [compact|project|archive|maintenance]")
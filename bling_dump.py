@@ -0,0 +1,179 @@
+"""
+Dump de produtos em JSON Lines (um objeto por linha), opcionalmente gzip.
+
+O DumpWriter grava cada produto assim que é processado, em "<arquivo>.partial",
+e o renomeia para o nome final só quando a varredura termina. sync() (chamado
+a cada página concluída) faz flush + fsync: após uma queda, o .partial contém
+tudo até a última página sincronizada e continua legível por iter_dump, que
+lê o arquivo em streaming e descarta uma última linha incompleta. O offset
+após cada sync() permite retomar o .partial exatamente daquele ponto.
+"""
+
+import json
+import os
+import sys
+import zlib
+
+from bling_logger import log
+
+PARTIAL_SUFFIX = ".partial"
+READ_CHUNK = 64 * 1024
+
+
+def is_compressed(path):
+    return str(path).endswith((".gz", ".gz" + PARTIAL_SUFFIX))
+
+
+class DumpWriter:
+    """Escritor de dump JSONL em streaming, seguro contra quedas."""
+
+    def __init__(
+        self, path, compress=None, append=False, compresslevel=6, resume_offset=None
+    ):
+        """
+        Args:
+            path: Arquivo final do dump (".gz" ativa a compressão por padrão)
+            compress: Força (True) ou desativa (False) o gzip
+            append: Continua um .partial existente em vez de recriá-lo
+            compresslevel: Nível do gzip (1-9)
+            resume_offset: Com append, descarta o que veio depois deste offset
+                (retorno de offset() no último sync)
+        """
+        self.path = str(path)
+        self.partial_path = self.path + PARTIAL_SUFFIX
+        self.compress = is_compressed(self.path) if compress is None else compress
+        self.compresslevel = compresslevel
+        self.count = 0
+        self.synced_count = 0
+        self.closed = False
+
+        self._raw = open(self.partial_path, "ab" if append else "wb")
+        if append and resume_offset is not None:
+            self._raw.truncate(resume_offset)
+        self._gz = self._new_member() if self.compress else None
+
+    def _new_member(self):
+        # Cada sync fecha um membro gzip e abre outro (iter_dump lê todos), para
+        # que todo offset sincronizado seja um ponto de retomada válido
+        return zlib.compressobj(self.compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Com erro, o .partial fica para inspeção/retomada
+        self.close(complete=exc_type is None)
+        return False
+
+    def write(self, record):
+        """Acrescenta um registro (dict) ao dump."""
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        data = (line + "\n").encode("utf-8")
+        if self._gz is not None:
+            data = self._gz.compress(data)
+        if data:
+            self._raw.write(data)
+        self.count += 1
+
+    def sync(self):
+        """Torna durável tudo o que foi escrito até aqui (flush + fsync)."""
+        if self.closed:
+            return
+        if self._gz is not None:
+            self._raw.write(self._gz.flush(zlib.Z_FINISH))
+            self._gz = self._new_member()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self.synced_count = self.count
+
+    def offset(self):
+        """Tamanho do .partial (ponto de retomada logo após um sync)."""
+        return self._raw.tell()
+
+    def close(self, complete=True):
+        """
+        Finaliza o dump.
+
+        Args:
+            complete: Renomeia o .partial para o nome final (False o mantém)
+        """
+        if self.closed:
+            return
+        if self._gz is not None:
+            self._raw.write(self._gz.flush(zlib.Z_FINISH))
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        self.synced_count = self.count
+        self.closed = True
+
+        if complete:
+            os.replace(self.partial_path, self.path)
+        else:
+            log.warning(
+                f"⚠️ Dump incompleto mantido em {self.partial_path} "
+                f"({self.count} registros)"
+            )
+
+
+def _iter_chunks(path, compressed):
+    """Blocos de bytes descomprimidos (aceita vários membros gzip e fim truncado)."""
+    with open(path, "rb") as f:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if compressed else None
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                break
+            if decompressor is None:
+                yield chunk
+                continue
+
+            while chunk:
+                yield decompressor.decompress(chunk)
+                if not decompressor.eof:
+                    break
+                # Fim de um membro: o restante pertence ao próximo
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def iter_dump(path, compressed=None):
+    """
+    Lê um dump JSONL em streaming, um produto por vez.
+
+    Uma última linha incompleta (queda durante a escrita) é descartada.
+
+    Args:
+        path: Arquivo do dump (final ou .partial)
+        compressed: Força a leitura como gzip (padrão: pela extensão)
+    """
+    compressed = is_compressed(path) if compressed is None else compressed
+    pending = b""
+    for data in _iter_chunks(path, compressed):
+        pending += data
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+    if pending.strip():
+        log.warning(f"⚠️ Última linha incompleta descartada em {path}")
+
+
+if __name__ == "__main__":
+    # Uso: python bling_dump.py <arquivo>
+    if len(sys.argv) != 2:
+        print("Uso: python bling_dump.py <arquivo.jsonl[.gz][.partial]>")
+        sys.exit(1)
+
+    total = 0
+    without_code = 0
+    inactive = 0
+    for product in iter_dump(sys.argv[1]):
+        total += 1
+        if not product.get("codigo"):
+            without_code += 1
+        if product.get("situacao") == "I":
+            inactive += 1
+    print(f"Produtos: {total} | sem código: {without_code} | inativos: {inactive}")
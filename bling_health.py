@@ -0,0 +1,81 @@
+"""
+Snapshots com TTL e limite de taxa para os endpoints de saúde/estatísticas.
+
+Consultas pesadas (COUNT(*), GROUP BY) são executadas no máximo uma vez por
+TTL, por uma única thread; as demais requisições recebem o último snapshot.
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class CachedSnapshot:
+    """Valor recalculado no máximo uma vez a cada `ttl` segundos."""
+
+    def __init__(self, loader, ttl=10):
+        """
+        Args:
+            loader: Callable() que produz o snapshot
+            ttl: Validade do snapshot em segundos
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self._value = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def age(self):
+        """Idade do snapshot atual em segundos (None se nunca carregado)."""
+        if self._loaded_at is None:
+            return None
+        return time.monotonic() - self._loaded_at
+
+    def get(self):
+        """
+        Retorna o snapshot, recalculando se expirado.
+
+        Enquanto uma thread recalcula, as outras recebem o valor anterior
+        (só esperam quando ainda não há nenhum).
+        """
+        age = self.age()
+        if age is not None and age < self.ttl:
+            return self._value
+
+        if not self._lock.acquire(blocking=self._loaded_at is None):
+            return self._value
+        try:
+            # Outra thread pode ter recalculado enquanto esperávamos
+            age = self.age()
+            if age is None or age >= self.ttl:
+                self._value = self.loader()
+                self._loaded_at = time.monotonic()
+            return self._value
+        finally:
+            self._lock.release()
+
+
+class RateLimitWindow:
+    """Limite de N chamadas por janela deslizante (compartilhado entre threads)."""
+
+    def __init__(self, max_calls=30, window=60):
+        self.max_calls = max_calls
+        self.window = window
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Registra uma chamada se houver vaga.
+
+        Returns:
+            (permitido: bool, segundos até a próxima vaga)
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._calls and now - self._calls[0] >= self.window:
+                self._calls.popleft()
+            if len(self._calls) >= self.max_calls:
+                return False, self.window - (now - self._calls[0])
+            self._calls.append(now)
+            return True, 0
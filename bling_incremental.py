@@ -0,0 +1,203 @@
+"""
+Varreduras incrementais: só reavalia produtos cujo resumo mudou.
+
+O resumo de cada produto da listagem (GET /produtos) é reduzido a uma
+impressão digital dos campos que influenciam as decisões (código, situação,
+estoque, nome, preço). Se ela é igual à gravada na última avaliação sem erro,
+o produto é pulado. O que não aparece no resumo (categoria, movimentações de
+estoque) é coberto por uma varredura completa periódica.
+
+Junto com a decisão fica o último registro detalhado do produto (snapshot,
+JSON + zlib): um produto pulado entra no dump com ele, e não com o resumo.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+from bling_logger import log
+
+FINGERPRINT_FIELDS = ("codigo", "situacao", "nome", "preco", "estoqueAtual")
+
+# Decisão que nunca é pulada na próxima execução
+DECISION_ERROR = "error"
+
+
+def product_fingerprint(summary, **overrides):
+    """
+    Impressão digital dos campos relevantes do resumo do produto.
+
+    Args:
+        summary: Produto como vem da listagem
+        overrides: Valores aplicados pela própria execução (ex.: codigo novo,
+            situacao="I"), para que a próxima listagem não pareça uma mudança
+    """
+    fields = {name: summary.get(name) for name in FINGERPRINT_FIELDS}
+    stock = summary.get("estoque") or {}
+    fields["saldoVirtualTotal"] = stock.get("saldoVirtualTotal")
+    fields.update(overrides)
+    raw = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def encode_snapshot(product):
+    raw = json.dumps(product, ensure_ascii=False, separators=(",", ":"), default=str)
+    return zlib.compress(raw.encode("utf-8"))
+
+
+def decode_snapshot(value):
+    return json.loads(zlib.decompress(value)) if value else None
+
+
+class ProductStateTracker:
+    """Estado por produto de um escopo ("dump", "monitor") entre execuções."""
+
+    def __init__(self, db, scope, full_sweep_hours=None, batch_size=200):
+        """
+        Args:
+            db: Instância de BlingDatabase
+            scope: Nome do escopo (cada script tem suas próprias decisões)
+            full_sweep_hours: Intervalo da varredura completa; 0 = sempre completa
+                (padrão: env FULL_SWEEP_HOURS ou 24)
+            batch_size: Estados acumulados antes de gravar
+        """
+        self.db = db
+        self.scope = scope
+        if full_sweep_hours is None:
+            full_sweep_hours = float(os.getenv("FULL_SWEEP_HOURS", 24))
+        self.full_sweep_hours = full_sweep_hours
+        self.batch_size = batch_size
+
+        self.full_sweep = True
+        self.skipped = 0
+        self.recorded = 0
+        self._pending = []
+        # Snapshots dos produtos pulados, até serem gravados no dump
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def begin(self, force_full=False):
+        """
+        Decide se a execução é completa ou incremental.
+
+        Returns:
+            True se todos os produtos devem ser avaliados
+        """
+        self.skipped = 0
+        self.recorded = 0
+        last = self.db.get_scan_state(self.scope)["last_full_sweep_at"]
+
+        if force_full:
+            reason = "solicitada"
+        elif self.full_sweep_hours <= 0:
+            reason = "modo incremental desativado"
+        elif last is None:
+            reason = "nenhuma varredura completa anterior"
+        elif time.time() - last >= self.full_sweep_hours * 3600:
+            reason = f"última há {(time.time() - last) / 3600:.1f}h"
+        else:
+            reason = None
+
+        self.full_sweep = reason is not None
+        if self.full_sweep:
+            log.info(f"🔁 Varredura completa ({reason})")
+        else:
+            log.info(
+                f"⚡ Varredura incremental (completa a cada {self.full_sweep_hours:g}h; "
+                f"última há {(time.time() - last) / 3600:.1f}h)"
+            )
+        return self.full_sweep
+
+    def unchanged(self, summaries):
+        """
+        IDs dos produtos que podem ser pulados (uma consulta por lote).
+
+        Args:
+            summaries: Produtos como vêm da listagem
+        """
+        if self.full_sweep or not summaries:
+            return set()
+
+        states = self.db.get_product_states(self.scope, [p["id"] for p in summaries])
+        skip = set()
+        snapshots = {}
+        for summary in summaries:
+            state = states.get(summary["id"])
+            if (
+                state is not None
+                and state["decision"] != DECISION_ERROR
+                and state["fingerprint"] == product_fingerprint(summary)
+            ):
+                skip.add(summary["id"])
+                if state["snapshot"]:
+                    snapshots[summary["id"]] = state["snapshot"]
+
+        with self._lock:
+            self.skipped += len(skip)
+            self._snapshots.update(snapshots)
+        return skip
+
+    def snapshot(self, product_id):
+        """
+        Último registro detalhado de um produto pulado (consumido na leitura).
+
+        Returns:
+            Dict do produto, ou None se não houver (estado gravado antes dos
+            snapshots: o chamador usa o resumo)
+        """
+        with self._lock:
+            value = self._snapshots.pop(product_id, None)
+        return decode_snapshot(value)
+
+    def record(self, summary, decision, stock=None, snapshot=None, **overrides):
+        """
+        Registra a avaliação de um produto (gravada em lotes).
+
+        Args:
+            summary: Produto como veio da listagem
+            decision: Resumo da decisão (DECISION_ERROR força reavaliação)
+            stock: Estoque considerado na decisão
+            snapshot: Registro detalhado gravado no dump (reusado quando o
+                produto for pulado)
+            overrides: Campos alterados pela execução (ver product_fingerprint)
+        """
+        row = (
+            summary["id"],
+            product_fingerprint(summary, **overrides),
+            decision,
+            stock,
+            encode_snapshot(snapshot) if snapshot is not None else None,
+        )
+        with self._lock:
+            self._pending.append(row)
+            self.recorded += 1
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._pending = self._pending, []
+        self.db.save_product_states(self.scope, rows)
+
+    def finish(self, completed=True):
+        """
+        Grava os estados pendentes e o fim da execução.
+
+        Args:
+            completed: A listagem foi percorrida até o fim (só então uma
+                varredura completa conta como tal)
+        """
+        self.flush()
+        self.db.mark_scan_run(self.scope, full_sweep=self.full_sweep and completed)
+
+    def stats(self):
+        return {
+            "scope": self.scope,
+            "full_sweep": self.full_sweep,
+            "skipped_unchanged": self.skipped,
+            "recorded": self.recorded,
+        }
@@ -0,0 +1,267 @@
+"""
+Diário de execuções em lote (retomada após queda).
+
+Cada varredura é uma linha em batch_runs; o run_journal registra, por
+execução, as páginas concluídas (junto com seus produtos e o offset do dump
+sincronizado) e cada escrita aplicada na API. Uma execução que não terminou
+("running", "failed" ou "incomplete", quando o orçamento acabou) é retomada
+pela próxima: páginas e produtos concluídos não são processados de novo e
+ações já aplicadas não são repetidas.
+
+Tipos de entrada (kind -> ref):
+    page              -> número da página
+    product           -> ID do produto (gravado com a página ou no checkpoint)
+    code_reserved     -> ID do produto/variação; detail = código reservado
+    code_applied      -> ID do produto/variação; detail = código gravado na API
+    deactivated       -> ID do produto
+    page_merged       -> página cujo arquivo (varredura em shards) já foi
+                         copiado para o dump
+"""
+
+import json
+import sys
+import threading
+import time
+
+from bling_logger import log
+
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+INCOMPLETE = "incomplete"
+ABANDONED = "abandoned"
+
+# Status retomados pela próxima execução do escopo
+RESUMABLE = (RUNNING, FAILED, INCOMPLETE)
+
+
+class RunJournal:
+    """Execução em lote de um escopo, com diário persistente no SQLite."""
+
+    def __init__(self, db, scope):
+        """
+        Args:
+            db: Instância de BlingDatabase
+            scope: Nome do escopo ("dump", ...); uma execução aberta por escopo
+        """
+        self.db = db
+        self.scope = scope
+        self.run_id = None
+        self.resumed = False
+        self.dump_path = None
+        self.dump_offset = None
+        self.done_pages = set()
+        self.done_products = set()
+        self._actions = {}  # (kind, ref) -> detail
+        self._lock = threading.Lock()
+
+    def open(self, dump_path=None, resume=True):
+        """
+        Retoma a última execução não concluída do escopo ou inicia uma nova.
+
+        Args:
+            dump_path: Arquivo de dump desta execução
+            resume: False abandona a execução pendente e começa do zero
+
+        Returns:
+            self
+        """
+        with self.db._get_connection() as conn:
+            row = conn.execute(
+                """
+                SELECT run_id, dump_path, dump_offset FROM batch_runs
+                WHERE scope = ? AND status IN (?, ?, ?)
+                ORDER BY run_id DESC LIMIT 1
+            """,
+                (self.scope,) + RESUMABLE,
+            ).fetchone()
+
+        if row and resume:
+            self.run_id = row["run_id"]
+            self.resumed = True
+            self.dump_path = row["dump_path"]
+            self.dump_offset = row["dump_offset"]
+            self._load()
+            self.db._write(self._set_status_op, self.run_id, RUNNING, None, None)
+            log.info(
+                f"♻️  Retomando execução #{self.run_id}: "
+                f"{len(self.done_pages)} páginas e {len(self.done_products)} "
+                f"produtos já concluídos, {len(self._actions)} ações registradas"
+            )
+            return self
+
+        if row:
+            self.db._write(self._set_status_op, row["run_id"], ABANDONED, None, None)
+            log.info(f"🗑️  Execução #{row['run_id']} abandonada, iniciando do zero")
+
+        self.dump_path = dump_path
+        self.run_id = self.db._write(self._start_op, self.scope, dump_path)
+        log.info(f"🆕 Execução #{self.run_id} iniciada")
+        return self
+
+    def attach(self, run_id):
+        """
+        Acompanha uma execução aberta por outro processo (worker de uma
+        varredura em shards): carrega o diário sem mudar o status.
+        """
+        self.run_id = run_id
+        self.resumed = True
+        return self.reload()
+
+    def reload(self):
+        """Relê o diário do banco (inclui o que outros processos gravaram)."""
+        with self._lock:
+            self.done_pages.clear()
+            self.done_products.clear()
+            self._actions.clear()
+        self._load()
+        return self
+
+    def _load(self):
+        with self.db._get_connection() as conn:
+            rows = conn.execute(
+                "SELECT kind, ref, detail FROM run_journal WHERE run_id = ?",
+                (self.run_id,),
+            ).fetchall()
+        for row in rows:
+            if row["kind"] == "page":
+                self.done_pages.add(row["ref"])
+            elif row["kind"] == "product":
+                self.done_products.add(row["ref"])
+            else:
+                self._actions[(row["kind"], row["ref"])] = row["detail"]
+
+    # === Consultas (memória) ===
+
+    def action(self, kind, ref):
+        """Detalhe de uma ação registrada (None se não houver)."""
+        return self._actions.get((kind, ref))
+
+    def has_action(self, kind, ref):
+        return (kind, ref) in self._actions
+
+    # === Registro ===
+
+    def record_actions(self, entries):
+        """
+        Registra ações aplicadas (aguarda o COMMIT antes de retornar).
+
+        Args:
+            entries: Lista de (kind, ref, detail)
+        """
+        if not entries:
+            return
+        rows = [(self.run_id, kind, int(ref), detail) for kind, ref, detail in entries]
+        self.db._write(self._record_op, rows, time.time())
+        with self._lock:
+            for kind, ref, detail in entries:
+                self._actions[(kind, int(ref))] = detail
+
+    def record_action(self, kind, ref, detail=None):
+        self.record_actions([(kind, ref, detail)])
+
+    def page_done(self, page, product_ids, dump_offset=None):
+        """Página concluída: produtos e offset do dump em uma transação."""
+        self.checkpoint(product_ids, dump_offset, page=page)
+
+    def checkpoint(self, product_ids, dump_offset=None, page=None, actions=()):
+        """
+        Produtos concluídos (e a página, se houver) com o offset do dump, na
+        mesma transação das ações (kind, ref, detail) recebidas.
+        """
+        rows = [(self.run_id, "page", page, None)] if page is not None else []
+        rows.extend((self.run_id, "product", int(pid), None) for pid in product_ids)
+        rows.extend((self.run_id, kind, int(ref), detail) for kind, ref, detail in actions)
+        self.db._write(self._page_done_op, self.run_id, rows, time.time(), dump_offset)
+        with self._lock:
+            if page is not None:
+                self.done_pages.add(page)
+            self.done_products.update(int(pid) for pid in product_ids)
+            for kind, ref, detail in actions:
+                self._actions[(kind, int(ref))] = detail
+        if dump_offset is not None:
+            self.dump_offset = dump_offset
+
+    def finish(self, status=COMPLETED, stats=None):
+        """
+        Encerra a execução: COMPLETED, ou FAILED/INCOMPLETE (que a próxima
+        execução retoma).
+        """
+        self.db._write(
+            self._set_status_op,
+            self.run_id,
+            status,
+            json.dumps(stats, ensure_ascii=False) if stats else None,
+            time.time() if status == COMPLETED else None,
+        )
+
+    # === Operações SQL ===
+
+    @staticmethod
+    def _start_op(conn, scope, dump_path):
+        now = time.time()
+        cursor = conn.execute(
+            """
+            INSERT INTO batch_runs (scope, status, started_at, updated_at, dump_path)
+            VALUES (?, ?, ?, ?, ?)
+        """,
+            (scope, RUNNING, now, now, dump_path),
+        )
+        return cursor.lastrowid
+
+    @staticmethod
+    def _set_status_op(conn, run_id, status, stats_json, finished_at):
+        conn.execute(
+            """
+            UPDATE batch_runs
+            SET status = ?, stats = COALESCE(?, stats), finished_at = ?, updated_at = ?
+            WHERE run_id = ?
+        """,
+            (status, stats_json, finished_at, time.time(), run_id),
+        )
+
+    @staticmethod
+    def _record_op(conn, rows, now):
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO run_journal (run_id, kind, ref, detail, recorded_at)
+            VALUES (?, ?, ?, ?, ?)
+        """,
+            [row + (now,) for row in rows],
+        )
+
+    @staticmethod
+    def _page_done_op(conn, run_id, rows, now, dump_offset):
+        RunJournal._record_op(conn, rows, now)
+        conn.execute(
+            """
+            UPDATE batch_runs SET dump_offset = COALESCE(?, dump_offset), updated_at = ?
+            WHERE run_id = ?
+        """,
+            (dump_offset, now, run_id),
+        )
+
+
+def list_runs(db, scope=None, limit=20):
+    """Últimas execuções (para inspeção pela linha de comando)."""
+    query = "SELECT * FROM batch_runs"
+    params = ()
+    if scope:
+        query += " WHERE scope = ?"
+        params = (scope,)
+    query += " ORDER BY run_id DESC LIMIT ?"
+    with db._get_connection() as conn:
+        return [dict(row) for row in conn.execute(query, params + (limit,))]
+
+
+if __name__ == "__main__":
+    # Uso: python bling_journal.py [escopo]
+    from bling_db import BlingDatabase
+
+    scope = sys.argv[1] if len(sys.argv) > 1 else None
+    for run in list_runs(BlingDatabase(), scope):
+        started = time.strftime("%Y-%m-%d %H:%M", time.localtime(run["started_at"]))
+        print(
+            f"#{run['run_id']:<5} {run['scope']:<8} {run['status']:<10} "
+            f"{started}  offset={run['dump_offset']}  {run['stats'] or ''}"
+        )
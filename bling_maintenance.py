@@ -0,0 +1,85 @@
+"""
+Agendador de manutenção periódica do banco (arquivamento, ANALYZE, vacuum, integridade)
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bling_logger import log
+
+
+class MaintenanceScheduler:
+    """Thread em background que executa BlingDatabase.run_maintenance periodicamente."""
+
+    def __init__(self, db, interval_hours=24, initial_delay_minutes=10, archive=True):
+        """
+        Args:
+            db: Instância de BlingDatabase
+            interval_hours: Intervalo entre execuções
+            initial_delay_minutes: Espera antes da primeira execução
+            archive: Arquiva linhas antigas a cada execução
+        """
+        self.db = db
+        self.interval = interval_hours * 3600
+        self.initial_delay = initial_delay_minutes * 60
+        self.archive = archive
+        self.last_report = None
+        self.last_run_at = None
+        self.last_error = None
+        self.next_run_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Inicia a thread de manutenção (idempotente)."""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._thread = threading.Thread(
+            target=self._run, name="bling-db-maintenance", daemon=True
+        )
+        self._thread.start()
+        log.info(
+            f"🧹 Manutenção agendada a cada {self.interval / 3600:.1f}h "
+            f"(primeira em {self.initial_delay / 60:.0f} min)"
+        )
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run_now(self):
+        """Executa a manutenção imediatamente (na thread chamadora)."""
+        try:
+            self.last_report = self.db.run_maintenance(archive=self.archive)
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            log.error(f"❌ Erro na manutenção do banco: {e}")
+        self.last_run_at = datetime.now()
+        return self.last_report
+
+    def status(self):
+        """Resumo da última execução (para /health)."""
+        report = self.last_report or {}
+        return {
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "next_run_at": self.next_run_at.isoformat() if self.next_run_at else None,
+            "last_error": self.last_error,
+            "file_size": report.get("file_size"),
+            "archive_size": report.get("archive_size"),
+            "integrity": report.get("integrity"),
+            "full_scans": report.get("full_scans"),
+        }
+
+    def _run(self):
+        delay = self.initial_delay
+        while True:
+            self.next_run_at = datetime.now() + timedelta(seconds=delay)
+            if self._stop.wait(delay):
+                return
+
+            started = time.monotonic()
+            self.run_now()
+            # Próxima execução conta a partir do início desta
+            delay = max(self.interval - (time.monotonic() - started), 60)
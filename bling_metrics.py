@@ -0,0 +1,251 @@
+"""
+Métricas em memória (contadores, gauges e histogramas) compartilhadas entre módulos
+"""
+
+import bisect
+import threading
+
+# Buckets padrão (segundos) para latências
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _label_key(labels):
+    """Normaliza labels (kwargs) em tupla ordenada e hashable."""
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Counter:
+    """Contador monotônico com labels opcionais."""
+
+    def __init__(self, name, help_text=""):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        self._inc(_label_key(labels), amount)
+
+    def _inc(self, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def labels(self, **labels):
+        """Série com labels fixos (evita normalizar os labels a cada inc em laços quentes)."""
+        return _BoundCounter(self, _label_key(labels))
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: value for key, value in self._values.items()}
+
+
+class _BoundCounter:
+    """Série de um Counter com labels já normalizados."""
+
+    def __init__(self, counter, key):
+        self._counter = counter
+        self._key = key
+
+    def inc(self, amount=1):
+        self._counter._inc(self._key, amount)
+
+
+class Gauge:
+    """Valor instantâneo (pode subir ou descer)."""
+
+    def __init__(self, name, help_text=""):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: value for key, value in self._values.items()}
+
+
+class Histogram:
+    """Histograma com buckets fixos, soma e contagem por conjunto de labels."""
+
+    def __init__(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> {"counts": [...], "sum": float, "count": int}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self._series[key] = series
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def quantile(self, q, **labels):
+        """Estimativa de quantil por interpolação linear dentro do bucket."""
+        series = self._series.get(_label_key(labels))
+        if not series or not series["count"]:
+            return None
+
+        target = q * series["count"]
+        cumulative = 0
+        lower = 0.0
+        for i, count in enumerate(series["counts"]):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if count and cumulative + count >= target:
+                fraction = (target - cumulative) / count
+                return lower + (upper - lower) * fraction
+            cumulative += count
+            lower = upper
+        return self.buckets[-1]
+
+    def summary(self, **labels):
+        """Resumo legível (count, média, p50, p95, p99)."""
+        series = self._series.get(_label_key(labels))
+        if not series or not series["count"]:
+            return {"count": 0, "avg": None, "p50": None, "p95": None, "p99": None}
+
+        return {
+            "count": series["count"],
+            "avg": series["sum"] / series["count"],
+            "p50": self.quantile(0.50, **labels),
+            "p95": self.quantile(0.95, **labels),
+            "p99": self.quantile(0.99, **labels),
+        }
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                key: {
+                    "counts": list(series["counts"]),
+                    "sum": series["sum"],
+                    "count": series["count"],
+                }
+                for key, series in self._series.items()
+            }
+
+
+class MetricsRegistry:
+    """Registro central de métricas (get-or-create por nome)."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, help_text, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Métrica {name} já registrada com outro tipo")
+            return metric
+
+    def counter(self, name, help_text=""):
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name, help_text=""):
+        return self._get_or_create(Gauge, name, help_text)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+
+# Content-Type do formato texto de exposição do Prometheus
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+def render_prometheus(registry=None):
+    """
+    Renderiza as métricas no formato texto de exposição do Prometheus.
+
+    Histogramas viram séries _bucket (cumulativas, com le="+Inf"), _sum e _count.
+    """
+    registry = registry or _registry
+    lines = []
+
+    for metric in sorted(registry.metrics(), key=lambda m: m.name):
+        if isinstance(metric, Counter):
+            kind = "counter"
+        elif isinstance(metric, Gauge):
+            kind = "gauge"
+        else:
+            kind = "histogram"
+
+        if metric.help:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {kind}")
+
+        if kind != "histogram":
+            for key, value in sorted(metric.snapshot().items()):
+                lines.append(f"{metric.name}{_format_labels(key)} {_format_value(value)}")
+            continue
+
+        for key, series in sorted(metric.snapshot().items()):
+            cumulative = 0
+            bounds = list(metric.buckets) + [float("inf")]
+            for bound, count in zip(bounds, series["counts"]):
+                cumulative += count
+                labels = _format_labels(key, [("le", _format_value(float(bound)))])
+                lines.append(f"{metric.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(key)
+            lines.append(f"{metric.name}_sum{labels} {_format_value(series['sum'])}")
+            lines.append(f"{metric.name}_count{labels} {series['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+# Instância global do registro
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    """Retorna o registro global de métricas."""
+    return _registry
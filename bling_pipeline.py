@@ -0,0 +1,322 @@
+"""
+Pipeline em estágios com filas limitadas entre eles.
+
+Cada estágio tem N threads que consomem da fila de entrada, aplicam a função
+do estágio e repassam o resultado à fila do próximo. As filas limitadas fazem
+a contrapressão: um estágio lento segura os anteriores em vez de acumular
+itens em memória. O fim da entrada é propagado por sentinelas, estágio a
+estágio, depois que todos os workers do estágio anterior terminam.
+"""
+
+import queue
+import threading
+import time
+
+from bling_logger import log
+from bling_metrics import get_registry
+
+metrics = get_registry()
+stage_item_seconds = metrics.histogram(
+    "bling_pipeline_stage_seconds", "Tempo de processamento de cada item por estágio"
+)
+stage_items = metrics.counter(
+    "bling_pipeline_items_total", "Itens processados por estágio e resultado"
+)
+
+# Marca de fim da entrada (uma por worker do estágio)
+_END = object()
+
+
+class Stage:
+    """Um estágio do pipeline: função, concorrência e fila de entrada."""
+
+    def __init__(
+        self, name, func, workers=1, queue_size=100, fan_out=False,
+        batch_size=1, batch_delay=0.5, on_error=None,
+    ):
+        """
+        Args:
+            name: Nome do estágio (threads, logs e relatório)
+            func: Callable(item) -> item | None; com batch_size > 1 recebe a lista
+            workers: Threads do estágio
+            queue_size: Limite da fila de entrada
+            fan_out: O retorno é um iterável e cada elemento segue adiante
+            batch_size: Itens agrupados por chamada de func
+            batch_delay: Espera máxima (s) para completar um lote
+            on_error: Callable(item, erro) chamado quando func levanta; o
+                retorno segue adiante como se fosse o de func (sem ele, o
+                item é descartado)
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.fan_out = fan_out
+        self.batch_size = max(1, int(batch_size))
+        self.batch_delay = batch_delay
+        self.on_error = on_error
+
+        self.items_in = 0
+        self.items_out = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.max_queue = 0
+        self.started_at = None
+        self.finished_at = None
+        self._remaining = self.workers
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """Vazão e tempos do estágio."""
+        end = self.finished_at or time.monotonic()
+        wall = max(end - (self.started_at or end), 1e-9)
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "errors": self.errors,
+            "wall_seconds": round(wall, 3),
+            "busy_seconds": round(self.busy_seconds, 3),
+            "items_per_second": round(self.items_in / wall, 2),
+            "ms_per_item": round(self.busy_seconds * 1000 / max(self.items_in, 1), 2),
+            "utilization": round(self.busy_seconds / (wall * self.workers), 4),
+            "max_queue": self.max_queue,
+        }
+
+
+class Pipeline:
+    """Encadeia estágios e executa uma fonte de itens até o fim."""
+
+    def __init__(self, name="pipeline"):
+        self.name = name
+        self.stages = []
+        self._stop_source = threading.Event()
+        self.started_at = None
+        self.finished_at = None
+
+    def add_stage(self, name, func, **options):
+        """Adiciona um estágio ao fim do pipeline (ver Stage para as opções)."""
+        self.stages.append(Stage(name, func, **options))
+        return self
+
+    def stop(self):
+        """Para de consumir a fonte; itens já em andamento terminam normalmente."""
+        self._stop_source.set()
+
+    def stopped(self):
+        return self._stop_source.is_set()
+
+    def run(self, source):
+        """
+        Executa o pipeline até a fonte acabar (ou stop()) e as filas esvaziarem.
+
+        Args:
+            source: Iterável com os itens de entrada do primeiro estágio
+
+        Returns:
+            Lista com as estatísticas de cada estágio
+        """
+        if not self.stages:
+            raise ValueError("Pipeline sem estágios")
+
+        self._stop_source.clear()
+        self.started_at = time.monotonic()
+        threads = [
+            threading.Thread(
+                target=self._feed, args=(source,), name=f"{self.name}-source",
+                daemon=True,
+            )
+        ]
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._work,
+                        args=(index,),
+                        name=f"{self.name}-{stage.name}-{n}",
+                        daemon=True,
+                    )
+                )
+        for thread in threads:
+            thread.start()
+
+        try:
+            # join com timeout mantém o Ctrl+C responsivo
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+            raise
+        finally:
+            self.finished_at = time.monotonic()
+
+        return self.stats()
+
+    def stats(self):
+        return [stage.stats() for stage in self.stages]
+
+    def log_report(self):
+        """Registra no log a vazão e os tempos de cada estágio."""
+        elapsed = (self.finished_at or time.monotonic()) - (self.started_at or 0)
+        log_stage_stats(self.stats(), elapsed)
+
+    # ------------------------------------------------------------------
+    # Threads
+    # ------------------------------------------------------------------
+
+    def _feed(self, source):
+        first = self.stages[0]
+        try:
+            for item in source:
+                if self._stop_source.is_set():
+                    break
+                self._put(first, item)
+        except Exception as e:
+            log.error(f"❌ Erro na fonte do pipeline {self.name}: {e}")
+        finally:
+            for _ in range(first.workers):
+                first.queue.put(_END)
+
+    def _work(self, index):
+        stage = self.stages[index]
+        following = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        with stage._lock:
+            if stage.started_at is None:
+                stage.started_at = time.monotonic()
+
+        batch = []
+        while True:
+            if batch:
+                try:
+                    item = stage.queue.get(timeout=stage.batch_delay)
+                except queue.Empty:
+                    self._process(stage, following, batch)
+                    batch = []
+                    continue
+            else:
+                item = stage.queue.get()
+
+            if item is _END:
+                break
+            if stage.batch_size > 1:
+                batch.append(item)
+                if len(batch) >= stage.batch_size:
+                    self._process(stage, following, batch)
+                    batch = []
+            else:
+                self._process(stage, following, item)
+
+        if batch:
+            self._process(stage, following, batch)
+
+        # O último worker a sair repassa o fim ao próximo estágio
+        with stage._lock:
+            stage._remaining -= 1
+            last = stage._remaining == 0
+            if last:
+                stage.finished_at = time.monotonic()
+        if last and following is not None:
+            for _ in range(following.workers):
+                following.queue.put(_END)
+
+    def _process(self, stage, following, item):
+        count = len(item) if stage.batch_size > 1 else 1
+        started = time.perf_counter()
+        outcome = "ok"
+        outputs = ()
+        try:
+            outputs = self._outputs(stage, stage.func(item))
+        except Exception as e:
+            outcome = "error"
+            log.error(f"❌ Erro no estágio {stage.name}: {e}")
+            if stage.on_error is not None:
+                try:
+                    outputs = self._outputs(stage, stage.on_error(item, e))
+                except Exception as handler_error:
+                    log.error(
+                        f"❌ Erro no tratamento de falha do estágio {stage.name}: "
+                        f"{handler_error}"
+                    )
+
+        elapsed = time.perf_counter() - started
+        with stage._lock:
+            stage.items_in += count
+            stage.busy_seconds += elapsed
+            if outcome == "error":
+                stage.errors += 1
+        stage_item_seconds.observe(elapsed / count, pipeline=self.name, stage=stage.name)
+        stage_items.inc(count, pipeline=self.name, stage=stage.name, outcome=outcome)
+
+        produced = 0
+        for output in outputs:
+            produced += 1
+            if following is not None:
+                self._put(following, output)
+        if produced:
+            with stage._lock:
+                stage.items_out += produced
+
+    @staticmethod
+    def _outputs(stage, result):
+        if result is None:
+            return ()
+        if stage.fan_out or stage.batch_size > 1:
+            return result
+        return (result,)
+
+    @staticmethod
+    def _put(stage, item):
+        stage.queue.put(item)
+        size = stage.queue.qsize()
+        if size > stage.max_queue:
+            stage.max_queue = size
+
+
+def log_stage_stats(stats, elapsed):
+    """Relatório por estágio (de um pipeline ou de vários, já somados)."""
+    log.info(f"--- Pipeline ({elapsed:.1f}s) ---")
+    for s in stats:
+        log.info(
+            f"⚙️  {s['stage']:<8} x{s['workers']}: "
+            f"{s['items_in']} → {s['items_out']} itens, {s['errors']} erros, "
+            f"{s['items_per_second']:.1f} it/s, {s['ms_per_item']:.1f} ms/it, "
+            f"ocupação {s['utilization']:.0%}, fila máx {s['max_queue']}"
+        )
+
+
+def merge_stage_stats(runs, elapsed, parallel=1):
+    """
+    Soma os stats() de várias execuções do mesmo pipeline (ex.: um por shard).
+
+    Args:
+        runs: Lista de retornos de Pipeline.stats()
+        elapsed: Tempo total (s) das execuções
+        parallel: Execuções simultâneas (processos), para a ocupação
+    """
+    merged = {}
+    for stats in runs:
+        for s in stats:
+            m = merged.setdefault(
+                s["stage"],
+                {"stage": s["stage"], "workers": 0, "items_in": 0, "items_out": 0,
+                 "errors": 0, "busy_seconds": 0.0, "max_queue": 0},
+            )
+            m["workers"] = max(m["workers"], s["workers"])
+            for key in ("items_in", "items_out", "errors", "busy_seconds"):
+                m[key] += s[key]
+            m["max_queue"] = max(m["max_queue"], s["max_queue"])
+
+    wall = max(elapsed, 1e-9)
+    result = []
+    for m in merged.values():
+        m["wall_seconds"] = round(wall, 3)
+        m["busy_seconds"] = round(m["busy_seconds"], 3)
+        m["items_per_second"] = round(m["items_in"] / wall, 2)
+        m["ms_per_item"] = round(m["busy_seconds"] * 1000 / max(m["items_in"], 1), 2)
+        m["utilization"] = round(
+            m["busy_seconds"] / (wall * m["workers"] * max(parallel, 1)), 4
+        )
+        result.append(m)
+    return result
@@ -0,0 +1,892 @@
+"""
+Fila durável de eventos webhook no bling_data.db (lease/ack, at-least-once).
+
+Fluxo:
+    enqueue  -> linha 'pending' gravada (COMMIT confirmado antes de responder)
+    lease    -> linha passa a 'leased' até lease_until (visibility timeout)
+    ack      -> linha removida da fila e registrada em processed_events
+    nack     -> linha volta a 'pending' (opcionalmente com atraso)
+
+Leases vencidos (worker travado/processo morto) voltam a ficar disponíveis, e
+na inicialização todos os leases do processo anterior são liberados (replay).
+
+Prioridade: cada evento cai em uma faixa (lane) — novos produtos (geração de
+código, visível para a equipe) em "high", atualizações em "normal" e estoque
+em "low". O lease reparte as vagas entre as faixas por round-robin ponderado,
+e eventos que esperam além de max_wait são servidos primeiro (anti-inanição).
+
+Coalescência: eventos de estoque/produto do mesmo produto que chegam enquanto
+outro ainda está pendente substituem o anterior (o substituído é registrado
+em processed_events). Eventos com data anterior ao último estado aplicado
+para o produto são descartados como obsoletos.
+"""
+
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+from bling_logger import log
+from bling_metrics import get_registry
+
+metrics = get_registry()
+enqueue_latency = metrics.histogram(
+    "bling_queue_enqueue_seconds", "Latência de enqueue durável (até o COMMIT)"
+)
+queue_events = metrics.counter(
+    "bling_queue_events_total", "Eventos da fila durável por operação"
+)
+cache_lookups = metrics.counter(
+    "bling_cache_lookups_total", "Consultas a caches em memória por resultado"
+)
+
+# Família de coalescência por tipo de evento (mesmo produto + família = mesma chave)
+COALESCE_FAMILIES = {
+    "stock.updated": "stock",
+    "product.created": "product",
+    "product.updated": "product",
+}
+
+# Tipos que aguardam a janela de debounce antes de ficarem disponíveis
+DEBOUNCED_TYPES = {"stock.updated", "product.updated"}
+
+# Faixa de prioridade por tipo de evento (demais tipos: "normal")
+EVENT_LANES = {
+    "product.created": "high",
+    "product.updated": "normal",
+    "stock.updated": "low",
+}
+LANE_RANK = {"high": 0, "normal": 1, "low": 2}
+DEFAULT_LANE_WEIGHTS = {"high": 6, "normal": 3, "low": 1}
+
+lane_wait = metrics.histogram(
+    "bling_queue_wait_seconds",
+    "Espera na fila (recebimento até lease) por faixa de prioridade",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+
+
+def parse_lane_weights(value):
+    """Converte "high:6,normal:3,low:1" em dict (faixas ausentes usam o padrão)."""
+    weights = dict(DEFAULT_LANE_WEIGHTS)
+    for part in (value or "").split(","):
+        if ":" in part:
+            lane, weight = part.split(":", 1)
+            weights[lane.strip()] = max(1, int(weight))
+    return weights
+
+
+class LaneScheduler:
+    """Round-robin ponderado suave entre faixas, com proteção contra inanição."""
+
+    def __init__(self, weights=None, max_wait=60):
+        """
+        Args:
+            weights: dict faixa -> peso (padrão DEFAULT_LANE_WEIGHTS)
+            max_wait: Segundos de espera a partir dos quais o evento passa na frente
+        """
+        self.weights = weights or dict(DEFAULT_LANE_WEIGHTS)
+        self.max_wait = max_wait
+        self._credits = {lane: 0 for lane in self.weights}
+
+    def pick(self, candidates, limit, now):
+        """
+        Escolhe até `limit` eventos entre os candidatos de cada faixa.
+
+        Args:
+            candidates: dict faixa -> lista de linhas prontas (mais antigas primeiro)
+            limit: Quantidade máxima a escolher
+            now: Epoch atual
+
+        Returns:
+            Lista de linhas na ordem de entrega
+        """
+        queues = {lane: list(rows) for lane, rows in candidates.items() if rows}
+        chosen = []
+
+        # 1. Anti-inanição: eventos esperando além de max_wait, mais antigos primeiro
+        starving = sorted(
+            (
+                row
+                for rows in queues.values()
+                for row in rows
+                if now - row["enqueued_at"] >= self.max_wait
+            ),
+            key=lambda row: row["enqueued_at"],
+        )
+        for row in starving[:limit]:
+            chosen.append(row)
+            queues[row["lane"]].remove(row)
+
+        # 2. Round-robin ponderado suave entre as faixas com eventos
+        while len(chosen) < limit:
+            active = [lane for lane, rows in queues.items() if rows]
+            if not active:
+                break
+            total = 0
+            for lane in active:
+                weight = self.weights.get(lane, 1)
+                self._credits[lane] = self._credits.get(lane, 0) + weight
+                total += weight
+            lane = max(active, key=lambda name: self._credits[name])
+            self._credits[lane] -= total
+            chosen.append(queues[lane].pop(0))
+
+        return chosen
+
+
+def event_product_id(payload):
+    """ID do produto de um payload de webhook (produto ou estoque)."""
+    data = payload.get("data", {})
+    return data.get("id") or data.get("produto", {}).get("id")
+
+
+def event_timestamp(payload, default=None):
+    """Data do evento (campo "date" do Bling) em epoch; default se ausente/inválida."""
+    value = payload.get("date")
+    if not value:
+        return default
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return default
+    if parsed.tzinfo is None:
+        parsed = parsed.astimezone()  # Sem fuso: assume horário local
+    return parsed.astimezone(timezone.utc).timestamp()
+
+
+class DurableEventQueue:
+    """Fila persistente em SQLite com semântica de lease/ack."""
+
+    def __init__(
+        self,
+        db,
+        visibility_timeout=300,
+        coalesce_window=2.0,
+        stale_margin=2.0,
+        lane_scheduler=None,
+        max_attempts=8,
+        retry_base_delay=30,
+        retry_max_delay=3600,
+    ):
+        """
+        Args:
+            db: Instância de BlingDatabase (usa o write-behind se ativo)
+            visibility_timeout: Segundos até um lease não confirmado expirar
+            coalesce_window: Debounce (s) de eventos de estoque/atualização
+            stale_margin: Tolerância (s) de relógio ao comparar com o estado aplicado
+            lane_scheduler: LaneScheduler (padrão: pesos DEFAULT_LANE_WEIGHTS)
+            max_attempts: Tentativas antes de mover o evento para dead_letters
+            retry_base_delay: Espera (s) após a 1ª falha; dobra a cada tentativa
+            retry_max_delay: Teto (s) da espera entre tentativas
+        """
+        self.db = db
+        self.lanes = lane_scheduler or LaneScheduler()
+        self.visibility_timeout = visibility_timeout
+        self.coalesce_window = coalesce_window
+        self.stale_margin = stale_margin
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self._available = threading.Event()
+        self._applied = {}  # (product_id, família) -> applied_ts
+        self._applied_lock = threading.Lock()
+        self._depth = None  # Profundidade mantida em memória (evita COUNT(*))
+        self._depth_lock = threading.Lock()
+
+    # === Produtor ===
+
+    def enqueue(self, payload, delay=0):
+        """
+        Grava o evento na fila e aguarda a confirmação do COMMIT. Um evento
+        pendente do mesmo produto/família é substituído (coalescência).
+
+        Returns:
+            "queued", "coalesced" ou "duplicate" (eventId já na fila)
+        """
+        started = time.perf_counter()
+        now = time.time()
+        event_type = payload.get("event")
+        product_id = event_product_id(payload)
+
+        family = COALESCE_FAMILIES.get(event_type)
+        coalesce_key = f"{family}:{product_id}" if family and product_id else None
+        if event_type in DEBOUNCED_TYPES:
+            delay = max(delay, self.coalesce_window)
+
+        status = self.db._write(
+            self._enqueue_op,
+            payload.get("eventId"),
+            event_type,
+            product_id,
+            json.dumps(payload),
+            now + delay,
+            coalesce_key,
+            event_timestamp(payload, default=now),
+            EVENT_LANES.get(event_type, "normal"),
+            key=("queue", payload.get("eventId")),
+        )
+
+        enqueue_latency.observe(time.perf_counter() - started)
+        queue_events.inc(op="received")
+        queue_events.inc(op=status)
+        if status == "queued":
+            self._adjust_depth(1)
+        if status != "duplicate":
+            self._available.set()
+        return status
+
+    @staticmethod
+    def _enqueue_op(
+        conn, event_id, event_type, product_id, payload_json, available_at,
+        coalesce_key, event_ts, lane,
+    ):
+        now = time.time()
+        previous = None
+        if coalesce_key:
+            previous = conn.execute(
+                """
+                SELECT event_id, available_at, lane FROM event_queue
+                WHERE coalesce_key = ? AND status = 'pending'
+                ORDER BY available_at LIMIT 1
+            """,
+                (coalesce_key,),
+            ).fetchone()
+
+        cursor = conn.execute(
+            """
+            INSERT OR IGNORE INTO event_queue
+            (event_id, event_type, product_id, payload, status, attempts,
+             enqueued_at, available_at, coalesce_key, event_ts, lane)
+            VALUES (?, ?, ?, ?, 'pending', 0, ?, ?, ?, ?, ?)
+        """,
+            (
+                event_id, event_type, product_id, payload_json, now,
+                available_at, coalesce_key, event_ts, lane,
+            ),
+        )
+        if cursor.rowcount == 0:
+            return "duplicate"
+
+        if not previous:
+            return "queued"
+
+        # Substitui o pendente: herda a disponibilidade (a janela não se estende)
+        # e a faixa de maior prioridade (ex.: created seguido de updated)
+        if LANE_RANK.get(previous["lane"], 1) < LANE_RANK.get(lane, 1):
+            lane = previous["lane"]
+        conn.execute(
+            "UPDATE event_queue SET available_at = ?, lane = ? WHERE event_id = ?",
+            (min(previous["available_at"], available_at), lane, event_id),
+        )
+        DurableEventQueue._ack_op(conn, previous["event_id"])
+        return "coalesced"
+
+    # === Consumidor ===
+
+    def lease(self, limit=10):
+        """
+        Reserva até `limit` eventos disponíveis (pendentes ou com lease vencido),
+        repartidos entre as faixas de prioridade pelo LaneScheduler.
+
+        Returns:
+            Lista de dicts {event_id, lane, attempts, enqueued_at, event_ts, payload}
+        """
+        leased = self.db._write(
+            self._lease_op, limit, self.visibility_timeout, self.lanes
+        )
+        now = time.time()
+        for item in leased:
+            lane_wait.observe(now - item["enqueued_at"], lane=item["lane"])
+        return leased
+
+    @staticmethod
+    def _lease_op(conn, limit, visibility_timeout, lanes):
+        now = time.time()
+        candidates = {}
+        for lane in lanes.weights:
+            candidates[lane] = conn.execute(
+                """
+                SELECT event_id, lane, attempts, enqueued_at, event_ts, payload
+                FROM event_queue
+                WHERE lane = ? AND (
+                    (status = 'pending' AND available_at <= ?)
+                    OR (status = 'leased' AND lease_until < ?)
+                )
+                ORDER BY available_at, rowid
+                LIMIT ?
+            """,
+                (lane, now, now, limit),
+            ).fetchall()
+
+        # Eventos esperando além de max_wait, mesmo fora do topo da sua faixa
+        starving = conn.execute(
+            """
+            SELECT event_id, lane, attempts, enqueued_at, event_ts, payload
+            FROM event_queue
+            WHERE status = 'pending' AND available_at <= ? AND enqueued_at <= ?
+            ORDER BY available_at, rowid
+            LIMIT ?
+        """,
+            (now, now - lanes.max_wait, limit),
+        ).fetchall()
+        for row in starving:
+            rows = candidates.setdefault(row["lane"], [])
+            if all(r["event_id"] != row["event_id"] for r in rows):
+                rows.append(row)
+
+        leased = []
+        for row in lanes.pick(candidates, limit, now):
+            conn.execute(
+                """
+                UPDATE event_queue
+                SET status = 'leased', lease_until = ?, attempts = attempts + 1
+                WHERE event_id = ?
+            """,
+                (now + visibility_timeout, row["event_id"]),
+            )
+            leased.append(
+                {
+                    "event_id": row["event_id"],
+                    "lane": row["lane"],
+                    "attempts": row["attempts"] + 1,
+                    "enqueued_at": row["enqueued_at"],
+                    "event_ts": row["event_ts"],
+                    "payload": json.loads(row["payload"]),
+                }
+            )
+        return leased
+
+    def depth_by_lane(self):
+        """Eventos na fila por faixa de prioridade."""
+        with self.db._get_connection() as conn:
+            rows = conn.execute(
+                "SELECT lane, COUNT(*) AS count FROM event_queue GROUP BY lane"
+            ).fetchall()
+        return {row["lane"]: row["count"] for row in rows}
+
+    def lane_stats(self):
+        """Profundidade e espera (p50/p95/p99) por faixa."""
+        depth = self.depth_by_lane()
+        return {
+            lane: {
+                "weight": weight,
+                "depth": depth.get(lane, 0),
+                "wait_seconds": lane_wait.summary(lane=lane),
+            }
+            for lane, weight in self.lanes.weights.items()
+        }
+
+    def ack(self, event_id, wait=False, stale=False, resolution=None):
+        """
+        Confirma o processamento: remove da fila e registra em processed_events.
+
+        Args:
+            resolution: Origem dos dados usados na decisão ("local" ou "api")
+        """
+        queue_events.inc(op="stale" if stale else "ack")
+        self._adjust_depth(-1)
+        return self.db._write(
+            self._ack_op, event_id, resolution, key=("event", event_id), wait=wait
+        )
+
+    @staticmethod
+    def _ack_op(conn, event_id, resolution=None):
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO processed_events
+            (event_id, event_type, product_id, processed_at, payload, resolution)
+            SELECT event_id, event_type, product_id, ?, payload, ?
+            FROM event_queue WHERE event_id = ?
+        """,
+            (datetime.now().isoformat(), resolution, event_id),
+        )
+        conn.execute("DELETE FROM event_queue WHERE event_id = ?", (event_id,))
+
+    def nack(self, event_id, error=None, delay=0, wait=False):
+        """Devolve o evento à fila (disponível novamente após `delay` segundos)."""
+        queue_events.inc(op="nack")
+        return self.db._write(
+            self._nack_op, event_id, str(error) if error else None, delay, wait=wait
+        )
+
+    @staticmethod
+    def _nack_op(conn, event_id, error, delay):
+        conn.execute(
+            """
+            UPDATE event_queue
+            SET status = 'pending', available_at = ?, lease_until = NULL,
+                last_error = ?
+            WHERE event_id = ?
+        """,
+            (time.time() + delay, error, event_id),
+        )
+
+    # === Retentativas e dead letters ===
+
+    def retry_delay(self, attempts):
+        """Backoff exponencial com jitter (±20%) para a tentativa `attempts`."""
+        delay = min(
+            self.retry_base_delay * 2 ** max(attempts - 1, 0), self.retry_max_delay
+        )
+        return delay * random.uniform(0.8, 1.2)
+
+    def fail(self, item, error, retry_after=None):
+        """
+        Registra a falha de um evento reservado: devolve à fila com backoff ou,
+        esgotadas as tentativas, move para dead_letters. Nunca bloqueia o worker.
+
+        Args:
+            item: Evento retornado por lease()
+            retry_after: Espera mínima (s) sugerida pela API (ex.: 429)
+
+        Returns:
+            ("retry", segundos) ou ("dead_letter", None)
+        """
+        event_id = item["event_id"]
+        if item["attempts"] >= self.max_attempts:
+            queue_events.inc(op="dead_letter")
+            self._adjust_depth(-1)
+            self.db._write(
+                self._dead_letter_op, event_id, str(error), key=("queue", event_id)
+            )
+            log.error(
+                f"☠️  Evento {event_id} movido para dead letters após "
+                f"{item['attempts']} tentativas: {error}"
+            )
+            return "dead_letter", None
+
+        delay = max(self.retry_delay(item["attempts"]), retry_after or 0)
+        self.nack(event_id, error=error, delay=delay)
+        return "retry", delay
+
+    @staticmethod
+    def _dead_letter_op(conn, event_id, error):
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO dead_letters
+            (event_id, event_type, product_id, payload, attempts, last_error,
+             enqueued_at, failed_at)
+            SELECT event_id, event_type, product_id, payload, attempts, ?,
+                   enqueued_at, ?
+            FROM event_queue WHERE event_id = ?
+        """,
+            (error, time.time(), event_id),
+        )
+        conn.execute("DELETE FROM event_queue WHERE event_id = ?", (event_id,))
+
+    def dead_letters(self, limit=100, event_type=None):
+        """Eventos em dead_letters (mais recentes primeiro)."""
+        query = """
+            SELECT event_id, event_type, product_id, attempts, last_error,
+                   enqueued_at, failed_at, payload
+            FROM dead_letters
+        """
+        params = []
+        if event_type:
+            query += " WHERE event_type = ?"
+            params.append(event_type)
+        query += " ORDER BY failed_at DESC LIMIT ?"
+        params.append(limit)
+
+        with self.db._get_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def dead_letter_count(self):
+        with self.db._get_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+    def replay_dead_letters(self, event_ids=None, event_type=None):
+        """
+        Devolve dead letters à fila (tentativas zeradas, disponíveis já).
+
+        Args:
+            event_ids: IDs específicos (None = todos, respeitando event_type)
+            event_type: Filtra por tipo de evento
+
+        Returns:
+            Quantidade de eventos reenfileirados
+        """
+        replayed = self.db._write(
+            self._replay_op, list(event_ids) if event_ids else None, event_type
+        )
+        if replayed:
+            self._adjust_depth(replayed)
+            self._available.set()
+            log.info(f"🔁 {replayed} dead letters devolvidos à fila")
+        return replayed
+
+    @staticmethod
+    def _replay_op(conn, event_ids, event_type):
+        query = "SELECT * FROM dead_letters"
+        conditions, params = [], []
+        if event_ids:
+            conditions.append(f"event_id IN ({','.join('?' * len(event_ids))})")
+            params.extend(event_ids)
+        if event_type:
+            conditions.append("event_type = ?")
+            params.append(event_type)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        now = time.time()
+        replayed = 0
+        for row in conn.execute(query, params).fetchall():
+            payload = json.loads(row["payload"])
+            family = COALESCE_FAMILIES.get(row["event_type"])
+            product_id = row["product_id"]
+            cursor = conn.execute(
+                """
+                INSERT OR IGNORE INTO event_queue
+                (event_id, event_type, product_id, payload, status, attempts,
+                 enqueued_at, available_at, coalesce_key, event_ts, lane)
+                VALUES (?, ?, ?, ?, 'pending', 0, ?, ?, ?, ?, ?)
+            """,
+                (
+                    row["event_id"],
+                    row["event_type"],
+                    product_id,
+                    row["payload"],
+                    now,
+                    now,
+                    f"{family}:{product_id}" if family and product_id else None,
+                    event_timestamp(payload, default=now),
+                    EVENT_LANES.get(row["event_type"], "normal"),
+                ),
+            )
+            conn.execute(
+                "DELETE FROM dead_letters WHERE event_id = ?", (row["event_id"],)
+            )
+            replayed += cursor.rowcount
+        return replayed
+
+    def recover(self):
+        """
+        Libera os leases deixados pelo processo anterior (reinício/crash) para
+        que os eventos sejam reprocessados.
+
+        Returns:
+            Quantidade de eventos pendentes após a recuperação
+        """
+        released = self.db._write(self._recover_op)
+        pending = self.depth()
+        with self._depth_lock:
+            self._depth = pending
+        if pending:
+            log.info(
+                f"♻️  Fila durável: {pending} eventos pendentes a reprocessar "
+                f"({released} leases liberados)"
+            )
+            self._available.set()
+        return pending
+
+    @staticmethod
+    def _recover_op(conn):
+        cursor = conn.execute(
+            """
+            UPDATE event_queue SET status = 'pending', lease_until = NULL
+            WHERE status = 'leased'
+        """
+        )
+        return cursor.rowcount
+
+    # === Estado aplicado (descarte de eventos obsoletos) ===
+
+    def _applied_ts(self, product_id, family):
+        key = (product_id, family)
+        if key in self._applied:
+            cache_lookups.inc(cache="applied_state", result="hit")
+        else:
+            cache_lookups.inc(cache="applied_state", result="miss")
+            with self.db._get_connection() as conn:
+                row = conn.execute(
+                    """
+                    SELECT applied_ts FROM product_event_state
+                    WHERE product_id = ? AND family = ?
+                """,
+                    key,
+                ).fetchone()
+            with self._applied_lock:
+                self._applied.setdefault(key, row["applied_ts"] if row else 0)
+        return self._applied[key]
+
+    def is_stale(self, item):
+        """
+        Verifica se o evento é anterior ao último estado já aplicado para o
+        produto (o processamento posterior já buscou um estado mais novo).
+        """
+        payload = item["payload"]
+        family = COALESCE_FAMILIES.get(payload.get("event"))
+        product_id = event_product_id(payload)
+        if not family or not product_id or item.get("event_ts") is None:
+            return False
+        applied_ts = self._applied_ts(product_id, family)
+        return item["event_ts"] < applied_ts - self.stale_margin
+
+    def mark_applied(self, item, applied_ts):
+        """
+        Registra que o estado do produto foi lido/aplicado em applied_ts
+        (início do processamento, antes da consulta à API; ou o horário do
+        evento, quando a decisão usou só os dados do payload).
+        """
+        payload = item["payload"]
+        family = COALESCE_FAMILIES.get(payload.get("event"))
+        product_id = event_product_id(payload)
+        if not family or not product_id:
+            return
+
+        key = (product_id, family)
+        with self._applied_lock:
+            if applied_ts <= self._applied.get(key, 0):
+                return
+            self._applied[key] = applied_ts
+
+        self.db._write(
+            self._mark_applied_op, product_id, family, applied_ts, wait=False
+        )
+
+    @staticmethod
+    def _mark_applied_op(conn, product_id, family, applied_ts):
+        conn.execute(
+            """
+            INSERT INTO product_event_state (product_id, family, applied_ts)
+            VALUES (?, ?, ?)
+            ON CONFLICT(product_id, family)
+            DO UPDATE SET applied_ts = MAX(applied_ts, excluded.applied_ts)
+        """,
+            (product_id, family, applied_ts),
+        )
+
+    def stats(self):
+        """Contadores de eventos recebidos x trabalho efetivamente executado."""
+        ops = (
+            "received", "queued", "coalesced", "duplicate", "stale", "ack", "nack",
+            "dead_letter",
+        )
+        stats = {op: queue_events.value(op=op) for op in ops}
+        stats["executed"] = stats["ack"] + stats["nack"]
+        return stats
+
+    def depth(self):
+        """Quantidade de eventos na fila (pendentes + em processamento)."""
+        with self.db._get_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM event_queue").fetchone()[0]
+
+    def sync_depth(self, depth):
+        """Corrige a profundidade em memória com uma contagem exata recente."""
+        with self._depth_lock:
+            self._depth = depth
+
+    def approx_depth(self):
+        """Profundidade mantida em memória (consulta o banco só na primeira vez)."""
+        if self._depth is None:
+            depth = self.depth()
+            with self._depth_lock:
+                if self._depth is None:
+                    self._depth = depth
+        return self._depth
+
+    def _adjust_depth(self, delta):
+        with self._depth_lock:
+            if self._depth is not None:
+                self._depth = max(0, self._depth + delta)
+
+    def wait_for_events(self, timeout):
+        """Bloqueia até um enqueue sinalizar novos eventos (ou até o timeout)."""
+        signaled = self._available.wait(timeout)
+        self._available.clear()
+        return signaled
+
+
+class BackpressureController:
+    """
+    Controle de admissão com histerese sobre a profundidade da fila.
+
+    Ao atingir high_watermark entra em modo de descarte e só sai quando a fila
+    volta a low_watermark. No modo "reject", eventos fora da faixa "high" são
+    recusados (HTTP 503 + Retry-After, o Bling reenvia depois); a faixa "high"
+    continua aceita até hard_limit. No modo "spill" tudo continua sendo
+    gravado na fila em disco (nada fica em RAM) e só as métricas registram a
+    saturação. Nos dois modos, um backlog do escritor em memória acima de
+    writer_limit também recusa o evento.
+    """
+
+    def __init__(
+        self,
+        high_watermark=5000,
+        low_watermark=2000,
+        hard_limit=None,
+        mode="reject",
+        writer_limit=5000,
+    ):
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.hard_limit = hard_limit or high_watermark * 2
+        self.mode = mode
+        self.writer_limit = writer_limit
+        self.shedding = False
+        self._lock = threading.Lock()
+
+        self._shed = metrics.counter(
+            "bling_webhook_shed_total", "Webhooks recusados por sobrecarga"
+        )
+        self._depth_gauge = metrics.gauge(
+            "bling_queue_depth", "Eventos na fila durável"
+        )
+        self._shedding_gauge = metrics.gauge(
+            "bling_webhook_shedding", "1 enquanto o descarte por sobrecarga está ativo"
+        )
+
+    def admit(self, lane, depth, writer_backlog=0):
+        """
+        Decide se um evento pode ser aceito.
+
+        Returns:
+            (aceitar: bool, motivo: str)
+        """
+        self._depth_gauge.set(depth)
+
+        with self._lock:
+            if not self.shedding and depth >= self.high_watermark:
+                self.shedding = True
+                log.warning(
+                    f"⚠️  Fila saturada ({depth} eventos): descarte ativado "
+                    f"(modo {self.mode})"
+                )
+            elif self.shedding and depth <= self.low_watermark:
+                self.shedding = False
+                log.info(f"✅ Fila normalizada ({depth} eventos): descarte desativado")
+            self._shedding_gauge.set(1 if self.shedding else 0)
+
+        if writer_backlog >= self.writer_limit:
+            return self._reject(lane, "writer_backlog")
+
+        if not self.shedding or self.mode == "spill":
+            return True, "ok"
+
+        if lane == "high" and depth < self.hard_limit:
+            return True, "priority"
+
+        return self._reject(lane, "queue_saturated")
+
+    def _reject(self, lane, reason):
+        self._shed.inc(lane=lane, reason=reason)
+        return False, reason
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "shedding": self.shedding,
+            "high_watermark": self.high_watermark,
+            "low_watermark": self.low_watermark,
+            "hard_limit": self.hard_limit,
+            "shed": {
+                "/".join(v for _, v in key): count
+                for key, count in self._shed.snapshot().items()
+            },
+        }
+
+
+class QueueDispatcher:
+    """
+    Thread que reserva eventos da fila durável e os entrega ao pool de workers,
+    mantendo no máximo `max_inflight` eventos em memória.
+    """
+
+    def __init__(self, event_queue, pool, key_func, max_inflight=10, poll_interval=1.0):
+        self.event_queue = event_queue
+        self.pool = pool
+        self.key_func = key_func
+        self.max_inflight = max_inflight
+        self.poll_interval = poll_interval
+        self._inflight = 0
+        self._inflight_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return self
+        self._thread = threading.Thread(
+            target=self._run, name="event-dispatcher", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def is_running(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def inflight(self):
+        return self._inflight
+
+    def done(self):
+        """Chamado pelo worker ao terminar (ack ou nack) um evento."""
+        with self._inflight_lock:
+            self._inflight -= 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            capacity = self.max_inflight - self._inflight
+            if capacity <= 0:
+                time.sleep(0.05)
+                continue
+
+            try:
+                leased = self.event_queue.lease(limit=capacity)
+            except Exception as e:
+                log.error(f"❌ Erro ao reservar eventos da fila: {e}")
+                time.sleep(self.poll_interval)
+                continue
+
+            if not leased:
+                self.event_queue.wait_for_events(self.poll_interval)
+                continue
+
+            for item in leased:
+                with self._inflight_lock:
+                    self._inflight += 1
+                self.pool.submit(item, key=self.key_func(item["payload"]))
+
+
+if __name__ == "__main__":
+    import sys
+
+    from bling_db import BlingDatabase
+
+    usage = (
+        "Uso: python bling_queue.py dead-letters [tipo]\n"
+        "     python bling_queue.py replay (--all | <event_id>...) [--type tipo]"
+    )
+    args = sys.argv[1:]
+    event_type = None
+    if "--type" in args:
+        index = args.index("--type")
+        event_type = args[index + 1] if index + 1 < len(args) else None
+        del args[index:index + 2]
+
+    store = DurableEventQueue(BlingDatabase())
+
+    if args[:1] == ["dead-letters"]:
+        event_type = event_type or (args[1] if len(args) > 1 else None)
+        letters = store.dead_letters(limit=1000, event_type=event_type)
+        for letter in letters:
+            failed_at = datetime.fromtimestamp(letter["failed_at"]).isoformat(
+                timespec="seconds"
+            )
+            print(
+                f"{letter['event_id']}  {letter['event_type']:<16} "
+                f"produto={letter['product_id']}  tentativas={letter['attempts']}  "
+                f"{failed_at}  {letter['last_error']}"
+            )
+        print(f"{len(letters)} dead letters")
+    elif args[:1] == ["replay"] and (args[1:] or event_type):
+        ids = None if args[1:] in ([], ["--all"]) else args[1:]
+        print(f"{store.replay_dead_letters(event_ids=ids, event_type=event_type)} "
+              "eventos devolvidos à fila")
+    else:
+        print(usage)
@@ -0,0 +1,312 @@
+"""
+Agendador adaptativo de ciclos periódicos (monitor de estoque zerado).
+
+O intervalo até o próximo ciclo parte de MINUTES_BETWEEN_RUNS e se ajusta a:
+    - taxa de mudanças observada: mira MONITOR_TARGET_CHANGES mudanças por
+      ciclo (muitas mudanças encurtam o intervalo; nenhuma o estende até o
+      máximo), limitada a [MONITOR_MIN_MINUTES, MONITOR_MAX_MINUTES];
+    - cota diária restante: o monitor usa no máximo MONITOR_QUOTA_SHARE do
+      que sobra da cota até o reset, pelo custo médio de um ciclo;
+    - duração do ciclo anterior: o intervalo é ao menos
+      DURATION_FACTOR vezes a duração, contado a partir do fim do ciclo.
+Um jitter (MONITOR_JITTER) evita ciclos sincronizados entre instâncias.
+
+Um ciclo nunca se sobrepõe a outro: no mesmo processo há um lock, e entre
+processos (test.py separado + monitor embutido no webhook_server) um lease
+na tabela scheduler_state. A próxima execução e o motivo do intervalo são
+publicados na mesma tabela (visíveis no /stats de qualquer processo) e
+sobrevivem a reinícios.
+"""
+
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime
+
+from bling_logger import log
+from bling_metrics import get_registry
+
+metrics = get_registry()
+interval_gauge = metrics.gauge(
+    "bling_scheduler_interval_seconds", "Intervalo escolhido até o próximo ciclo"
+)
+cycles_total = metrics.counter(
+    "bling_scheduler_cycles_total", "Ciclos da agenda por resultado"
+)
+
+# Intervalo mínimo em relação à duração do último ciclo
+DURATION_FACTOR = 2.0
+# Peso da última medição na média móvel da taxa de mudanças e do custo
+EWMA_ALPHA = 0.5
+# Lease entre processos: ao menos isto, ou 3x a duração do último ciclo
+LEASE_SECONDS = 2 * 3600
+
+
+class AdaptiveScheduler:
+    """Executa um ciclo repetidamente, com intervalo adaptativo e sem sobreposição."""
+
+    def __init__(
+        self, cycle, name="monitor", db=None, rate_limiter=None,
+        base_minutes=None, min_minutes=None, max_minutes=None,
+        target_changes=None, quota_share=None, jitter=None,
+        initial_delay_minutes=0,
+    ):
+        """
+        Args:
+            cycle: Callable() -> dict do ciclo; usa as chaves "changes" (itens
+                que mudaram desde o ciclo anterior) e "api_calls"
+            name: Nome da agenda (lease e estado publicado em scheduler_state)
+            db: BlingDatabase para lease/publicação (None = só neste processo)
+            rate_limiter: Limitador da BlingAPI (fonte da cota diária restante)
+            base_minutes: Intervalo sem histórico (env MINUTES_BETWEEN_RUNS ou 60)
+            min_minutes / max_minutes: Faixa do ajuste pela taxa de mudanças
+                (env MONITOR_MIN_MINUTES ou 10 / MONITOR_MAX_MINUTES ou 240)
+            target_changes: Mudanças desejadas por ciclo
+                (env MONITOR_TARGET_CHANGES ou 20)
+            quota_share: Fração da cota restante que os ciclos podem usar
+                (env MONITOR_QUOTA_SHARE ou 0.25)
+            jitter: Variação aleatória relativa do intervalo (env MONITOR_JITTER
+                ou 0.1)
+            initial_delay_minutes: Espera antes do primeiro ciclo, se não houver
+                próxima execução publicada
+        """
+        self.cycle = cycle
+        self.name = name
+        self.db = db
+        self.rate_limiter = rate_limiter
+        self.base = 60 * _setting(base_minutes, "MINUTES_BETWEEN_RUNS", 60)
+        self.min_interval = 60 * _setting(min_minutes, "MONITOR_MIN_MINUTES", 10)
+        self.max_interval = 60 * _setting(max_minutes, "MONITOR_MAX_MINUTES", 240)
+        self.target_changes = _setting(target_changes, "MONITOR_TARGET_CHANGES", 20)
+        self.quota_share = _setting(quota_share, "MONITOR_QUOTA_SHARE", 0.25)
+        self.jitter = _setting(jitter, "MONITOR_JITTER", 0.1)
+        self.initial_delay = initial_delay_minutes * 60
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+
+        self.change_rate = None  # mudanças/hora (média móvel)
+        self.cycle_calls = None  # requisições por ciclo (média móvel)
+        self.last_started_at = None
+        self.last_duration = None
+        self.last_stats = None
+        self.last_error = None
+        self.next_run_at = None
+        self.interval = None
+        self.reasons = []
+        self._running = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # === Execução ===
+
+    def start(self):
+        """Executa os ciclos em uma thread em background (idempotente)."""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._thread = threading.Thread(
+            target=self.run_forever, name=f"bling-scheduler-{self.name}", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self):
+        """Laço da agenda (na thread chamadora) até stop()."""
+        delay = self._initial_delay()
+        while True:
+            self._set_next_run(delay)
+            log.info(
+                f"⏳ Próximo ciclo ({self.name}) às "
+                f"{datetime.fromtimestamp(self.next_run_at):%H:%M:%S} "
+                f"(em {delay / 60:.1f} min: {'; '.join(self.reasons)})"
+            )
+            if self._stop.wait(delay):
+                return
+            delay = self.run_once()
+
+    def _initial_delay(self):
+        """Respeita a próxima execução publicada antes de um reinício."""
+        self.reasons = ["primeiro ciclo"]
+        published = self.db.get_schedule(self.name) if self.db else None
+        if published and published["next_run_at"]:
+            pending = published["next_run_at"] - time.time()
+            if pending > self.initial_delay:
+                self.reasons = ["agenda publicada antes do reinício"]
+                return pending
+        return self.initial_delay
+
+    def run_once(self):
+        """
+        Executa um ciclo (se nenhum outro estiver em andamento) e planeja o próximo.
+
+        Returns:
+            Segundos até o próximo ciclo
+        """
+        if not self._running.acquire(blocking=False):
+            cycles_total.inc(result="overlap")
+            self.reasons = ["ciclo anterior ainda em andamento neste processo"]
+            return self.min_interval
+
+        try:
+            lease = max(LEASE_SECONDS, 3 * (self.last_duration or 0))
+            if self.db and not self.db.acquire_schedule_lease(self.name, self.owner, lease):
+                cycles_total.inc(result="overlap")
+                holder = self.db.get_schedule(self.name) or {}
+                self.reasons = [f"ciclo em andamento em outro processo ({holder.get('owner')})"]
+                log.info(f"⏭️  Ciclo ({self.name}) pulado: {self.reasons[0]}")
+                return self.min_interval
+
+            started = time.time()
+            try:
+                stats = self.cycle() or {}
+                self.last_error = None
+                cycles_total.inc(result="ok")
+            except Exception as e:
+                stats = None
+                self.last_error = f"{type(e).__name__}: {e}"
+                cycles_total.inc(result="error")
+                log.error(f"❌ Erro no ciclo ({self.name}): {e}")
+            finally:
+                if self.db:
+                    self.db.release_schedule_lease(self.name, self.owner)
+
+            previous_start = self.last_started_at
+            self.last_started_at = started
+            self.last_duration = time.time() - started
+            self.last_stats = stats
+            return self.plan(stats, previous_start)
+        finally:
+            self._running.release()
+
+    # === Planejamento ===
+
+    def plan(self, stats, previous_start=None):
+        """
+        Escolhe o intervalo até o próximo ciclo a partir do ciclo que acabou.
+
+        Returns:
+            Segundos até o próximo ciclo (reasons explica a escolha)
+        """
+        reasons = []
+        if stats is None:
+            interval = self.base
+            reasons.append("erro no ciclo: intervalo base")
+        else:
+            self._observe(stats, previous_start)
+            interval, reason = self._change_interval()
+            reasons.append(reason)
+
+        quota_interval, quota_reason = self._quota_interval()
+        if quota_interval is not None and quota_interval > interval:
+            interval = quota_interval
+            reasons.append(quota_reason)
+
+        min_gap = DURATION_FACTOR * (self.last_duration or 0)
+        if min_gap > interval:
+            interval = min_gap
+            reasons.append(f"ciclo anterior levou {self.last_duration / 60:.1f} min")
+
+        if self.jitter:
+            interval *= 1 + random.uniform(-self.jitter, self.jitter)
+        self.interval = interval
+        self.reasons = reasons
+        interval_gauge.set(interval, name=self.name)
+        return interval
+
+    def _observe(self, stats, previous_start):
+        calls = stats.get("api_calls")
+        if calls is not None:
+            self.cycle_calls = _ewma(self.cycle_calls, calls)
+        changes = stats.get("changes")
+        if changes is None or previous_start is None:
+            return
+        hours = max((self.last_started_at - previous_start) / 3600, 1 / 60)
+        self.change_rate = _ewma(self.change_rate, changes / hours)
+
+    def _change_interval(self):
+        """Intervalo para acumular target_changes mudanças por ciclo."""
+        if self.change_rate is None:
+            return self.base, "sem histórico de mudanças: intervalo base"
+        if self.change_rate <= 0:
+            interval, reason = self.max_interval, "nenhuma mudança recente"
+        else:
+            interval = self.target_changes / self.change_rate * 3600
+            reason = f"{self.change_rate:.1f} mudanças/h"
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        return interval, f"{reason} → {interval / 60:.0f} min"
+
+    def _quota_interval(self):
+        """Intervalo mínimo para os ciclos caberem na cota diária restante."""
+        if self.rate_limiter is None or not self.cycle_calls:
+            return None, None
+        remaining, reset_in = self.rate_limiter.daily_quota()
+        cycles_left = remaining * self.quota_share / self.cycle_calls
+        if cycles_left < 1:
+            return reset_in, f"cota diária quase esgotada ({remaining} restantes)"
+        interval = reset_in / cycles_left
+        return interval, (
+            f"cota: {remaining} requisições restantes, ~{self.cycle_calls:.0f} por ciclo"
+        )
+
+    def _set_next_run(self, delay):
+        self.next_run_at = time.time() + delay
+        if self.db:
+            try:
+                self.db.publish_schedule(
+                    self.name, self.next_run_at, "; ".join(self.reasons)
+                )
+            except Exception as e:
+                log.warning(f"⚠️ Não foi possível publicar a agenda ({self.name}): {e}")
+
+    # === Consulta ===
+
+    def status(self):
+        """Estado da agenda (para /stats)."""
+        stats = self.last_stats or {}
+        return {
+            "name": self.name,
+            "running": self._running.locked(),
+            "next_run_at": _iso(self.next_run_at),
+            "interval_minutes": round(self.interval / 60, 1) if self.interval else None,
+            "reasons": self.reasons,
+            "last_started_at": _iso(self.last_started_at),
+            "last_duration_seconds": (
+                round(self.last_duration, 1) if self.last_duration is not None else None
+            ),
+            "last_changes": stats.get("changes"),
+            "last_api_calls": stats.get("api_calls"),
+            "change_rate_per_hour": (
+                round(self.change_rate, 2) if self.change_rate is not None else None
+            ),
+            "last_error": self.last_error,
+        }
+
+
+def published_status(db, name="monitor"):
+    """Próxima execução publicada por outro processo (ex.: test.py separado)."""
+    row = db.get_schedule(name)
+    if not row:
+        return None
+    return {
+        "name": name,
+        "next_run_at": _iso(row["next_run_at"]),
+        "reason": row["reason"],
+        "running_in": row["owner"],
+    }
+
+
+def _setting(value, env, default):
+    return float(os.getenv(env, default)) if value is None else value
+
+
+def _ewma(current, sample):
+    if current is None:
+        return float(sample)
+    return EWMA_ALPHA * sample + (1 - EWMA_ALPHA) * current
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts).isoformat(timespec="seconds") if ts else None
@@ -0,0 +1,271 @@
+"""
+Varredura em shards de páginas distribuídos entre processos.
+
+O coordenador divide a listagem em faixas de páginas (shards) e entrega uma
+por vez a cada processo worker; o fim da listagem é descoberto pelos próprios
+workers (primeira página vazia). Todos os workers usam o mesmo
+SharedRateLimiter, criado aqui: o limite de req/s e a cota diária valem para
+o conjunto, não por processo.
+
+Se um worker morre com um shard em mãos, o shard volta para a fila e um
+processo substituto é iniciado. Refazer um shard é seguro porque o trabalho
+de cada página é registrado no diário da execução (bling_journal) por quem
+o fez.
+"""
+
+import multiprocessing
+import queue
+import time
+from collections import deque
+
+from bling_api import SharedRateLimiter
+from bling_logger import log
+
+# Tentativas de um shard cuja função levantou exceção (não conta quedas)
+SHARD_ATTEMPTS = 2
+
+
+def _worker_main(worker_id, inbox, results, init, init_args, func):
+    """Laço do processo worker: um shard por vez até receber None."""
+    try:
+        context = init(*init_args) if init else None
+    except Exception as e:
+        results.put(("init_error", worker_id, None, f"{type(e).__name__}: {e}"))
+        return
+
+    while True:
+        shard = inbox.get()
+        if shard is None:
+            return
+        try:
+            result = func(shard["pages"], context)
+        except Exception as e:
+            results.put(("error", worker_id, shard, f"{type(e).__name__}: {e}"))
+        else:
+            results.put(("done", worker_id, shard, result))
+
+
+class ShardCoordinator:
+    """Distribui shards de páginas entre processos e junta os resultados."""
+
+    def __init__(
+        self, func, init=None, init_args=(), processes=2, shard_pages=5,
+        budget=None, max_restarts=None, context=None,
+    ):
+        """
+        Args:
+            func: Callable(pages, context) -> dict executado no worker; o dict
+                pode ter "end_page" (primeira página vazia) e "failed"
+            init: Callable(rate_limiter, *init_args) -> context, uma vez por worker
+            init_args: Argumentos extras de init (precisam ser serializáveis)
+            processes: Processos worker simultâneos
+            shard_pages: Páginas por shard
+            budget: RunBudget; esgotado, nenhum shard novo é entregue
+            max_restarts: Workers substitutos permitidos (padrão: 2 por processo)
+            context: Contexto do multiprocessing (padrão: "spawn", igual em
+                todos os sistemas)
+        """
+        self.func = func
+        self.init = init
+        self.init_args = tuple(init_args)
+        self.processes = max(1, int(processes))
+        self.shard_pages = max(1, int(shard_pages))
+        self.budget = budget
+        self.max_restarts = (
+            2 * self.processes if max_restarts is None else max_restarts
+        )
+        self.ctx = context or multiprocessing.get_context("spawn")
+        self.rate_limiter = SharedRateLimiter(context=self.ctx)
+
+        self.results = []
+        self.end_page = None
+        self.failed = False
+        self.incomplete = False
+        self.restarts = 0
+        self.shards_done = 0
+        self.elapsed = 0.0
+
+        self._next_page = 1
+        self._skip_pages = set()
+        self._retry = deque()
+        self._workers = {}  # worker_id -> (processo, inbox)
+        self._assigned = {}  # worker_id -> shard
+        self._worker_ids = iter(range(1, 1_000_000))
+        self._results_queue = None
+
+    # === Execução ===
+
+    def run(self, skip_pages=()):
+        """
+        Executa todos os shards (páginas em skip_pages não são entregues).
+
+        Returns:
+            self (results: lista dos dicts retornados por func)
+        """
+        started = time.monotonic()
+        self._skip_pages = set(skip_pages)
+        self._results_queue = self.ctx.Queue()
+        if self.budget is not None:
+            self.budget.rate_limiter = self.rate_limiter
+            self.budget.start()
+
+        log.info(
+            f"🧩 Varredura em shards: {self.processes} processos, "
+            f"{self.shard_pages} páginas por shard"
+        )
+        for _ in range(self.processes):
+            self._spawn()
+
+        try:
+            while True:
+                self._assign()
+                if not self._assigned:
+                    break
+                self._drain(timeout=1.0)
+                self._check_workers()
+        finally:
+            self._shutdown()
+            self.elapsed = time.monotonic() - started
+
+        # Orçamento esgotado só conta se sobraram páginas sem shard
+        self.incomplete = self.incomplete and (
+            self.end_page is None or self._next_page < self.end_page or bool(self._retry)
+        )
+
+        log.info(
+            f"🧩 Shards concluídos: {self.shards_done}, workers substituídos: "
+            f"{self.restarts}, última página: {self.end_page or '?'}"
+        )
+        return self
+
+    def _spawn(self):
+        worker_id = next(self._worker_ids)
+        inbox = self.ctx.Queue()
+        process = self.ctx.Process(
+            target=_worker_main,
+            args=(
+                worker_id, inbox, self._results_queue, self.init,
+                (self.rate_limiter,) + self.init_args, self.func,
+            ),
+            name=f"shard-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        self._workers[worker_id] = (process, inbox)
+
+    def _next_shard(self):
+        if self.failed:
+            return None
+        if self._retry:
+            return self._retry.popleft()
+        if self.budget is not None and self.budget.exceeded():
+            if not self.incomplete:
+                log.warning(
+                    f"⏳ Orçamento esgotado ({self.budget.exhausted_reason}): "
+                    "nenhum shard novo será iniciado"
+                )
+            self.incomplete = True
+            return None
+
+        while self.end_page is None or self._next_page < self.end_page:
+            first = self._next_page
+            self._next_page += self.shard_pages
+            pages = [
+                page for page in range(first, self._next_page)
+                if page not in self._skip_pages
+            ]
+            if pages:
+                return {"first": first, "pages": pages, "attempts": 0}
+        return None
+
+    def _assign(self):
+        for worker_id, (process, inbox) in list(self._workers.items()):
+            if worker_id in self._assigned:
+                continue
+            shard = self._next_shard()
+            if shard is None:
+                return
+            self._assigned[worker_id] = shard
+            inbox.put(shard)
+
+    def _drain(self, timeout):
+        try:
+            message = self._results_queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while True:
+            self._handle(*message)
+            try:
+                message = self._results_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _handle(self, kind, worker_id, shard, payload):
+        self._assigned.pop(worker_id, None)
+
+        if kind == "done":
+            self.shards_done += 1
+            self.results.append(payload)
+            end_page = payload.get("end_page")
+            if end_page is not None:
+                self.end_page = min(self.end_page or end_page, end_page)
+            if payload.get("failed"):
+                log.error(f"❌ Shard a partir da página {shard['first']} falhou")
+                self.failed = True
+            return
+
+        if kind == "init_error":
+            log.error(f"❌ Worker {worker_id} não iniciou: {payload}")
+            self.failed = True
+            return
+
+        shard["attempts"] += 1
+        log.error(
+            f"❌ Erro no shard a partir da página {shard['first']} "
+            f"(tentativa {shard['attempts']}): {payload}"
+        )
+        if shard["attempts"] < SHARD_ATTEMPTS:
+            self._retry.append(shard)
+        else:
+            self.failed = True
+
+    def _check_workers(self):
+        """Shards de workers mortos voltam para a fila; o worker é substituído."""
+        for worker_id, (process, _) in list(self._workers.items()):
+            if process.is_alive():
+                continue
+            # Resultado enviado logo antes da queda ainda pode estar na fila
+            self._drain(timeout=0.1)
+            del self._workers[worker_id]
+            shard = self._assigned.pop(worker_id, None)
+            log.warning(
+                f"💥 Worker {worker_id} terminou (código {process.exitcode})"
+                + (f"; shard a partir da página {shard['first']} reatribuído"
+                   if shard else "")
+            )
+            if shard:
+                self._retry.appendleft(shard)
+            if self.failed:
+                continue
+            if self.restarts >= self.max_restarts:
+                log.error("❌ Limite de workers substitutos atingido")
+                self.failed = True
+                continue
+            self.restarts += 1
+            self._spawn()
+
+        if not self._workers and (self._assigned or self._retry):
+            self.failed = True
+            self._assigned.clear()
+
+    def _shutdown(self):
+        for process, inbox in self._workers.values():
+            if process.is_alive():
+                inbox.put(None)
+        for process, _ in self._workers.values():
+            process.join(timeout=30)
+            if process.is_alive():
+                log.warning(f"⚠️ Encerrando {process.name} à força")
+                process.terminate()
+                process.join(timeout=5)
+        self._workers.clear()
@@ -1,34 +1,284 @@
 """
 Funções utilitárias compartilhadas entre módulos
 """
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
 from datetime import datetime, timedelta
 from bling_logger import log
+from bling_metrics import get_registry
+
+cache_lookups = get_registry().counter(
+    'bling_cache_lookups_total', 'Consultas a caches em memória por resultado'
+)
+category_hits = cache_lookups.labels(cache='category', result='hit')
+category_misses = cache_lookups.labels(cache='category', result='miss')
+
+# Regras padrão de exclusão (lowercase)
+EXCLUDED_CATEGORIES = frozenset({'notebook', 'sff', 'mini', 'monitor'})
+IGNORE_SUBCATEGORIES = frozenset({'submaquina'})
+
+# Decisões pré-calculadas por categoria (ver compile_decision_table)
+CategoryDecision = namedtuple('CategoryDecision', [
+    'category', 'subcategory', 'full_name',
+    'ignore', 'ignore_reason',
+    'generate', 'generate_reason', 'prefix',
+])
 
 
 class CategoryCache:
-    """Cache de categorias carregadas da API."""
+    """
+    Cache de categorias com warm start pelo SQLite e atualização em background.
     
-    def __init__(self):
+    Leitores nunca bloqueiam: cada atualização monta um dicionário novo e o
+    troca por atribuição (atômica). Categoria ausente dispara uma busca
+    pontual na API em vez de seguir com o nome vazio.
+    """
+    
+    def __init__(self, ttl_minutes=None, miss_retry_seconds=None):
+        """
+        Args:
+            ttl_minutes: Idade máxima da árvore antes de recarregar da API
+                (padrão: env CATEGORY_CACHE_TTL_MINUTES ou 360, lido no load)
+            miss_retry_seconds: Intervalo mínimo entre buscas de um mesmo ID
+                ausente (padrão: env CATEGORY_MISS_RETRY_SECONDS ou 300)
+        """
         self._categories = {}  # ID -> categoria completa
         self._loaded = False
-    
-    def load(self, api):
-        """Carrega todas as categorias da API."""
+        self._loaded_at = None  # time.time() da última carga completa
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._miss_lock = threading.Lock()
+        self._missing = {}  # ID -> time.monotonic() da última busca sem sucesso
+        self._refresh_thread = None
+        self._stop = threading.Event()
+        self._write_lock = threading.Lock()
+        self._decision_tables = {}  # (excluídas, ignoradas) -> (versão, tabela)
+        self.version = 0  # Incrementada a cada alteração do dicionário
+        self.ttl = ttl_minutes * 60 if ttl_minutes is not None else None
+        self.miss_retry = miss_retry_seconds
+        self.api = None
+        self.db = None
+        self.source = None
+        self.refreshes = 0
+        self.targeted_fetches = 0
+        self.last_error = None
+    
+    def load(self, api, db=None):
+        """
+        Carrega as categorias (uma vez, mesmo com vários workers).
+        
+        Com `db`, usa a cópia persistida (warm start) e agenda a atualização
+        em background se ela estiver mais velha que o TTL.
+        """
+        self.api = api
+        if db is not None:
+            self.db = db
+        if self.ttl is None:
+            self.ttl = float(os.getenv('CATEGORY_CACHE_TTL_MINUTES', 360)) * 60
+        if self.miss_retry is None:
+            self.miss_retry = float(os.getenv('CATEGORY_MISS_RETRY_SECONDS', 300))
+        
         if self._loaded:
+            if self.is_stale():
+                self.refresh_async()
             return
         
-        log.info("Carregando cache de categorias...")
-        self._categories = api.get_all_categories()
-        self._loaded = True
+        with self._lock:
+            if self._loaded:
+                return
+            
+            if self.db is not None:
+                categories, fetched_at = self.db.load_categories()
+                if categories:
+                    self._swap(categories, fetched_at, 'db')
+                    log.info(f"✅ {len(categories)} categorias em cache (banco)")
+                    if self.is_stale():
+                        self.refresh_async()
+                    return
+            
+            log.info("Carregando cache de categorias...")
+            self._swap(api.get_all_categories(), time.time(), 'api')
+            self._persist_all()
         log.info(f"✅ {len(self._categories)} categorias em cache")
     
+    def _swap(self, categories, loaded_at, source):
+        with self._write_lock:
+            self._categories = categories
+            self.version += 1
+        self._loaded_at = loaded_at
+        self._loaded = True
+        self._missing = {}
+        self.source = source
+    
+    def _persist_all(self):
+        if self.db is None:
+            return
+        try:
+            self.db.save_categories(self._categories, replace=True)
+        except Exception as e:
+            log.error(f"❌ Erro ao persistir categorias: {e}")
+    
+    def is_stale(self):
+        """Verifica se a árvore carregada passou do TTL."""
+        if self._loaded_at is None:
+            return True
+        return time.time() - self._loaded_at >= self.ttl
+    
+    def refresh(self):
+        """
+        Recarrega todas as categorias da API e troca o dicionário atomicamente.
+        
+        Returns:
+            bool: se o cache foi atualizado (False se já havia um refresh em curso)
+        """
+        if self.api is None or not self._refresh_lock.acquire(blocking=False):
+            return False
+        try:
+            categories = self.api.get_all_categories()
+            if not categories and self._categories:
+                log.warning("⚠️  API retornou 0 categorias, mantendo cache atual")
+                return False
+            self._swap(categories, time.time(), 'api')
+            self._persist_all()
+            self.refreshes += 1
+            self.last_error = None
+            log.info(f"🔄 Cache de categorias atualizado: {len(categories)} categorias")
+            return True
+        except Exception as e:
+            self.last_error = str(e)
+            log.error(f"❌ Erro ao atualizar cache de categorias: {e}")
+            return False
+        finally:
+            self._refresh_lock.release()
+    
+    def refresh_async(self):
+        """Dispara refresh() em uma thread (ignorado se já houver um em curso)."""
+        if self._refresh_lock.locked():
+            return
+        threading.Thread(
+            target=self.refresh, name='category-refresh', daemon=True
+        ).start()
+    
+    def start_auto_refresh(self, interval_minutes=None):
+        """Atualiza a árvore periodicamente (padrão: a cada TTL)."""
+        if self._refresh_thread and self._refresh_thread.is_alive():
+            return self
+        interval = interval_minutes * 60 if interval_minutes else self.ttl
+        
+        def run():
+            while not self._stop.wait(interval):
+                self.refresh()
+        
+        self._refresh_thread = threading.Thread(
+            target=run, name='category-auto-refresh', daemon=True
+        )
+        self._refresh_thread.start()
+        log.info(f"🔄 Categorias recarregadas a cada {interval / 60:.0f} min")
+        return self
+    
+    def stop(self):
+        self._stop.set()
+    
+    def put(self, category):
+        """Insere/atualiza uma categoria (cópia + troca) e persiste."""
+        category_id = category.get('id')
+        if not category_id:
+            return
+        with self._write_lock:
+            categories = dict(self._categories)
+            categories[category_id] = category
+            self._categories = categories
+            self.version += 1
+        self._missing.pop(category_id, None)
+        if self.db is not None:
+            self.db.save_categories({category_id: category})
+    
+    def remove(self, category_id):
+        """Remove uma categoria (cópia + troca) e da cópia persistida."""
+        with self._write_lock:
+            categories = dict(self._categories)
+            if categories.pop(category_id, None) is not None:
+                self._categories = categories
+                self.version += 1
+        if self.db is not None:
+            self.db.delete_category(category_id)
+    
+    def refresh_category(self, category_id):
+        """
+        Busca uma categoria na API e atualiza o cache (None se não existir).
+        
+        Erros da API (429, 5xx, timeout, RetryableAPIError) propagam: só um
+        404 ou uma resposta vazia contam como "categoria inexistente".
+        """
+        if self.api is None:
+            return None
+        try:
+            category = self.api.get_category(category_id).get('data')
+        except Exception as e:
+            if getattr(getattr(e, 'response', None), 'status_code', None) != 404:
+                raise
+            category = None
+        if not category:
+            return None
+        self.put(category)
+        self.targeted_fetches += 1
+        log.info(f"🔎 Categoria {category_id} carregada da API: {category.get('descricao', '')}")
+        return category
+    
+    def apply_event(self, event_type, data):
+        """Aplica um webhook de categoria (created/updated/deleted)."""
+        category_id = data.get('id')
+        if not category_id:
+            return
+        if event_type.endswith('.deleted'):
+            self.remove(category_id)
+            log.info(f"🗑️  Categoria {category_id} removida do cache")
+        elif data.get('descricao'):
+            self.put(data)
+            log.info(f"🔄 Categoria {category_id} atualizada: {data['descricao']}")
+        else:
+            self.refresh_category(category_id)
+    
+    def _fetch_missing(self, category_id):
+        """Busca pontual de uma categoria ausente (limitada por miss_retry)."""
+        if self.api is None or not self._loaded or not category_id:
+            return None
+        
+        last = self._missing.get(category_id)
+        if last is not None and time.monotonic() - last < self.miss_retry:
+            return None
+        
+        with self._miss_lock:
+            # Outro worker pode ter buscado enquanto esperávamos
+            cat = self._categories.get(category_id)
+            if cat is not None:
+                return cat
+            last = self._missing.get(category_id)
+            if last is not None and time.monotonic() - last < self.miss_retry:
+                return None
+            cat = self.refresh_category(category_id)
+            if cat is None:
+                # Só uma resposta "não existe" é lembrada; erros propagam
+                # e a próxima consulta tenta de novo
+                self._missing[category_id] = time.monotonic()
+            return cat
+    
+    def _lookup(self, category_id):
+        cat = self._categories.get(category_id)
+        (category_hits if cat else category_misses).inc()
+        if cat is None:
+            cat = self._fetch_missing(category_id)
+        return cat
+    
     def get_by_id(self, category_id):
         """Obtém categoria por ID."""
-        return self._categories.get(category_id)
+        return self._lookup(category_id)
     
     def get_name(self, category_id):
         """Obtém nome da categoria por ID."""
-        cat = self._categories.get(category_id)
+        cat = self._lookup(category_id)
         
         if not cat:
             return  ''
@@ -44,6 +294,43 @@ class CategoryCache:
     def is_loaded(self):
         """Verifica se cache foi carregado."""
         return self._loaded
+    
+    def decision_table(self, excluded_categories, ignore_subcategories):
+        """
+        Tabela de decisão (ID -> CategoryDecision) compilada para a versão
+        atual do cache; recompilada só quando as categorias mudam.
+        """
+        key = (frozenset(excluded_categories), frozenset(ignore_subcategories))
+        entry = self._decision_tables.get(key)
+        if entry is not None and entry[0] == self.version:
+            return entry[1]
+        
+        # Versão lida antes do dicionário: na corrida, a tabela fica marcada
+        # com a versão antiga e é recompilada na próxima consulta
+        version = self.version
+        table = compile_decision_table(self._categories, *key)
+        self._decision_tables[key] = (version, table)
+        return table
+    
+    def stats(self):
+        """Tamanho, idade e acertos/faltas do cache."""
+        hits = cache_lookups.value(cache='category', result='hit')
+        misses = cache_lookups.value(cache='category', result='miss')
+        return {
+            'loaded': self._loaded,
+            'source': self.source,
+            'size': len(self._categories),
+            'age_seconds': (
+                round(time.time() - self._loaded_at) if self._loaded_at else None
+            ),
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+            'version': self.version,
+            'targeted_fetches': self.targeted_fetches,
+            'refreshes': self.refreshes,
+            'last_error': self.last_error,
+        }
 
 
 # Instância global do cache
@@ -55,6 +342,63 @@ def get_category_cache():
     return _category_cache
 
 
+class ProductSnapshotCache:
+    """
+    Últimos valores conhecidos de campos estáveis de cada produto (código,
+    categoria, situação), vindos de payloads de webhook e de consultas à API.
+    LRU limitado a max_size produtos; entradas expiram após ttl_seconds.
+    """
+    
+    FIELDS = ('codigo', 'categoria', 'situacao')
+    
+    def __init__(self, max_size=20000, ttl_seconds=3600):
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+        self._items = OrderedDict()  # ID -> (observed_at, campos)
+        self._lock = threading.Lock()
+        self._hits = cache_lookups.labels(cache='product', result='hit')
+        self._misses = cache_lookups.labels(cache='product', result='miss')
+    
+    def remember(self, product, observed_at=None):
+        """Registra os campos presentes no produto (observação mais antiga só completa lacunas)."""
+        product_id = product.get('id')
+        fields = {f: product[f] for f in self.FIELDS if f in product}
+        if not product_id or not fields:
+            return
+        observed_at = observed_at or time.time()
+        
+        with self._lock:
+            previous_at, previous = self._items.pop(product_id, (0, {}))
+            if observed_at >= previous_at:
+                merged = {**previous, **fields}
+            else:
+                merged = {**fields, **previous}
+                observed_at = previous_at
+            self._items[product_id] = (observed_at, merged)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+    
+    def get(self, product_id):
+        """Campos conhecidos do produto (None se ausente ou expirado)."""
+        with self._lock:
+            entry = self._items.get(product_id)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                del self._items[product_id]
+                entry = None
+            if entry is not None:
+                self._items.move_to_end(product_id)
+        
+        (self._hits if entry else self._misses).inc()
+        return dict(entry[1]) if entry else None
+    
+    def forget(self, product_id):
+        with self._lock:
+            self._items.pop(product_id, None)
+    
+    def __len__(self):
+        return len(self._items)
+
+
 def extract_category_info(product, category_cache=None):
     """
     Extrai categoria e subcategoria de um produto.
@@ -79,22 +423,70 @@ def extract_category_info(product, category_cache=None):
         # Fallback: tentar obter do próprio produto (pode não existir)
         full_name = cat_info.get('nome', '')
     
+    category, subcategory, full = _split_hierarchy(full_name)
+    return category, subcategory, full, cat_id
+
+
+def _split_hierarchy(full_name):
+    """"Categoria>>Subcategoria" -> (categoria, subcategoria, nome completo)."""
     if not full_name:
-        return None, None, None, cat_id
+        return None, None, None
     
     # Extrair hierarquia (Categoria>>Subcategoria)
     if '>>' in full_name:
         parts = full_name.split('>>')
         category = parts[0].strip()
         subcategory = parts[-1].strip()
-        return category, subcategory, full_name, cat_id
+        return category, subcategory, full_name
     else:
-        return full_name, None, full_name, cat_id
+        return full_name, None, full_name
+
+
+def compile_decision_table(categories, excluded_categories=EXCLUDED_CATEGORIES,
+                           ignore_subcategories=IGNORE_SUBCATEGORIES):
+    """
+    Aplica as regras de ignorar/gerar código uma vez por categoria.
+    
+    Args:
+        categories: Dict ID -> categoria (como em CategoryCache)
+    
+    Returns:
+        Dict ID -> CategoryDecision
+    """
+    table = {}
+    for cat_id, cat in categories.items():
+        full_name = (cat.get('nome', '') or cat.get('descricao', '')) if cat else ''
+        category, subcategory, full = _split_hierarchy(full_name)
+        ignore, ignore_reason = _ignore_decision(
+            category, subcategory, excluded_categories, ignore_subcategories
+        )
+        generate, generate_reason, prefix = _code_decision(category, subcategory)
+        table[cat_id] = CategoryDecision(
+            category, subcategory, full,
+            ignore, ignore_reason,
+            generate, generate_reason, prefix,
+        )
+    return table
+
+
+def _lookup_decision(product, category_cache, excluded_categories, ignore_subcategories):
+    """Decisão pré-compilada da categoria do produto (None = usar o caminho comum)."""
+    if not category_cache:
+        return None
+    cat_info = product.get('categoria')
+    if not isinstance(cat_info, dict) or not cat_info.get('id'):
+        return None
+    
+    table = category_cache.decision_table(excluded_categories, ignore_subcategories)
+    decision = table.get(cat_info['id'])
+    if decision is not None:
+        category_hits.inc()
+    return decision
 
 
 def should_ignore_product(product, category_cache=None,
-                         excluded_categories={'notebook', 'sff', 'mini', 'monitor'}, 
-                         ignore_subcategories={'submaquina'}):
+                         excluded_categories=EXCLUDED_CATEGORIES, 
+                         ignore_subcategories=IGNORE_SUBCATEGORIES):
     """
     Verifica se produto deve ser ignorado baseado em categoria.
     
@@ -107,8 +499,18 @@ def should_ignore_product(product, category_cache=None,
     Returns:
         (should_ignore: bool, reason: str)
     """
-    category, subcategory, full, cat_id = extract_category_info(product, category_cache)
+    decision = _lookup_decision(
+        product, category_cache, excluded_categories, ignore_subcategories
+    )
+    if decision is not None:
+        return decision.ignore, decision.ignore_reason
     
+    category, subcategory, full, cat_id = extract_category_info(product, category_cache)
+    return _ignore_decision(category, subcategory, excluded_categories, ignore_subcategories)
+
+
+def _ignore_decision(category, subcategory, excluded_categories, ignore_subcategories):
+    """Regras de exclusão aplicadas à categoria/subcategoria já extraídas."""
     if not category:
         return False, "Sem categoria ou categoria não encontrada no cache"
     
@@ -123,13 +525,15 @@ def should_ignore_product(product, category_cache=None,
     return False, ""
 
 
-def check_stock_depleted_by_sales(api, product_id):
+def check_stock_depleted_by_sales(api, product_id, raise_errors=False):
     """
     Verifica se o estoque zerou ESPECIFICAMENTE por vendas.
     
     Args:
         api: Instância de BlingAPI
         product_id: ID do produto
+        raise_errors: Se True, erros da consulta (ex.: RetryableAPIError)
+            sobem para o chamador em vez de virar "não zerou"
     
     Returns:
         (is_depleted_by_sales: bool, details: dict)
@@ -186,9 +590,22 @@ def check_stock_depleted_by_sales(api, product_id):
     
     except Exception as e:
         log.error(f"    Erro ao verificar movimentacoes para o produto ID {product_id}: {e}")
+        if raise_errors:
+            raise
         return False, {'reason': f'Erro: {e}', 'entries': 0, 'sales_exits': 0}
 
 
+# Acentos comuns -> letra sem acento (tabela montada uma única vez)
+_ACCENT_TABLE = str.maketrans({
+    'ã': 'a', 'á': 'a', 'à': 'a', 'â': 'a',
+    'é': 'e', 'ê': 'e',
+    'í': 'i',
+    'õ': 'o', 'ó': 'o', 'ô': 'o',
+    'ú': 'u', 'ü': 'u',
+    'ç': 'c'
+})
+
+
 def get_category_prefix(category_name):
     """
     Gera prefixo de código baseado no nome da categoria.
@@ -199,18 +616,7 @@ def get_category_prefix(category_name):
         "Monitor" -> "MONI"
     """
     # Remove acentos comuns
-    replacements = {
-        'ã': 'a', 'á': 'a', 'à': 'a', 'â': 'a',
-        'é': 'e', 'ê': 'e',
-        'í': 'i',
-        'õ': 'o', 'ó': 'o', 'ô': 'o',
-        'ú': 'u', 'ü': 'u',
-        'ç': 'c'
-    }
-    
-    clean_name = category_name.lower()
-    for old, new in replacements.items():
-        clean_name = clean_name.replace(old, new)
+    clean_name = category_name.lower().translate(_ACCENT_TABLE)
     
     parts = clean_name.split()
     
@@ -237,8 +643,18 @@ def should_generate_code(product, category_cache=None):
     if product.get('codigo'):
         return False, "Ja possui codigo", None
     
-    category, subcategory, full, cat_id = extract_category_info(product, category_cache)
+    decision = _lookup_decision(
+        product, category_cache, EXCLUDED_CATEGORIES, IGNORE_SUBCATEGORIES
+    )
+    if decision is not None:
+        return decision.generate, decision.generate_reason, decision.prefix
     
+    category, subcategory, full, cat_id = extract_category_info(product, category_cache)
+    return _code_decision(category, subcategory)
+
+
+def _code_decision(category, subcategory):
+    """Regras de geração de código aplicadas à categoria/subcategoria já extraídas."""
     if not category:
         return False, "Sem categoria ou categoria nao encontrada", None
     
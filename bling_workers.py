@@ -0,0 +1,151 @@
+"""
+Pool de workers com filas particionadas por chave.
+
+Eventos com a mesma chave (ex.: ID do produto) sempre caem na mesma fila e
+são processados em ordem por um único worker; chaves diferentes avançam em
+paralelo. O limite global de requisições continua garantido pelo RateLimiter
+compartilhado da BlingAPI.
+"""
+
+import queue
+import threading
+import time
+import zlib
+
+from bling_logger import log
+from bling_metrics import get_registry
+
+metrics = get_registry()
+worker_busy_seconds = metrics.counter(
+    "bling_worker_busy_seconds_total", "Tempo ocupado de cada worker"
+)
+worker_items = metrics.counter(
+    "bling_worker_items_total", "Itens processados por worker e resultado"
+)
+
+
+class _WorkerState:
+    """Estado e métricas de um worker do pool."""
+
+    def __init__(self, index, maxsize):
+        self.index = index
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = None
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.started_at = time.monotonic()
+        self.current_key = None
+        self.current_since = None
+
+
+class PartitionedWorkerPool:
+    """Pool de N workers, cada um com sua fila FIFO; roteamento por hash da chave."""
+
+    def __init__(self, handler, num_workers=3, queue_size=0, name="worker"):
+        """
+        Args:
+            handler: Callable(item) executado pelos workers
+            num_workers: Quantidade de workers (e de partições)
+            queue_size: Limite de cada fila (0 = ilimitada)
+            name: Prefixo do nome das threads
+        """
+        self.handler = handler
+        self.num_workers = max(1, int(num_workers))
+        self.name = name
+        self._workers = [
+            _WorkerState(i, queue_size) for i in range(self.num_workers)
+        ]
+        self._stop = threading.Event()
+
+    def partition_for(self, key):
+        """Índice da partição (estável entre execuções) para uma chave."""
+        if key is None:
+            return 0
+        if isinstance(key, int):
+            return key % self.num_workers
+        return zlib.crc32(str(key).encode("utf-8")) % self.num_workers
+
+    def start(self):
+        """Inicia as threads dos workers."""
+        for state in self._workers:
+            if state.thread and state.thread.is_alive():
+                continue
+            state.thread = threading.Thread(
+                target=self._run,
+                args=(state,),
+                name=f"{self.name}-{state.index}",
+                daemon=True,
+            )
+            state.thread.start()
+        log.info(f"🔄 {self.num_workers} workers de processamento iniciados")
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def submit(self, item, key=None, block=True, timeout=None):
+        """Enfileira um item na partição da chave."""
+        state = self._workers[self.partition_for(key)]
+        state.queue.put((key, item), block=block, timeout=timeout)
+        return state.index
+
+    def is_running(self):
+        """Todas as threads de worker estão vivas."""
+        return all(state.thread and state.thread.is_alive() for state in self._workers)
+
+    def qsize(self):
+        """Total de itens aguardando em todas as partições."""
+        return sum(state.queue.qsize() for state in self._workers)
+
+    def stats(self):
+        """Métricas por worker: fila, processados, erros e utilização."""
+        now = time.monotonic()
+        workers = []
+        for state in self._workers:
+            busy = state.busy_seconds
+            if state.current_since is not None:
+                busy += now - state.current_since
+            uptime = max(now - state.started_at, 1e-9)
+            workers.append(
+                {
+                    "worker": state.index,
+                    "alive": bool(state.thread and state.thread.is_alive()),
+                    "queue_size": state.queue.qsize(),
+                    "processed": state.processed,
+                    "errors": state.errors,
+                    "utilization": round(busy / uptime, 4),
+                    "current_key": state.current_key,
+                }
+            )
+        return {
+            "num_workers": self.num_workers,
+            "queue_size": sum(w["queue_size"] for w in workers),
+            "workers": workers,
+        }
+
+    def _run(self, state):
+        while not self._stop.is_set():
+            try:
+                key, item = state.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            state.current_key = key
+            state.current_since = time.monotonic()
+            outcome = "ok"
+            try:
+                self.handler(item)
+                state.processed += 1
+            except Exception as e:
+                outcome = "error"
+                state.errors += 1
+                log.error(f"❌ Erro grave no worker {state.index}: {e}")
+            finally:
+                elapsed = time.monotonic() - state.current_since
+                state.busy_seconds += elapsed
+                state.current_key = None
+                state.current_since = None
+                worker_busy_seconds.inc(elapsed, worker=state.index)
+                worker_items.inc(worker=state.index, outcome=outcome)
+                state.queue.task_done()
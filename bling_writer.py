@@ -0,0 +1,277 @@
+"""
+Escritor write-behind para o BlingDatabase.
+
+Uma única thread é dona da conexão de escrita e agrupa as operações
+enfileiradas em transações limitadas por tamanho (max_batch_size) ou por
+tempo (max_delay). Cada operação recebe um WriteTicket que é confirmado
+somente após o COMMIT do lote, permitindo que quem precisa de durabilidade
+aguarde a confirmação.
+"""
+
+import queue
+import threading
+import time
+
+from bling_logger import log
+from bling_metrics import get_registry
+
+metrics = get_registry()
+batch_size_hist = metrics.histogram(
+    "bling_db_write_batch_size",
+    "Operações por transação do escritor write-behind",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+commit_latency_hist = metrics.histogram(
+    "bling_db_write_commit_seconds",
+    "Duração de cada transação do escritor write-behind",
+)
+ack_latency_hist = metrics.histogram(
+    "bling_db_write_ack_seconds",
+    "Tempo entre enfileirar uma escrita e a confirmação do COMMIT",
+)
+db_op_hist = metrics.histogram(
+    "bling_db_op_seconds", "Duração de cada operação no banco (sem o COMMIT)"
+)
+
+
+def op_name(operation):
+    """Nome curto da operação para label de métrica ("_mark_applied_op" -> "mark_applied")."""
+    name = getattr(operation, "__name__", "op").strip("_")
+    return name[:-3] if name.endswith("_op") else name
+
+
+class WriteTicket:
+    """Confirmação de durabilidade de uma operação enfileirada."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.result = None
+        self.error = None
+        self.submitted_at = time.monotonic()
+
+    def _resolve(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        ack_latency_hist.observe(time.monotonic() - self.submitted_at)
+        self._event.set()
+
+    def done(self):
+        """Indica se a operação já foi confirmada (ou falhou)."""
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Aguarda o COMMIT da operação.
+
+        Returns:
+            Valor retornado pela operação
+
+        Raises:
+            TimeoutError: se não confirmada dentro do timeout
+            Exception: erro levantado pela própria operação ou pelo COMMIT
+        """
+        if not self._event.wait(timeout):
+            raise TimeoutError("Escrita não confirmada dentro do prazo")
+        if self.error:
+            raise self.error
+        return self.result
+
+
+class WriteBehindWriter:
+    """Thread única de escrita que agrupa operações em transações."""
+
+    _STOP = object()
+
+    def __init__(self, db, max_batch_size=100, max_delay=0.05, max_queue=10000):
+        """
+        Args:
+            db: Instância de BlingDatabase
+            max_batch_size: Máximo de operações por transação
+            max_delay: Tempo máximo (s) que uma operação espera pelo lote
+            max_queue: Limite da fila de operações pendentes
+        """
+        self.db = db
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending_keys = {}
+        self._pending_lock = threading.Lock()
+        self._thread = None
+
+        # Estatísticas acumuladas
+        self.total_ops = 0
+        self.total_batches = 0
+        self.total_errors = 0
+        self.last_batch_size = 0
+        self.last_commit_ms = 0.0
+
+    def start(self):
+        """Inicia a thread de escrita (idempotente)."""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._thread = threading.Thread(
+            target=self._run, name="bling-db-writer", daemon=True
+        )
+        self._thread.start()
+        log.info(
+            f"💾 Escritor write-behind iniciado (lote máx: {self.max_batch_size}, "
+            f"atraso máx: {self.max_delay * 1000:.0f}ms)"
+        )
+        return self
+
+    def is_running(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def submit(self, operation, *args, key=None, wait=False, timeout=None):
+        """
+        Enfileira uma operação de escrita.
+
+        Args:
+            operation: Callable(conn, *args) executado dentro da transação do lote
+            key: Chave opcional para consultar escritas ainda não confirmadas
+            wait: Se True, bloqueia até o COMMIT e retorna o resultado
+            timeout: Tempo máximo de espera quando wait=True
+
+        Returns:
+            Resultado da operação (wait=True) ou WriteTicket
+        """
+        ticket = WriteTicket()
+        if key is not None:
+            with self._pending_lock:
+                self._pending_keys[key] = self._pending_keys.get(key, 0) + 1
+
+        self._queue.put((operation, args, key, ticket))
+
+        if wait:
+            return ticket.wait(timeout)
+        return ticket
+
+    def is_pending(self, key):
+        """Verifica se há escrita enfileirada (ainda não confirmada) para a chave."""
+        with self._pending_lock:
+            return key in self._pending_keys
+
+    def flush(self, timeout=None):
+        """Aguarda até que todas as operações enfileiradas até agora sejam confirmadas."""
+        return self.submit(lambda conn: None, wait=True, timeout=timeout)
+
+    def stop(self, timeout=5):
+        """Confirma as operações pendentes e encerra a thread."""
+        if not self.is_running():
+            return
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+        log.info("💾 Escritor write-behind encerrado")
+
+    def queue_size(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        """Estatísticas de lotes e latências de COMMIT."""
+        return {
+            "running": self.is_running(),
+            "queue_size": self._queue.qsize(),
+            "total_ops": self.total_ops,
+            "total_batches": self.total_batches,
+            "total_errors": self.total_errors,
+            "avg_batch_size": (
+                self.total_ops / self.total_batches if self.total_batches else 0
+            ),
+            "last_batch_size": self.last_batch_size,
+            "last_commit_ms": round(self.last_commit_ms, 2),
+            "batch_size": batch_size_hist.summary(),
+            "commit_seconds": commit_latency_hist.summary(),
+            "ack_seconds": ack_latency_hist.summary(),
+        }
+
+    def _collect_batch(self, first):
+        """Agrupa operações até atingir o tamanho ou o prazo do lote."""
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        stop = False
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is self._STOP:
+                stop = True
+                break
+            batch.append(item)
+
+        return batch, stop
+
+    def _release_keys(self, batch):
+        with self._pending_lock:
+            for _, _, key, _ in batch:
+                if key is None:
+                    continue
+                count = self._pending_keys.get(key, 0) - 1
+                if count > 0:
+                    self._pending_keys[key] = count
+                else:
+                    self._pending_keys.pop(key, None)
+
+    def _apply_batch(self, conn, batch):
+        """Executa o lote em uma única transação (SAVEPOINT por operação)."""
+        results = []
+        started = time.monotonic()
+
+        conn.execute("BEGIN")
+        for operation, args, _, _ in batch:
+            conn.execute("SAVEPOINT op")
+            op_started = time.perf_counter()
+            try:
+                results.append((operation(conn, *args), None))
+                db_op_hist.observe(time.perf_counter() - op_started, op=op_name(operation))
+                conn.execute("RELEASE SAVEPOINT op")
+            except Exception as e:
+                # Falha isolada: desfaz só esta operação e mantém o lote
+                conn.execute("ROLLBACK TO SAVEPOINT op")
+                conn.execute("RELEASE SAVEPOINT op")
+                results.append((None, e))
+                self.total_errors += 1
+
+        conn.commit()
+
+        elapsed = time.monotonic() - started
+        self.total_ops += len(batch)
+        self.total_batches += 1
+        self.last_batch_size = len(batch)
+        self.last_commit_ms = elapsed * 1000
+        batch_size_hist.observe(len(batch))
+        commit_latency_hist.observe(elapsed)
+        return results
+
+    def _run(self):
+        conn = self.db._connect()
+        stop = False
+
+        try:
+            while not stop:
+                first = self._queue.get()
+                if first is self._STOP:
+                    break
+
+                batch, stop = self._collect_batch(first)
+
+                try:
+                    results = self._apply_batch(conn, batch)
+                except Exception as e:
+                    log.error(f"❌ Erro ao confirmar lote de {len(batch)} escritas: {e}")
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+                    self.total_errors += len(batch)
+                    results = [(None, e)] * len(batch)
+
+                self._release_keys(batch)
+                for (_, _, _, ticket), (result, error) in zip(batch, results):
+                    ticket._resolve(result, error)
+        finally:
+            conn.close()
@@ -1,8 +1,23 @@
 """
 Script de geração de códigos para produtos - COM PERSISTÊNCIA
+
+A varredura roda como pipeline em estágios (bling_pipeline), com filas
+limitadas entre eles:
+páginas → detalhes → regras → consultas ao banco → escritas em lote → saída
+
+Com orçamento de tempo ou de requisições (bling_budget), a listagem é lida
+primeiro e os produtos são processados por prioridade; o que não couber no
+orçamento fica para a próxima execução.
+
+Com DUMP_PROCESSES > 1, a listagem é dividida em shards de páginas entre
+processos (bling_shards), cada um com o seu pipeline.
 """
 
-import json
+import multiprocessing
+import os
+import sys
+import time
+from itertools import count
 
 # Imports dos novos módulos
 from bling_logger import log
@@ -10,6 +25,12 @@ from bling_auth import ensure_authenticated
 from bling_api import BlingAPI
 from bling_sync import OrderSynchronizer
 from bling_db import BlingDatabase
+from bling_dump import PARTIAL_SUFFIX, DumpWriter, is_compressed, iter_dump
+from bling_journal import COMPLETED, FAILED, INCOMPLETE, RunJournal
+from bling_budget import DEFAULT_CALLS_PER_ITEM, RunBudget
+from bling_incremental import DECISION_ERROR, ProductStateTracker
+from bling_pipeline import Pipeline, log_stage_stats, merge_stage_stats
+from bling_shards import ShardCoordinator
 from bling_utils import (
     get_category_cache,
     extract_category_info,
@@ -28,51 +49,74 @@ category_cache = get_category_cache()
 EXCLUDED_CATEGORIES = {"notebook", "sff", "mini", "monitor"}
 IGNORE_SUBCATEGORIES = {"submaquina"}
 
-OUTPUT_FILE = "products_dump.json"
-
-
-def generate_and_update_code(product, product_details):
-    """
-    Gera código e atualiza produto na API.
+# Dump JSON Lines (".gz" no nome ativa a compressão)
+OUTPUT_FILE = os.getenv("DUMP_FILE", "products_dump.jsonl")
+PAGE_SIZE = 100
 
-    Returns:
-        (success: bool, code: str or None, message: str)
-    """
-    product_id = product["id"]
+# Concorrência de cada estágio do pipeline
+PAGE_WORKERS = int(os.getenv("PIPELINE_PAGE_WORKERS", 1))
+DETAIL_WORKERS = int(os.getenv("PIPELINE_DETAIL_WORKERS", 3))
+LOOKUP_WORKERS = int(os.getenv("PIPELINE_LOOKUP_WORKERS", 2))
+WRITE_WORKERS = int(os.getenv("PIPELINE_WRITE_WORKERS", 1))
+WRITE_BATCH = int(os.getenv("PIPELINE_WRITE_BATCH", 20))
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 200))
 
-    # Passa o cache para should_generate_code (ATUALIZADO)
-    should_gen, reason, prefix = should_generate_code(product_details, category_cache)
+# Varredura em shards: processos e páginas por shard (1 processo = sem shards)
+PROCESSES = int(os.getenv("DUMP_PROCESSES", 1))
+SHARD_PAGES = int(os.getenv("DUMP_SHARD_PAGES", 5))
+# Diretório dos arquivos por página dos shards ("<DUMP_FILE>.pages")
+PAGES_DIR_SUFFIX = ".pages"
 
-    if not should_gen:
-        return False, None, reason
+# Orçamento por execução (0 = ilimitado)
+TIME_BUDGET_MINUTES = float(os.getenv("DUMP_TIME_BUDGET_MINUTES", 0))
+API_BUDGET = int(os.getenv("DUMP_API_BUDGET", 0))
+# Produtos por checkpoint no modo priorizado (as páginas terminam fora de ordem)
+CHECKPOINT_EVERY = PAGE_SIZE
+# Fração do orçamento que a listagem pode consumir antes de começar o trabalho
+LISTING_BUDGET_SHARE = float(os.getenv("DUMP_LISTING_BUDGET_SHARE", 0.5))
 
-    # Gerar código usando banco de dados (thread-safe)
-    category, subcategory, full, cat_id = extract_category_info(
-        product_details, category_cache
-    )
-    new_code = db.get_next_code(prefix=prefix, category_id=cat_id, category_name=full)
+# Prioridades do modo com orçamento (menor primeiro)
+PRIORITY_UNCHANGED = -1  # Sem custo de API: entra antes de tudo
+PRIORITY_NO_CODE = 0
+PRIORITY_ZERO_STOCK = 1
+PRIORITY_OTHER = 2
+PRIORITY_LABELS = {
+    PRIORITY_UNCHANGED: "unchanged",
+    PRIORITY_NO_CODE: "no_code",
+    PRIORITY_ZERO_STOCK: "zero_stock",
+    PRIORITY_OTHER: "other",
+}
 
-    log.info(f"   🏷️  Código gerado: {new_code}")
 
-    # Atualizar na API
-    try:
-        api.update_product(product_id, {"codigo": new_code})
-        return True, new_code, f"Atualizado com sucesso ({reason})"
-    except Exception as e:
-        log.error(f"Erro ao atualizar produto {product_id}: {e}")
-        return False, None, f"Erro ao atualizar: {e}"
+def work_priority(summary):
+    """
+    Valor esperado de processar o produto, pelo resumo da listagem:
+    sem código, depois ativos com estoque zerado, depois o resto.
+    """
+    if not summary.get("codigo"):
+        return PRIORITY_NO_CODE
+    stock = (summary.get("estoque") or {}).get("saldoVirtualTotal")
+    if stock is None:
+        stock = summary.get("estoqueAtual")
+    if summary.get("situacao") == "A" and stock is not None and stock <= 0:
+        return PRIORITY_ZERO_STOCK
+    return PRIORITY_OTHER
 
 
-def process_product_variations(product_details):
+def process_product_variations(product_details, journal=None):
     """
     Processa variações de produto (se houver).
+
+    Com journal, um código já aplicado não é regravado e um código reservado
+    antes de uma queda é reaproveitado.
     """
     variations = product_details.get("variacoes", [])
 
     if not variations:
         return
 
-    log.info(f"   🔀 Produto tem {len(variations)} variações")
+    product_id = product_details.get("id")
+    log.info(f"   🔀 Produto {product_id} tem {len(variations)} variações")
 
     for var in variations:
         var_id = var.get("id")
@@ -83,6 +127,12 @@ def process_product_variations(product_details):
             log.info(f"      ⏭️  Variação {var_id} já tem código: {var_code}")
             continue
 
+        applied = journal.action("code_applied", var_id) if journal else None
+        if applied:
+            var["codigo"] = applied
+            log.info(f"      ⏭️  Variação {var_id} já atualizada (execução anterior)")
+            continue
+
         log.info(f"      🔍 Processando variação: {var_name}")
 
         # Variações herdam categoria do produto pai
@@ -95,12 +145,16 @@ def process_product_variations(product_details):
             continue
 
         # Gerar código
-        category, subcategory, full, cat_id = extract_category_info(
-            product_details, category_cache
-        )
-        new_code = db.get_next_code(
-            prefix=prefix, category_id=cat_id, category_name=full
-        )
+        new_code = journal.action("code_reserved", var_id) if journal else None
+        if not new_code:
+            category, subcategory, full, cat_id = extract_category_info(
+                product_details, category_cache
+            )
+            new_code = db.get_next_code(
+                prefix=prefix, category_id=cat_id, category_name=full
+            )
+            if journal:
+                journal.record_action("code_reserved", var_id, new_code)
 
         log.info(f"      🏷️  Código gerado para variação: {new_code}")
 
@@ -108,16 +162,801 @@ def process_product_variations(product_details):
         try:
             api.update_product(var_id, {"codigo": new_code})
             var["codigo"] = new_code
+            if journal:
+                journal.record_action("code_applied", var_id, new_code)
             log.info("      ✅ Variação atualizada com sucesso")
         except Exception as e:
             log.error(f"      ❌ Erro ao atualizar variação {var_id}: {e}")
 
 
-def dump_update_and_deactivate_products():
+class ProductScan:
+    """
+    Uma execução da varredura de produtos.
+
+    Cada produto atravessa o pipeline como um dicionário de trabalho
+    ("page", "summary", "product", ...) que os estágios vão completando.
+    """
+
+    def __init__(self, writer, tracker, journal, budget=None, prioritize=None):
+        """
+        Args:
+            writer: DumpWriter que recebe cada produto processado
+            tracker: ProductStateTracker (pula produtos sem mudança)
+            journal: RunJournal da execução (retomada e ações aplicadas)
+            budget: RunBudget; com limites, ativa o modo priorizado
+            prioritize: Força (True) ou desativa (False) o modo priorizado
+        """
+        self.writer = writer
+        self.tracker = tracker
+        self.journal = journal
+        self.budget = budget if budget is not None else RunBudget()
+        if prioritize is None:
+            prioritize = self.budget.limited
+        self.prioritized = prioritize
+        self.failed = False
+        self.pages_completed = 0
+        # Página -> produtos ainda não gravados no dump / IDs da página
+        self._page_pending = {}
+        self._page_ids = {}
+        # Modo priorizado: produtos gravados desde o último checkpoint
+        self._unsynced_ids = []
+        self.work_total = 0
+        self.by_priority = {}
+        self.deferred = 0
+        # Modo priorizado: a listagem chegou ao fim nesta execução
+        self.listing_complete = False
+        # Primeira página vazia da listagem (fim)
+        self.end_page = None
+        self.total_processed = 0
+        self.skipped_unchanged = 0
+        self.skipped_resumed = 0
+        self.total_updated = 0
+        self.total_skipped = 0
+        self.total_errors = 0
+        self.deactivated_count = 0
+        self.ignored_count = 0
+
+        # Erro em um produto: ele segue com o erro anexado (conta como erro e
+        # é reavaliado na próxima execução). Erro na listagem ou na saída
+        # deixa a execução como falha, para ser retomada.
+        self.pipeline = Pipeline("dump")
+        if not self.prioritized:
+            self.pipeline.add_stage(
+                "pages", self.fetch_page, workers=PAGE_WORKERS,
+                queue_size=PAGE_WORKERS, fan_out=True, on_error=self._stage_failed,
+            )
+        (
+            self.pipeline
+            .add_stage(
+                "details", self.fetch_details, workers=DETAIL_WORKERS,
+                queue_size=QUEUE_SIZE, on_error=self._item_failed,
+            )
+            .add_stage(
+                "rules", self.evaluate_rules, queue_size=QUEUE_SIZE,
+                on_error=self._item_failed,
+            )
+            .add_stage(
+                "lookups", self.lookup_entries, workers=LOOKUP_WORKERS,
+                queue_size=QUEUE_SIZE, on_error=self._item_failed,
+            )
+            .add_stage(
+                "writes", self.apply_writes, workers=WRITE_WORKERS,
+                queue_size=QUEUE_SIZE, batch_size=WRITE_BATCH,
+                on_error=self._batch_failed,
+            )
+            # Estágio único: contadores e escrita do dump sem locks
+            .add_stage(
+                "output", self.collect, queue_size=QUEUE_SIZE,
+                on_error=self._stage_failed,
+            )
+        )
+
+    def run(self):
+        self.budget.start()
+        if self.prioritized:
+            self.pipeline.run(self.prioritized_items())
+            self._checkpoint()
+        else:
+            done_pages = self.journal.done_pages
+            self.pipeline.run(page for page in count(1) if page not in done_pages)
+        return self
+
+    @property
+    def carried_over(self):
+        """Produtos listados que ficaram para a próxima execução."""
+        return max(self.work_total - self.total_processed, 0)
+
+    @property
+    def incomplete(self):
+        return (
+            self.prioritized
+            and not self.failed
+            and (self.carried_over > 0 or not self.listing_complete)
+        )
+
+    def stats(self):
+        stats = {
+            "processed": self.total_processed,
+            "skipped_unchanged": self.skipped_unchanged,
+            "skipped_resumed": self.skipped_resumed,
+            "codes": self.total_updated,
+            "deactivated": self.deactivated_count,
+            "errors": self.total_errors,
+            "pages": self.pages_completed,
+            "skipped_rules": self.total_skipped,
+            "ignored": self.ignored_count,
+        }
+        if self.prioritized:
+            stats["budget"] = self.budget.stats()
+            stats["by_priority"] = self.by_priority
+            stats["carried_over"] = self.carried_over
+            stats["listing_complete"] = self.listing_complete
+        return stats
+
+    def log_pipeline(self):
+        self.pipeline.log_report()
+
+    # ------------------------------------------------------------------
+    # Fonte do modo priorizado
+    # ------------------------------------------------------------------
+
+    def prioritized_items(self):
+        """
+        Lê a listagem (só resumos, uma requisição por página) e entrega os
+        itens em ordem de prioridade. Produtos sem mudança vêm antes: não
+        custam requisições e completam o dump.
+
+        Páginas já concluídas na execução retomada não são relidas. A leitura
+        para quando os produtos listados já ocupam o orçamento restante de
+        requisições, ou ao consumir LISTING_BUDGET_SHARE do orçamento; as
+        páginas seguintes ficam para a próxima execução.
+        """
+        items = []
+        done_pages = self.journal.done_pages
+        done = self.journal.done_products
+        listed = 0
+        pending = 0  # Itens listados que custam requisições
+        for page in count(1):
+            if page in done_pages:
+                continue
+            if self.budget.exceeded():
+                log.warning(
+                    f"⏳ Orçamento esgotado durante a listagem (página {page}): "
+                    f"{self.budget.exhausted_reason}"
+                )
+                break
+            if listed and self.budget.api_calls is not None and (
+                pending * DEFAULT_CALLS_PER_ITEM
+                >= self.budget.api_calls - self.budget.calls_used()
+            ):
+                log.info(
+                    f"⏳ Listagem pausada na página {page}: os produtos já listados "
+                    "ocupam o orçamento restante"
+                )
+                break
+            if listed and self.budget.used_fraction() >= LISTING_BUDGET_SHARE:
+                log.info(
+                    f"⏳ Listagem pausada na página {page} ({LISTING_BUDGET_SHARE:.0%} "
+                    "do orçamento): as páginas seguintes ficam para a próxima execução"
+                )
+                break
+            try:
+                data = api.get_products(page=page, limit=PAGE_SIZE)
+            except Exception as e:
+                log.error(f"❌ Erro fatal na página {page}: {e}")
+                self.failed = True
+                return
+            listed += 1
+            products = data.get("data", [])
+            if not products:
+                self.end_page = page
+                self.listing_complete = True
+                break
+
+            fresh = [p for p in products if p["id"] not in done]
+            self.skipped_resumed += len(products) - len(fresh)
+            if not fresh:
+                # Concluída antes da queda, sem o registro da página
+                self.journal.checkpoint([], page=page)
+                continue
+            self._page_pending[page] = len(fresh)
+            unchanged = self.tracker.unchanged(fresh)
+            for summary in fresh:
+                item = self._new_item(page, summary, summary["id"] in unchanged)
+                if item["unchanged"]:
+                    priority = PRIORITY_UNCHANGED
+                else:
+                    priority = work_priority(summary)
+                    pending += 1
+                items.append((priority, len(items), item))
+
+        items.sort(key=lambda entry: entry[:2])
+        self.work_total = len(items)
+        self.by_priority = {label: 0 for label in PRIORITY_LABELS.values()}
+        for priority, _, _ in items:
+            self.by_priority[PRIORITY_LABELS[priority]] += 1
+        log.info(
+            f"🎯 {self.work_total} produtos a processar de {listed} páginas lidas "
+            f"(sem mudança: {self.by_priority['unchanged']}, "
+            f"sem código: {self.by_priority['no_code']}, "
+            f"ativos zerados: {self.by_priority['zero_stock']}, "
+            f"demais: {self.by_priority['other']})"
+        )
+        for _, _, item in items:
+            yield item
+
+    @staticmethod
+    def _new_item(page, summary, unchanged):
+        return {
+            "page": page,
+            "summary": summary,
+            "product": summary,
+            "errors": [],
+            "unchanged": unchanged,
+            "detailed": False,
+            "admitted": False,
+            "deferred": False,
+        }
+
+    # ------------------------------------------------------------------
+    # Estágios
+    # ------------------------------------------------------------------
+
+    def _item_failed(self, item, error):
+        """Produto com erro em um estágio: segue só para ser gravado e contado."""
+        item["errors"].append(f"{type(error).__name__}: {error}")
+        item["detailed"] = False
+        return item
+
+    def _batch_failed(self, batch, error):
+        """Lote com erro nas escritas: marca os produtos que não foram gravados."""
+        for item in batch:
+            if "deactivated" not in item:
+                self._item_failed(item, error)
+        return batch
+
+    def _stage_failed(self, item, error):
+        self.failed = True
+        self.pipeline.stop()
+        return None
+
+    def fetch_page(self, page):
+        """Página de resumos -> itens de trabalho; página vazia encerra a fonte."""
+        # Páginas já enfileiradas depois da última não gastam requisição
+        if self.pipeline.stopped():
+            return []
+        try:
+            data = api.get_products(page=page, limit=PAGE_SIZE)
+        except Exception as e:
+            log.error(f"❌ Erro fatal na página {page}: {e}")
+            self.failed = True
+            self.pipeline.stop()
+            return []
+
+        products = data.get("data", [])
+        if not products:
+            self.end_page = page if self.end_page is None else min(self.end_page, page)
+            self.pipeline.stop()
+            return []
+
+        # Retomada: produtos já concluídos (a listagem pode ter deslocado)
+        done = self.journal.done_products
+        fresh = [p for p in products if p["id"] not in done]
+        self.skipped_resumed += len(products) - len(fresh)
+        products = fresh
+        if not products:
+            return []
+
+        log.info(f"📄 Página {page} recebida ({len(products)} produtos)")
+        self._page_ids[page] = [p["id"] for p in products]
+        self._page_pending[page] = len(products)
+        unchanged = self.tracker.unchanged(products)
+        return [
+            self._new_item(page, summary, summary["id"] in unchanged)
+            for summary in products
+        ]
+
+    def fetch_details(self, item):
+        if item["unchanged"]:
+            return item
+
+        # Sem orçamento para mais um produto: os já admitidos terminam e o
+        # restante fica para a próxima execução
+        if not self.budget.admit():
+            item["deferred"] = True
+            if not self.pipeline.stopped():
+                log.warning(
+                    f"⏳ Orçamento esgotado ({self.budget.exhausted_reason}): "
+                    "encerrando após os produtos em andamento"
+                )
+                self.pipeline.stop()
+            return item
+        item["admitted"] = True
+
+        product_id = item["summary"]["id"]
+        try:
+            details_response = api.get_product(product_id)
+            item["product"] = details_response.get("data", {})
+            item["detailed"] = True
+        except Exception as e:
+            log.error(f"    ❌ Erro ao buscar detalhes de {product_id}: {e}")
+            item["errors"].append(f"detalhes: {e}")
+            item["detailed"] = False
+        return item
+
+    def evaluate_rules(self, item):
+        """Decisões de código e desativação (somente CPU, sem I/O)."""
+        if not item["detailed"]:
+            return item
+
+        product = item["product"]
+        summary = item["summary"]
+
+        should_gen, reason, prefix = should_generate_code(product, category_cache)
+        item["code_reason"] = reason
+        item["code_request"] = None
+        if should_gen:
+            _, _, full, cat_id = extract_category_info(product, category_cache)
+            item["code_request"] = (prefix, cat_id, full)
+
+        # Checar estoque (detalhe; resumo da listagem como fallback)
+        stock = product.get("estoqueAtual") or 0
+        if stock <= 0 and summary.get("estoque"):
+            stock = summary["estoque"].get("saldoVirtualTotal", 0)
+        item["stock"] = stock
+        item["zero_stock"] = stock <= 0
+
+        item["ignore_reason"] = None
+        if item["zero_stock"]:
+            should_ignore, ignore_reason = should_ignore_product(
+                product, category_cache, EXCLUDED_CATEGORIES, IGNORE_SUBCATEGORIES
+            )
+            if should_ignore:
+                item["ignore_reason"] = ignore_reason
+        return item
+
+    def lookup_entries(self, item):
+        """Histórico de entradas no banco local para os zerados não ignorados."""
+        item["entry"] = None
+        if item["detailed"] and item["zero_stock"] and not item["ignore_reason"]:
+            has_entry, entry_details = db.product_has_entry(item["summary"]["id"])
+            if has_entry:
+                item["entry"] = entry_details
+        return item
+
+    def apply_writes(self, batch):
+        """
+        Aplica as escritas de um lote: códigos reservados em uma única
+        transação (e registrados no diário antes de ir à API), depois as
+        atualizações na API.
+        """
+        pending = []
+        for item in batch:
+            if not item.get("code_request"):
+                continue
+            # Código reservado antes de uma queda é reaproveitado
+            reserved = self.journal.action("code_reserved", item["summary"]["id"])
+            if reserved:
+                item["new_code"] = reserved
+            else:
+                pending.append(item)
+
+        codes = db.get_next_codes([item["code_request"] for item in pending])
+        for item, code in zip(pending, codes):
+            item["new_code"] = code
+        self.journal.record_actions(
+            [
+                ("code_reserved", item["summary"]["id"], item["new_code"])
+                for item in pending
+            ]
+        )
+
+        for item in batch:
+            if item["detailed"]:
+                self._write_product(item)
+        return batch
+
+    def _write_product(self, item):
+        product = item["product"]
+        product_id = item["summary"]["id"]
+
+        # Gerar e atualizar código
+        item["code_updated"] = False
+        new_code = item.get("new_code")
+        if new_code and self.journal.action("code_applied", product_id) == new_code:
+            product["codigo"] = new_code
+            item["code_updated"] = True
+            item["code_message"] = f"Atualizado na execução anterior ({new_code})"
+        elif new_code:
+            log.info(f"   🏷️  Código gerado para {product_id}: {new_code}")
+            try:
+                api.update_product(product_id, {"codigo": new_code})
+                self.journal.record_action("code_applied", product_id, new_code)
+                product["codigo"] = new_code
+                item["code_updated"] = True
+                item["code_message"] = f"Atualizado com sucesso ({item['code_reason']})"
+            except Exception as e:
+                log.error(f"Erro ao atualizar produto {product_id}: {e}")
+                item["code_message"] = f"Erro ao atualizar: {e}"
+        else:
+            item["code_message"] = item["code_reason"]
+
+        # Processar variações
+        process_product_variations(product, self.journal)
+
+        # Desativar somente se estiver ativo
+        item["deactivated"] = False
+        if item["entry"] and product.get("situacao") == "A":
+            if self.journal.has_action("deactivated", product_id):
+                product["situacao"] = "I"
+                item["deactivated"] = True
+                return
+
+            log.warning(f"   🔴 DESATIVANDO produto {product_id}...")
+            try:
+                api.update_product_situation(product_id, "I")
+                self.journal.record_action("deactivated", product_id)
+                product["situacao"] = "I"
+                item["deactivated"] = True
+            except Exception as e:
+                log.error(f"   ❌ Erro ao desativar produto {product_id}: {e}")
+                item["errors"].append(f"desativação: {e}")
+
+    def collect(self, item):
+        """Contadores, log por produto e escrita do dump (thread única)."""
+        if item["deferred"]:
+            self.deferred += 1
+            return None
+        if item["admitted"]:
+            self.budget.done()
+
+        self.total_processed += 1
+        product = item["product"]
+        if item["unchanged"]:
+            self.skipped_unchanged += 1
+            # Registro detalhado da última avaliação (resumo se não houver)
+            snapshot = self.tracker.snapshot(item["summary"]["id"])
+            self._write_dump(item, snapshot or product)
+            return None
+
+        product_id = item["summary"]["id"]
+        product_name = item["summary"].get("nome", "Sem nome")
+        self.total_errors += len(item["errors"])
+
+        log.info(f"[{self.total_processed}] 📦 {product_name} (ID: {product_id})")
+        try:
+            self._report(item, product)
+            self._record_state(item, product)
+        finally:
+            self._write_dump(item, product)
+        return None
+
+    def _record_state(self, item, product):
+        """Decisão e impressão digital do produto para a próxima execução."""
+        overrides = {}
+        if item["errors"] or (item.get("new_code") and not item["code_updated"]):
+            decision = DECISION_ERROR
+        elif item["deactivated"]:
+            decision = "deactivated"
+            overrides["situacao"] = "I"
+        elif item["code_updated"]:
+            decision = "code_generated"
+        elif item["zero_stock"] and item["ignore_reason"]:
+            decision = "ignored"
+        elif item["zero_stock"]:
+            decision = "has_entry" if item["entry"] else "no_entry"
+        else:
+            decision = "ok"
+
+        if item.get("code_updated"):
+            overrides["codigo"] = product.get("codigo")
+        self.tracker.record(
+            item["summary"], decision, stock=item.get("stock"),
+            snapshot=product if item["detailed"] else None, **overrides
+        )
+
+    def _write_dump(self, item, product):
+        """
+        Grava o produto; quando a página dele fica completa, fsync do dump e
+        registro da página no diário (com o offset para retomada). No modo
+        priorizado, os produtos também entram no checkpoint a cada
+        CHECKPOINT_EVERY produtos (as páginas terminam fora de ordem).
+        """
+        page = item["page"]
+        self._writer_for(page).write(product)
+        if self.prioritized:
+            self._unsynced_ids.append(item["summary"]["id"])
+            finished = self._page_written(page)
+            if finished or len(self._unsynced_ids) >= CHECKPOINT_EVERY:
+                self._checkpoint(page if finished else None)
+            return
+
+        if self._page_written(page):
+            self._finish_page(page)
+
+    def _page_written(self, page):
+        """Mais um produto da página gravado; True quando ela fica completa."""
+        self._page_pending[page] -= 1
+        if self._page_pending[page]:
+            return False
+        del self._page_pending[page]
+        self.pages_completed += 1
+        return True
+
+    def _writer_for(self, page):
+        return self.writer
+
+    def _finish_page(self, page):
+        self.writer.sync()
+        self.journal.page_done(
+            page, self._page_ids.pop(page), dump_offset=self.writer.offset()
+        )
+
+    def _checkpoint(self, page=None):
+        if not self._unsynced_ids and page is None:
+            return
+        self.writer.sync()
+        self.journal.checkpoint(
+            self._unsynced_ids, dump_offset=self.writer.offset(), page=page
+        )
+        self._unsynced_ids = []
+
+    def _report(self, item, product):
+        """Contadores e log das decisões tomadas para o produto."""
+        if not item["detailed"]:
+            return
+
+        if item["code_updated"]:
+            log.info(f"    ✅ {item['code_message']}")
+            self.total_updated += 1
+        else:
+            log.info(f"    ⏭️  {item['code_message']}")
+            self.total_skipped += 1
+
+        if not item["zero_stock"]:
+            return
+
+        log.info("   📉 Estoque zerado ou negativo encontrado.")
+        if item["ignore_reason"]:
+            self.ignored_count += 1
+            log.info(f"   ⏭️  IGNORADO para desativação: {item['ignore_reason']}")
+        elif item["entry"]:
+            entry = item["entry"]
+            log.info(
+                f"   📊 Entrada encontrada: {entry.get('source', 'N/A')}, "
+                f"pedido {entry.get('order_number', 'N/A')}, "
+                f"data {entry.get('order_date', 'N/A')}, "
+                f"quantidade {entry.get('quantity', 0)}"
+            )
+            if item["deactivated"]:
+                self.deactivated_count += 1
+                log.info("   ✅ Produto DESATIVADO com sucesso")
+            elif product.get("situacao") != "A":
+                log.info("   ✅ Produto já estava INATIVO.")
+        else:
+            log.info("   ✅ Produto sem histórico de entradas (não será desativado)")
+
+
+class ShardScan(ProductScan):
+    """
+    Shard de páginas em um processo worker.
+
+    Cada página é gravada em um arquivo próprio em "<DUMP_FILE>.pages/",
+    renomeado do .partial quando a página termina (antes de registrá-la no
+    diário); o coordenador junta os arquivos no dump no fim. Com orçamento
+    (já iniciado, compartilhado entre os processos), produtos adiados deixam
+    a página incompleta e ela é refeita na próxima execução.
+    """
+
+    def __init__(self, pages_dir, tracker, journal, budget=None):
+        super().__init__(None, tracker, journal, budget, prioritize=False)
+        self.pages_dir = pages_dir
+        self._page_writers = {}
+
+    def run(self, pages):
+        done_pages = self.journal.done_pages
+        try:
+            self.pipeline.run(page for page in pages if page not in done_pages)
+        finally:
+            # Páginas incompletas ficam como .partial (descartadas na junção)
+            for writer in self._page_writers.values():
+                writer.close(complete=False)
+        return self
+
+    def _writer_for(self, page):
+        writer = self._page_writers.get(page)
+        if writer is None:
+            writer = DumpWriter(page_file(self.pages_dir, page))
+            self._page_writers[page] = writer
+        return writer
+
+    def _finish_page(self, page):
+        self._page_writers.pop(page).close()
+        self.journal.page_done(page, self._page_ids.pop(page))
+
+
+def page_file(pages_dir, page):
+    suffix = ".jsonl.gz" if is_compressed(OUTPUT_FILE) else ".jsonl"
+    return os.path.join(pages_dir, f"page-{page:06d}{suffix}")
+
+
+def _init_shard_worker(rate_limiter, run_id, full_sweep, deadline, api_calls):
+    """Inicialização de cada processo worker (ver ShardCoordinator)."""
+    global api
+    # Mesmo limite de req/s e cota diária para todos os processos
+    api = BlingAPI(ensure_authenticated, rate_limiter=rate_limiter)
+    category_cache.load(api, db=db)
+    return {
+        "run_id": run_id,
+        "full_sweep": full_sweep,
+        "deadline": deadline,
+        "api_calls": api_calls,
+        "rate_limiter": rate_limiter,
+    }
+
+
+def scan_shard(pages, context):
+    """Processa um shard de páginas no worker e devolve os resultados."""
+    # Diário relido a cada shard: um shard reatribuído traz as ações
+    # (códigos reservados/aplicados) do worker que caiu
+    journal = RunJournal(db, "dump").attach(context["run_id"])
+    tracker = ProductStateTracker(db, "dump")
+    tracker.full_sweep = context["full_sweep"]
+
+    # Orçamento da execução inteira: contagem compartilhada desde o início
+    deadline = context["deadline"]
+    budget = RunBudget(
+        seconds=max(deadline - time.time(), 1e-3) if deadline else None,
+        api_calls=context["api_calls"],
+        rate_limiter=context["rate_limiter"],
+    ).start(calls_at_start=0)
+
+    pages_dir = OUTPUT_FILE + PAGES_DIR_SUFFIX
+    os.makedirs(pages_dir, exist_ok=True)
+    scan = ShardScan(pages_dir, tracker, journal, budget).run(pages)
+    tracker.flush()
+    return {
+        "stats": scan.stats(),
+        "pipeline": scan.pipeline.stats(),
+        "end_page": scan.end_page,
+        "failed": scan.failed,
+        "deferred": scan.deferred,
+    }
+
+
+def absorb_page_files(writer, journal):
+    """
+    Copia para o dump os arquivos de página dos shards e os remove.
+
+    Só entram páginas concluídas no diário e ainda não copiadas; a cópia e o
+    novo offset do dump são registrados juntos ("page_merged"), então uma
+    queda no meio não duplica nem perde páginas.
+
+    Returns:
+        Número de páginas copiadas
+    """
+    pages_dir = OUTPUT_FILE + PAGES_DIR_SUFFIX
+    if not os.path.isdir(pages_dir):
+        return 0
+
+    journal.reload()
+    merged = []
+    files = sorted(os.listdir(pages_dir))
+    for name in files:
+        if name.endswith(PARTIAL_SUFFIX):
+            continue
+        page = int(name.split("-")[1].split(".")[0])
+        if page not in journal.done_pages or journal.has_action("page_merged", page):
+            continue
+        for record in iter_dump(os.path.join(pages_dir, name)):
+            writer.write(record)
+        merged.append(page)
+
+    if merged:
+        writer.sync()
+        journal.checkpoint(
+            [], dump_offset=writer.offset(),
+            actions=[("page_merged", page, None) for page in merged],
+        )
+    for name in files:
+        os.remove(os.path.join(pages_dir, name))
+    os.rmdir(pages_dir)
+    return len(merged)
+
+
+class ShardedScan:
+    """
+    Varredura dividida em shards de páginas entre processos (DUMP_PROCESSES).
+
+    Os contadores e o relatório do pipeline são a soma dos shards; os
+    atributos espelham os de ProductScan para o relatório final.
+    """
+
+    COUNTERS = {
+        "total_processed": "processed",
+        "skipped_unchanged": "skipped_unchanged",
+        "skipped_resumed": "skipped_resumed",
+        "total_updated": "codes",
+        "total_skipped": "skipped_rules",
+        "deactivated_count": "deactivated",
+        "ignored_count": "ignored",
+        "total_errors": "errors",
+        "pages_completed": "pages",
+    }
+
+    def __init__(self, writer, tracker, journal, budget, processes):
+        self.writer = writer
+        self.journal = journal
+        deadline = time.time() + budget.seconds if budget.seconds else None
+        self.coordinator = ShardCoordinator(
+            scan_shard,
+            init=_init_shard_worker,
+            init_args=(journal.run_id, tracker.full_sweep, deadline, budget.api_calls),
+            processes=processes,
+            shard_pages=SHARD_PAGES,
+            budget=budget if budget.limited else None,
+        )
+        for attr in self.COUNTERS:
+            setattr(self, attr, 0)
+        self.failed = False
+        self.incomplete = False
+        # Pendentes não são contáveis sem a listagem inteira
+        self.carried_over = None
+
+    def run(self):
+        coordinator = self.coordinator.run(skip_pages=self.journal.done_pages)
+        for result in coordinator.results:
+            for attr, key in self.COUNTERS.items():
+                setattr(self, attr, getattr(self, attr) + result["stats"][key])
+        self.failed = coordinator.failed
+        deferred = sum(result.get("deferred", 0) for result in coordinator.results)
+        self.incomplete = (coordinator.incomplete or deferred > 0) and not self.failed
+
+        merged = absorb_page_files(self.writer, self.journal)
+        log.info(f"🧩 {merged} páginas dos shards copiadas para o dump")
+        return self
+
+    def stats(self):
+        stats = {key: getattr(self, attr) for attr, key in self.COUNTERS.items()}
+        stats["shards"] = self.coordinator.shards_done
+        stats["worker_restarts"] = self.coordinator.restarts
+        stats["processes"] = self.coordinator.processes
+        return stats
+
+    def log_pipeline(self):
+        coordinator = self.coordinator
+        log_stage_stats(
+            merge_stage_stats(
+                [result["pipeline"] for result in coordinator.results],
+                coordinator.elapsed,
+                parallel=coordinator.processes,
+            ),
+            coordinator.elapsed,
+        )
+
+
+def dump_update_and_deactivate_products(
+    force_full=False, resume=True, budget_minutes=None, budget_calls=None,
+    processes=None,
+):
     """
     Varre todos os produtos para:
     1. Gerar códigos para produtos e variações sem código.
     2. Desativar produtos com estoque zerado por vendas.
+
+    Produtos sem mudança desde a última execução são pulados, exceto na
+    varredura completa periódica (FULL_SWEEP_HOURS) ou com force_full.
+    Uma execução interrompida é retomada de onde parou (resume=False
+    descarta e começa do zero).
+
+    Com orçamento (budget_minutes/budget_calls, padrão: env
+    DUMP_TIME_BUDGET_MINUTES/DUMP_API_BUDGET), os produtos são processados
+    por prioridade e a execução termina "incomplete" quando ele acaba; a
+    próxima continua com o restante.
+
+    Com processes > 1 (padrão: env DUMP_PROCESSES), a listagem é dividida em
+    shards de páginas entre processos; o orçamento, se houver, é conferido
+    a cada shard entregue, sem priorização.
     """
     log.info(f"{'=' * 80}")
     log.info("🚀 INICIANDO PROCESSAMENTO DE PRODUTOS")
@@ -130,151 +969,116 @@ def dump_update_and_deactivate_products():
 
     # Carregar cache de categorias
     log.info("\n📥 PASSO 2: Carregando categorias...")
-    category_cache.load(api)
+    category_cache.load(api, db=db)
 
     log.info("\n📥 PASSO 3: Processando produtos...")
-    all_products = []
-    page = 1
-    total_processed = 0
-    total_updated = 0
-    total_skipped = 0
-    total_errors = 0
-    deactivated_count = 0
-    ignored_count = 0
-
-    while True:
-        try:
-            data = api.get_products(page=page, limit=100)
-            products = data.get("data", [])
-
-            if not products:
-                break
-
-            log.info(f"{'─' * 80}")
-            log.info(f"📄 Processando página {page} ({len(products)} produtos)")
-            log.info(f"{'─' * 80}")
-
-            for product_summary in products:
-                total_processed += 1
-                product_id = product_summary["id"]
-                product_name = product_summary.get("nome", "Sem nome")
-
-                log.info(f"[{total_processed}] 📦 {product_name} (ID: {product_id})")
-
-                # Buscar detalhes completos
-                try:
-                    details_response = api.get_product(product_id)
-                    product_details = details_response.get("data", {})
-                except Exception as e:
-                    log.error(f"    ❌ Erro ao buscar detalhes: {e}")
-                    total_errors += 1
-                    all_products.append(product_summary)
-                    continue
-
-                # Gerar e atualizar código
-                success, code, message = generate_and_update_code(
-                    product_summary, product_details
-                )
+    if processes is None:
+        processes = PROCESSES
+    log.info(
+        f"⚙️  Workers: páginas {PAGE_WORKERS}, detalhes {DETAIL_WORKERS}, "
+        f"consultas {LOOKUP_WORKERS}, escritas {WRITE_WORKERS} "
+        f"(lotes de {WRITE_BATCH})"
+    )
+    if budget_minutes is None:
+        budget_minutes = TIME_BUDGET_MINUTES
+    if budget_calls is None:
+        budget_calls = API_BUDGET
+    budget = RunBudget(
+        seconds=budget_minutes * 60, api_calls=budget_calls,
+        rate_limiter=api.rate_limiter,
+    )
+    if budget.limited:
+        limits = []
+        if budget_minutes:
+            limits.append(f"{budget_minutes:g} min")
+        if budget_calls:
+            limits.append(f"{budget_calls} requisições")
+        order = (
+            "por shard, sem priorização" if processes > 1
+            else "ordem: sem código, ativos zerados, demais"
+        )
+        log.info(f"⏳ Orçamento: {', '.join(limits)} ({order})")
 
-                if success:
-                    log.info(f"    ✅ {message}")
-                    product_details["codigo"] = code
-                    total_updated += 1
-                else:
-                    log.info(f"    ⏭️  {message}")
-                    total_skipped += 1
-
-                # Processar variações
-                process_product_variations(product_details)
-
-                # Checar estoque usando banco local
-                stock = product_details.get("estoqueAtual", 0)
-                if stock <= 0 and product_summary["estoque"]:
-                    stock = product_summary["estoque"].get("saldoVirtualTotal", 0)
-
-                if stock <= 0:
-                    log.info("   📉 Estoque zerado ou negativo encontrado.")
-
-                    # Verificar se deve ignorar por categoria
-                    should_ignore, ignore_reason = should_ignore_product(
-                        product_details,
-                        category_cache,
-                        EXCLUDED_CATEGORIES,
-                        IGNORE_SUBCATEGORIES,
-                    )
-
-                    if should_ignore:
-                        ignored_count += 1
-                        log.info(f"   ⏭️  IGNORADO para desativação: {ignore_reason}")
-                    else:
-                        # Verificar no banco local se teve entrada
-                        log.info(
-                            "   🔍 Verificando histórico de entradas no banco local..."
-                        )
-                        has_entry, entry_details = db.product_has_entry(product_id)
-
-                        if has_entry:
-                            log.info("   📊 Entrada encontrada!")
-                            log.info(
-                                f"   📊 Tipo: {entry_details.get('source', 'N/A')}"
-                            )
-                            log.info(
-                                f"   📊 Pedido: {entry_details.get('order_number', 'N/A')}"
-                            )
-                            log.info(
-                                f"   📊 Data: {entry_details.get('order_date', 'N/A')}"
-                            )
-                            log.info(
-                                f"   📊 Quantidade: {entry_details.get('quantity', 0)}"
-                            )
-
-                            # Somente desativa se estiver ativo
-                            if product_details.get("situacao") == "A":
-                                log.warning("   🔴 DESATIVANDO produto...")
-                                try:
-                                    api.update_product_situation(product_id, "I")
-                                    deactivated_count += 1
-                                    product_details["situacao"] = "I"
-                                    log.info("   ✅ Produto DESATIVADO com sucesso")
-                                except Exception as e:
-                                    log.error(
-                                        f"   ❌ Erro ao desativar produto {product_id}: {e}"
-                                    )
-                                    total_errors += 1
-                            else:
-                                log.info("   ✅ Produto já estava INATIVO.")
-                        else:
-                            log.info(
-                                "   ✅ Produto sem histórico de entradas (não será desativado)"
-                            )
-
-                all_products.append(product_details)
-
-            page += 1
+    tracker = ProductStateTracker(db, "dump")
+    tracker.begin(force_full=force_full)
 
-        except Exception as e:
-            log.error(f"❌ Erro fatal na página {page}: {e}")
-            break
+    journal = RunJournal(db, "dump").open(dump_path=OUTPUT_FILE, resume=resume)
+    append = (
+        journal.resumed
+        and journal.dump_path == OUTPUT_FILE
+        and os.path.exists(OUTPUT_FILE + PARTIAL_SUFFIX)
+    )
+    if journal.resumed and not append and journal.done_products:
+        log.warning(
+            "⚠️ Dump parcial da execução anterior não encontrado: o novo dump "
+            "terá apenas os produtos desta retomada"
+        )
 
-    # Salvar dump
-    log.info(f"💾 Salvando dump em {OUTPUT_FILE}...")
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(all_products, f, ensure_ascii=False, indent=2)
+    log.info(f"💾 Dump gravado progressivamente em {OUTPUT_FILE}")
+    writer = DumpWriter(
+        OUTPUT_FILE, append=append, resume_offset=(journal.dump_offset or 0)
+    )
+    try:
+        # Arquivos de página de uma varredura em shards interrompida
+        absorb_page_files(writer, journal)
+        if processes > 1:
+            scan = ShardedScan(writer, tracker, journal, budget, processes).run()
+        else:
+            scan = ProductScan(writer, tracker, journal, budget).run()
+    except BaseException:
+        # Execução fica "running" no diário e será retomada
+        writer.close(complete=False)
+        raise
+    # Com erro fatal ou orçamento esgotado, o .partial fica para a retomada
+    finished = not scan.failed and not scan.incomplete
+    writer.close(complete=finished)
+    tracker.finish(completed=finished and not journal.resumed)
+    if scan.failed:
+        status = FAILED
+    elif scan.incomplete:
+        status = INCOMPLETE
+    else:
+        status = COMPLETED
+    journal.finish(status, stats=scan.stats())
 
     # Relatório final
     log.info(f"{'=' * 80}")
     log.info("📊 RELATÓRIO FINAL")
     log.info(f"{'=' * 80}")
     log.info("--- Geração de Códigos ---")
-    log.info(f"✅ Produtos processados: {total_processed}")
-    log.info(f"🏷️  Códigos gerados/atualizados: {total_updated}")
-    log.info(f"⏭️  Ignorados (código existente/regra): {total_skipped}")
+    log.info(f"✅ Produtos processados: {scan.total_processed}")
+    log.info(f"⚡ Pulados (sem mudança): {scan.skipped_unchanged}")
+    if journal.resumed:
+        log.info(f"♻️  Já concluídos antes da retomada: {scan.skipped_resumed}")
+    log.info(f"🏷️  Códigos gerados/atualizados: {scan.total_updated}")
+    log.info(f"⏭️  Ignorados (código existente/regra): {scan.total_skipped}")
     log.info("--- Desativação de Produtos ---")
-    log.info(f"🔴 Desativados (zerado por vendas): {deactivated_count}")
-    log.info(f"⏭️  Ignorados para desativação (categoria): {ignored_count}")
+    log.info(f"🔴 Desativados (zerado por vendas): {scan.deactivated_count}")
+    log.info(f"⏭️  Ignorados para desativação (categoria): {scan.ignored_count}")
     log.info("--- Resumo ---")
-    log.info(f"❌ Erros totais (API/DB): {total_errors}")
-    log.info(f"💾 Dump salvo em: {OUTPUT_FILE}")
+    log.info(f"❌ Erros totais (API/DB): {scan.total_errors}")
+    if budget.limited:
+        used = budget.stats()
+        log.info(
+            f"⏳ Orçamento usado: {used['elapsed_seconds'] / 60:.1f} min, "
+            f"{used['api_calls_used']} requisições"
+            + (f" (esgotado: {used['exhausted']})" if used["exhausted"] else "")
+        )
+        if scan.carried_over is not None:
+            log.info(f"📌 Pendentes para a próxima execução: {scan.carried_over}")
+            if not scan.listing_complete and not scan.failed:
+                log.info("📌 Listagem não concluída: continua na próxima execução")
+    if not finished:
+        log.info(f"💾 Dump parcial em: {writer.partial_path} (continua na retomada)")
+    else:
+        log.info(f"💾 Dump salvo em: {OUTPUT_FILE} ({writer.count} produtos)")
+    status_text = {
+        FAILED: "FALHOU (será retomada)",
+        INCOMPLETE: "incompleta por orçamento (será retomada)",
+        COMPLETED: "concluída",
+    }[status]
+    log.info(f"🧾 Execução #{journal.run_id}: {status_text}")
+    scan.log_pipeline()
     log.info(f"{'=' * 80}")
 
     # Estatísticas do banco
@@ -292,8 +1096,31 @@ def dump_update_and_deactivate_products():
 
 
 if __name__ == "__main__":
+    # No executável do PyInstaller (package.bat), os processos dos shards
+    # reexecutam o .exe: isto os desvia para o worker em vez do main
+    multiprocessing.freeze_support()
     try:
-        dump_update_and_deactivate_products()
+        # --full: reavalia todos os produtos, mesmo os sem mudança
+        # --fresh: descarta uma execução interrompida em vez de retomá-la
+        # --budget-minutes=N / --budget-calls=N: orçamento desta execução
+        # --processes=N: varredura em shards com N processos
+        options = dict(
+            arg[2:].split("=", 1) for arg in sys.argv[1:]
+            if arg.startswith("--") and "=" in arg
+        )
+        dump_update_and_deactivate_products(
+            force_full="--full" in sys.argv,
+            resume="--fresh" not in sys.argv,
+            budget_minutes=(
+                float(options["budget-minutes"]) if "budget-minutes" in options else None
+            ),
+            budget_calls=(
+                int(options["budget-calls"]) if "budget-calls" in options else None
+            ),
+            processes=(
+                int(options["processes"]) if "processes" in options else None
+            ),
+        )
     except Exception as e:
         log.error(f"❌ Erro fatal {e}")
 
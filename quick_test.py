@@ -5,6 +5,15 @@ from bling_auth import ensure_authenticated
 from bling_api import BlingAPI
 from bling_db import BlingDatabase
 from bling_logger import log
+import random
+import timeit
+from bling_utils import (
+    CategoryCache,
+    should_ignore_product,
+    should_generate_code,
+    EXCLUDED_CATEGORIES,
+    IGNORE_SUBCATEGORIES,
+)
 
 def test_auth():
     """Testa autenticação."""
@@ -61,6 +70,200 @@ def test_database():
         log.error(f"❌ Erro: {e}")
         return False
 
+def _sample_categories():
+    """Árvore sintética com os casos das regras (acentos, peças, SubMaquina...)."""
+    names = [
+        "Notebook", "SFF", "Mini", "Monitor", "SubMaquina", "Peças",
+        "Peças>>Placa Mãe", "Peças>>Memória", "Peca>>Fonte", "Pecas",
+        "Teclado Mouse", "Acessórios>>SubMaquina", "Cabos>>HDMI",
+        "Áudio>>Fone de Ouvido", "Impressão", "", "Computador>>Gamer",
+    ]
+    categories = {}
+    for i in range(1, 501):
+        name = names[i % len(names)]
+        # Alterna entre "descricao" e "nome" (get_name aceita os dois)
+        key = "nome" if i % 7 == 0 else "descricao"
+        categories[i] = {"id": i, key: f"{name} {i}" if i > len(names) else name}
+    return categories
+
+
+def _sample_products(n=20000):
+    rnd = random.Random(42)
+    products = []
+    for i in range(n):
+        cat_id = rnd.choice([rnd.randint(1, 500), rnd.randint(1, 500), 0, 9999])
+        product = {"id": i, "categoria": {"id": cat_id}}
+        if i % 5 == 0:
+            product["codigo"] = f"X{i}"
+        products.append(product)
+    return products
+
+
+# === Regras originais (cópia literal, antes da tabela de decisão) ===
+# Referência independente: a tabela compilada precisa dar as mesmas decisões.
+
+def _baseline_extract_category_info(product, category_cache=None):
+    cat_info = product.get('categoria', '')
+    cat_id = cat_info.get('id')
+    
+    if not cat_id:
+        return None, None, None, None
+    
+    # Tentar obter nome do cache primeiro
+    if category_cache:
+        full_name = category_cache.get_name(cat_id)
+    else:
+        # Fallback: tentar obter do próprio produto (pode não existir)
+        full_name = cat_info.get('nome', '')
+    
+    if not full_name:
+        return None, None, None, cat_id
+    
+    # Extrair hierarquia (Categoria>>Subcategoria)
+    if '>>' in full_name:
+        parts = full_name.split('>>')
+        category = parts[0].strip()
+        subcategory = parts[-1].strip()
+        return category, subcategory, full_name, cat_id
+    else:
+        return full_name, None, full_name, cat_id
+
+
+def _baseline_should_ignore_product(product, category_cache=None,
+                         excluded_categories={'notebook', 'sff', 'mini', 'monitor'}, 
+                         ignore_subcategories={'submaquina'}):
+    category, subcategory, full, cat_id = _baseline_extract_category_info(product, category_cache)
+    
+    if not category:
+        return False, "Sem categoria ou categoria não encontrada no cache"
+    
+    # Verificar categorias excluídas
+    if category.lower() in excluded_categories:
+        return True, f"Categoria excluída: {category}"
+    
+    # Verificar subcategorias ignoradas
+    if subcategory and subcategory.lower() in ignore_subcategories:
+        return True, f"Subcategoria ignorada: {subcategory}"
+    
+    return False, ""
+
+
+def _baseline_get_category_prefix(category_name):
+    # Remove acentos comuns
+    replacements = {
+        'ã': 'a', 'á': 'a', 'à': 'a', 'â': 'a',
+        'é': 'e', 'ê': 'e',
+        'í': 'i',
+        'õ': 'o', 'ó': 'o', 'ô': 'o',
+        'ú': 'u', 'ü': 'u',
+        'ç': 'c'
+    }
+    
+    clean_name = category_name.lower()
+    for old, new in replacements.items():
+        clean_name = clean_name.replace(old, new)
+    
+    parts = clean_name.split()
+    
+    if len(parts) > 1:
+        # Pega 2 primeiras letras de cada palavra
+        return (parts[0][:2] + parts[1][:2]).upper()
+    else:
+        # Pega 4 primeiras letras
+        return clean_name[:4].upper()
+
+
+def _baseline_should_generate_code(product, category_cache=None):
+    # Já tem código?
+    if product.get('codigo'):
+        return False, "Ja possui codigo", None
+    
+    category, subcategory, full, cat_id = _baseline_extract_category_info(product, category_cache)
+    
+    if not category:
+        return False, "Sem categoria ou categoria nao encontrada", None
+    
+    # SubMaquina: ignorar
+    if subcategory and subcategory.lower() == 'submaquina':
+        return False, "Subcategoria SubMaquina (ignorar)", None
+    
+    if category.lower() == 'submaquina':
+        return False, "Categoria SubMaquina (ignorar)", None
+    
+    # Notebook, Mini, SFF -> NTB
+    if category.lower() in ['notebook', 'mini', 'sff']:
+        return True, f"Categoria {category}", "NTB"
+    
+    # Peças: usar subcategoria (CORRIGIDO - sem encoding corrompido)
+    if category.lower() in ['pecas', 'peca'] or 'peca' in category.lower():
+        if subcategory:
+            prefix = _baseline_get_category_prefix(subcategory)
+            return True, f"Peca - Subcategoria {subcategory}", prefix
+        else:
+            return False, "Peca sem subcategoria", None
+    
+    # Outras categorias: gera prefixo da categoria
+    prefix = _baseline_get_category_prefix(category)
+    return True, f"Categoria {category}", prefix
+
+
+def test_decision_table():
+    """Equivalência da tabela de decisão com as regras originais + micro-benchmark."""
+    log.info("🧮 Testando tabela de decisão por categoria...")
+    try:
+        cache = CategoryCache()
+        cache._swap(_sample_categories(), 0, "test")
+        products = _sample_products()
+
+        def reference_ignore(product):
+            return _baseline_should_ignore_product(
+                product, cache, EXCLUDED_CATEGORIES, IGNORE_SUBCATEGORIES
+            )
+
+        def reference_code(product):
+            return _baseline_should_generate_code(product, cache)
+
+        for product in products:
+            assert should_ignore_product(product, cache) == reference_ignore(product), product
+            assert should_generate_code(product, cache) == reference_code(product), product
+
+        # Tabela recompilada quando o cache muda
+        cache.put({"id": 1, "descricao": "Notebook>>Gamer"})
+        assert should_ignore_product({"categoria": {"id": 1}}, cache)[0]
+        assert should_generate_code({"categoria": {"id": 1}}, cache)[2] == "NTB"
+
+        log.info(f"✅ {len(products)} produtos com decisões idênticas")
+
+        # Benchmark no caminho quente: categoria conhecida e produto sem código
+        hot = [
+            p for p in products
+            if p["categoria"]["id"] in cache._categories and not p.get("codigo")
+        ]
+
+        def run(ignore, code):
+            for product in hot:
+                ignore(product)
+                code(product)
+
+        compiled = min(timeit.repeat(
+            lambda: run(lambda p: should_ignore_product(p, cache),
+                        lambda p: should_generate_code(p, cache)),
+            number=1, repeat=3,
+        ))
+        reference = min(timeit.repeat(
+            lambda: run(reference_ignore, reference_code), number=1, repeat=3
+        ))
+        per_call = 1e6 / (2 * len(hot))
+        log.info(
+            f"⏱️  Por decisão: tabela {compiled * per_call:.2f}µs, "
+            f"cálculo direto {reference * per_call:.2f}µs "
+            f"({reference / compiled:.1f}x)"
+        )
+        return True
+    except Exception as e:
+        log.error(f"❌ Erro: {e}")
+        return False
+
 if __name__ == "__main__":
     log.info("="*60)
     log.info("🧪 TESTE DE VALIDAÇÃO DOS MÓDULOS")
@@ -69,7 +272,8 @@ if __name__ == "__main__":
     results = {
         "Autenticação": test_auth(),
         "API": test_api(),
-        "Database": test_database()
+        "Database": test_database(),
+        "Tabela de decisão": test_decision_table()
     }
     
     log.info("="*60)
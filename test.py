@@ -9,6 +9,11 @@ import os
 # Imports dos novos módulos
 from bling_auth import ensure_authenticated
 from bling_api import BlingAPI
+from bling_db import BlingDatabase
+from bling_incremental import DECISION_ERROR
+from bling_candidates import StockCandidateIndex, summary_stock
+from bling_journal import COMPLETED, FAILED, RunJournal
+from bling_scheduler import AdaptiveScheduler
 from bling_utils import (
     get_category_cache,
     should_ignore_product,
@@ -17,7 +22,7 @@ from bling_utils import (
 
 load_dotenv()
 
-# Configurações
+# Configurações (intervalo base; o agendador adapta a cada ciclo)
 MINUTES_BETWEEN_RUNS = int(os.getenv("MINUTES_BETWEEN_RUNS", 60))
 EXCLUDED_CATEGORIES = {"notebook", "sff", "mini", "monitor"}
 IGNORE_SUBCATEGORIES = {"submaquina"}
@@ -25,122 +30,207 @@ IGNORE_SUBCATEGORIES = {"submaquina"}
 # Cliente API
 api = BlingAPI(ensure_authenticated)
 
+# Banco local (cópia persistida das categorias)
+db = BlingDatabase()
+
 # Cache de categorias (NOVO)
 category_cache = get_category_cache()
 
+# Candidatos com estoque zerado (webhooks stock.updated + reconciliação)
+stock_index = StockCandidateIndex(db)
+
+
+def attach(host_api, host_db, host_stock_index):
+    """
+    Usa o limitador de requisições, o banco e o índice de um processo
+    hospedeiro (webhook_server com o monitor embutido): ritmo e cota diária
+    passam a ser compartilhados com os webhooks.
+    """
+    global api, db, stock_index
+    api = BlingAPI(ensure_authenticated, rate_limiter=host_api.rate_limiter)
+    db = host_db
+    stock_index = host_stock_index
+
+
+def create_scheduler(**kwargs):
+    """Agenda adaptativa dos ciclos do monitor (ver bling_scheduler)."""
+    return AdaptiveScheduler(
+        process_zero_stock_products,
+        name="monitor",
+        db=db,
+        rate_limiter=api.rate_limiter,
+        base_minutes=MINUTES_BETWEEN_RUNS,
+        **kwargs
+    )
+
+
+def evaluate_candidate(candidate):
+    """
+    Avalia um candidato do índice, desativando-o se zerou por vendas.
+    
+    Returns:
+        Decisão registrada no índice ("left_index" se o saldo voltou a ser positivo)
+    """
+    product_id = candidate['product_id']
+    
+    # Buscar detalhes completos (saldo atual, categoria, situação)
+    try:
+        details_response = api.get_product(product_id)
+        product_details = details_response.get("data", {})
+    except Exception as e:
+        print(f"\n❌ Erro ao buscar detalhes do produto {product_id}: {e}")
+        stock_index.record(product_id, DECISION_ERROR)
+        return DECISION_ERROR
+    
+    stock = summary_stock(product_details)
+    if stock > 0:
+        # Saldo voltou: sai do índice
+        stock_index.observe(product_id, stock, source='monitor')
+        return 'left_index'
+    
+    print("\n📦 Produto com estoque ZERO encontrado:")
+    print(f"   ID: {product_id}")
+    print(f"   Nome: {product_details.get('nome', 'Sem nome')}")
+    
+    if product_details.get('situacao') == 'I':
+        print("   ⏭️  Já está INATIVO")
+        stock_index.forget(product_id)
+        return 'inactive'
+    
+    # Verificar se deve ignorar (ATUALIZADO - passa o cache)
+    try:
+        should_ignore, ignore_reason = should_ignore_product(
+            product_details, 
+            category_cache,
+            EXCLUDED_CATEGORIES,
+            IGNORE_SUBCATEGORIES
+        )
+    except Exception as e:
+        # Categoria ausente e API indisponível: reavaliado no próximo ciclo
+        print(f"   ❌ Erro ao buscar a categoria: {e}")
+        stock_index.record(product_id, DECISION_ERROR)
+        return DECISION_ERROR
+    
+    if should_ignore:
+        print(f"   ⏭️  IGNORADO: {ignore_reason}")
+        stock_index.record(product_id, 'ignored')
+        return 'ignored'
+    
+    # Verificar se zerou por vendas
+    print("   🔍 Verificando movimentações de estoque...")
+    try:
+        is_depleted, details = check_stock_depleted_by_sales(
+            api, product_id, raise_errors=True
+        )
+    except Exception as e:
+        # Reavaliado no próximo ciclo (não conta como "não zerou")
+        print(f"   ❌ Erro ao verificar movimentações: {e}")
+        stock_index.record(product_id, DECISION_ERROR)
+        return DECISION_ERROR
+    
+    print(f"   📊 Entradas: {details['entries']}")
+    print(f"   📊 Saídas por venda: {details['sales_exits']}")
+    print(f"   📊 Motivo: {details['reason']}")
+    
+    if not is_depleted:
+        print("   ✅ Produto NÃO será desativado (não zerou por vendas)")
+        stock_index.record(product_id, 'not_depleted')
+        return 'not_depleted'
+    
+    print("   🔴 DESATIVANDO produto...")
+    try:
+        api.update_product_situation(product_id, 'I')
+        print("   ✅ Produto DESATIVADO com sucesso")
+        stock_index.forget(product_id)
+        return 'deactivated'
+    except Exception as e:
+        print(f"   ❌ Erro ao desativar: {e}")
+        stock_index.record(product_id, DECISION_ERROR)
+        return DECISION_ERROR
+
 
-def process_zero_stock_products():
+def process_zero_stock_products(force_reconcile=False):
     """
     Processa produtos com estoque zero, desativando apenas os que zeraram por vendas.
+    
+    Avalia só os candidatos do índice; a listagem inteira só é percorrida na
+    reconciliação periódica (CANDIDATE_RECONCILE_HOURS).
     """
     print(f"\n{'='*80}")
-    print(f"🔍 INICIANDO VARREDURA - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"🔍 INICIANDO CICLO - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"{'='*80}\n")
     
-    # Carregar cache de categorias (NOVO - só carrega uma vez)
-    if not category_cache.is_loaded():
-        category_cache.load(api)
+    started = time.time()
+    calls_before = api.call_count
+    journal = RunJournal(db, "monitor").open(resume=False)
     
-    page = 1
-    checked_count = 0
-    zero_stock_count = 0
-    deactivated_count = 0
-    ignored_count = 0
+    # Carregar cache de categorias (warm start pelo banco; refresh após o TTL)
+    category_cache.load(api, db=db)
     
-    while True:
+    reconcile = None
+    reason = stock_index.reconcile_reason(force=force_reconcile)
+    if reason:
+        print(f"🔄 Reconciliando índice de candidatos ({reason})...")
         try:
-            data = api.get_products(page=page, limit=100)
-            products = data.get("data", [])
-            
-            if not products:
-                break
-            
-            for p in products:
-                checked_count += 1
-                stock = p.get("estoqueAtual", 0)
-                
-                if stock != 0:
-                    continue
-                
-                zero_stock_count += 1
-                product_id = p.get("id")
-                product_name = p.get("nome", "Sem nome")
-                
-                print("\n📦 Produto com estoque ZERO encontrado:")
-                print(f"   ID: {product_id}")
-                print(f"   Nome: {product_name}")
-                
-                # Buscar detalhes completos
-                try:
-                    details_response = api.get_product(product_id)
-                    product_details = details_response.get("data", {})
-                except Exception as e:
-                    print(f"   ❌ Erro ao buscar detalhes: {e}")
-                    continue
-                
-                # Verificar se deve ignorar (ATUALIZADO - passa o cache)
-                should_ignore, ignore_reason = should_ignore_product(
-                    product_details, 
-                    category_cache,
-                    EXCLUDED_CATEGORIES,
-                    IGNORE_SUBCATEGORIES
-                )
-                
-                if should_ignore:
-                    ignored_count += 1
-                    print(f"   ⏭️  IGNORADO: {ignore_reason}")
-                    continue
-                
-                # Verificar se zerou por vendas
-                print("   🔍 Verificando movimentações de estoque...")
-                is_depleted, details = check_stock_depleted_by_sales(api, product_id)
-                
-                print(f"   📊 Entradas: {details['entries']}")
-                print(f"   📊 Saídas por venda: {details['sales_exits']}")
-                print(f"   📊 Motivo: {details['reason']}")
-                
-                if is_depleted:
-                    print("   🔴 DESATIVANDO produto...")
-                    try:
-                        api.update_product_situation(product_id, 'I')
-                        deactivated_count += 1
-                        print("   ✅ Produto DESATIVADO com sucesso")
-                    except Exception as e:
-                        print(f"   ❌ Erro ao desativar: {e}")
-                else:
-                    print("   ✅ Produto NÃO será desativado (não zerou por vendas)")
-            
-            print(f"\n📄 Página {page} processada ({len(products)} produtos)")
-            page += 1
-        
+            reconcile = stock_index.reconcile(api)
         except Exception as e:
-            print(f"\n❌ Erro na página {page}: {e}")
-            break
+            # Segue com o índice atual; a próxima execução tenta de novo
+            print(f"\n❌ Erro na reconciliação: {e}")
+    
+    due, total = stock_index.due()
+    print(f"🎯 Candidatos: {total} no índice, {len(due)} a avaliar neste ciclo")
+    
+    # Novos ou com saldo alterado (base da taxa de mudanças do agendador)
+    changes = sum(1 for c in due if c['decision'] is None)
+    
+    decisions = {}
+    for candidate in due:
+        decision = evaluate_candidate(candidate)
+        decisions[decision] = decisions.get(decision, 0) + 1
+    
+    remaining = stock_index.refresh_gauge()
+    stats = {
+        "candidates": total,
+        "evaluated": len(due),
+        "skipped": total - len(due),
+        "changes": changes,
+        "decisions": decisions,
+        "candidates_after": remaining,
+        "api_calls": api.call_count - calls_before,
+        "seconds": round(time.time() - started, 1),
+        "reconcile": reconcile,
+    }
+    failed = bool(reason) and reconcile is None
+    journal.finish(FAILED if failed else COMPLETED, stats=stats)
     
     # Relatório final
     print(f"\n{'='*80}")
     print("📊 RELATÓRIO FINAL")
     print(f"{'='*80}")
-    print(f"✅ Produtos verificados: {checked_count}")
-    print(f"⚠️  Com estoque zero: {zero_stock_count}")
-    print(f"⏭️  Ignorados (categoria): {ignored_count}")
-    print(f"🔴 Desativados (zerado por vendas): {deactivated_count}")
+    if reconcile:
+        print(
+            f"🔄 Reconciliação: {reconcile['products_seen']} produtos, "
+            f"{reconcile['api_calls']} requisições, {reconcile['seconds']}s "
+            f"(candidatos {reconcile['candidates_before']} → {reconcile['candidates_after']})"
+        )
+    print(f"🎯 Candidatos no índice: {total} ({len(due)} avaliados, {total - len(due)} sem mudança)")
+    print(f"↩️  Saíram do índice (estoque > 0): {decisions.get('left_index', 0)}")
+    print(f"⏭️  Ignorados (categoria): {decisions.get('ignored', 0)}")
+    print(f"🔴 Desativados (zerado por vendas): {decisions.get('deactivated', 0)}")
+    print(f"❌ Erros: {decisions.get(DECISION_ERROR, 0)}")
+    print(f"🌐 Requisições no ciclo: {stats['api_calls']} em {stats['seconds']}s")
     print(f"{'='*80}\n")
+    return stats
 
 
 def main():
-    """Loop principal."""
+    """Loop principal (intervalo adaptativo entre ciclos)."""
     print("🚀 Iniciando monitoramento Bling...")
-    print(f"⏱️  Intervalo entre execuções: {MINUTES_BETWEEN_RUNS} minutos\n")
+    print(f"⏱️  Intervalo base entre execuções: {MINUTES_BETWEEN_RUNS} minutos")
+    print("   (ajustado pelas mudanças, cota diária e duração de cada ciclo)\n")
     
     try:
-        while True:
-            process_zero_stock_products()
-            
-            print(f"⏳ Aguardando {MINUTES_BETWEEN_RUNS} minutos até próxima execução...")
-            print("   (Pressione Ctrl+C para interromper)\n")
-            
-            time.sleep(MINUTES_BETWEEN_RUNS * 60)
+        create_scheduler().run_forever()
     
     except KeyboardInterrupt:
         print("\n\n🛑 Script interrompido pelo usuário. Encerrando...")
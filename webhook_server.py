@@ -2,19 +2,37 @@
 Servidor de webhooks Bling com validação HMAC e processamento assíncrono
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+import atexit
 import hmac
 import hashlib
+import json
 import os
 import threading
-import queue
+import time
 from dotenv import load_dotenv
 
 from bling_logger import log
 from bling_auth import ensure_authenticated
-from bling_api import BlingAPI
+from bling_api import BlingAPI, RetryableAPIError
+from bling_async_ingest import AsyncIngestServer
+from bling_candidates import StockCandidateIndex
 from bling_db import BlingDatabase
+from bling_health import CachedSnapshot, RateLimitWindow
+from bling_maintenance import MaintenanceScheduler
+from bling_metrics import PROMETHEUS_CONTENT_TYPE, get_registry, render_prometheus
+from bling_scheduler import published_status
+from bling_queue import (
+    EVENT_LANES,
+    BackpressureController,
+    DurableEventQueue,
+    LaneScheduler,
+    QueueDispatcher,
+    parse_lane_weights,
+)
+from bling_workers import PartitionedWorkerPool
 from bling_utils import (
+    ProductSnapshotCache,
     get_category_cache,
     should_ignore_product,
     check_stock_depleted_by_sales,
@@ -29,17 +47,90 @@ app = Flask(__name__)
 # Configurações
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 5000))
-
-# Recursos
-api = BlingAPI(ensure_authenticated)
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 100))
+WRITE_BATCH_DELAY_MS = int(os.getenv("WRITE_BATCH_DELAY_MS", 50))
+MAINTENANCE_INTERVAL_HOURS = float(os.getenv("MAINTENANCE_INTERVAL_HOURS", 24))
+# 1 = executa os ciclos do monitor (test.py) em uma thread deste processo
+EMBEDDED_MONITOR = int(os.getenv("EMBEDDED_MONITOR", 0))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 3))
+EVENT_VISIBILITY_TIMEOUT = int(os.getenv("EVENT_VISIBILITY_TIMEOUT", 300))
+EVENT_RETRY_DELAY = int(os.getenv("EVENT_RETRY_DELAY", 30))
+EVENT_RETRY_MAX_DELAY = int(os.getenv("EVENT_RETRY_MAX_DELAY", 3600))
+EVENT_MAX_ATTEMPTS = int(os.getenv("EVENT_MAX_ATTEMPTS", 8))
+EVENT_COALESCE_WINDOW = float(os.getenv("EVENT_COALESCE_WINDOW", 2))
+WEBHOOK_LANE_WEIGHTS = parse_lane_weights(os.getenv("WEBHOOK_LANE_WEIGHTS"))
+WEBHOOK_LANE_MAX_WAIT = float(os.getenv("WEBHOOK_LANE_MAX_WAIT", 60))
+QUEUE_HIGH_WATERMARK = int(os.getenv("QUEUE_HIGH_WATERMARK", 5000))
+QUEUE_LOW_WATERMARK = int(os.getenv("QUEUE_LOW_WATERMARK", 2000))
+QUEUE_OVERLOAD_MODE = os.getenv("QUEUE_OVERLOAD_MODE", "reject")
+WEBHOOK_RETRY_AFTER = int(os.getenv("WEBHOOK_RETRY_AFTER", 30))
+WEBHOOK_FRONTEND = os.getenv("WEBHOOK_FRONTEND", "flask")
+INGEST_CHANNEL_SIZE = int(os.getenv("INGEST_CHANNEL_SIZE", 1000))
+INGEST_ACK_WORKERS = int(os.getenv("INGEST_ACK_WORKERS", 16))
+HEALTH_CACHE_TTL = float(os.getenv("HEALTH_CACHE_TTL", 10))
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", 5))
+STATS_RATE_LIMIT = int(os.getenv("STATS_RATE_LIMIT", 30))
+PAYLOAD_MAX_AGE = float(os.getenv("PAYLOAD_MAX_AGE", 300))
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", 20000))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", 3600))
+
+# Recursos (429/5xx reagendam o evento em vez de dormir no worker)
+api = BlingAPI(ensure_authenticated, blocking_retries=False)
 db = BlingDatabase()
+maintenance = MaintenanceScheduler(db, interval_hours=MAINTENANCE_INTERVAL_HOURS)
+# Candidatos com estoque zerado avaliados pelo monitor (test.py)
+stock_index = StockCandidateIndex(db)
+
+# Fila durável de eventos (sobrevive a reinícios)
+event_store = DurableEventQueue(
+    db,
+    visibility_timeout=EVENT_VISIBILITY_TIMEOUT,
+    coalesce_window=EVENT_COALESCE_WINDOW,
+    lane_scheduler=LaneScheduler(WEBHOOK_LANE_WEIGHTS, max_wait=WEBHOOK_LANE_MAX_WAIT),
+    max_attempts=EVENT_MAX_ATTEMPTS,
+    retry_base_delay=EVENT_RETRY_DELAY,
+    retry_max_delay=EVENT_RETRY_MAX_DELAY,
+)
+
+# Admissão com marcas d'água alta/baixa sobre a fila
+backpressure = BackpressureController(
+    high_watermark=QUEUE_HIGH_WATERMARK,
+    low_watermark=QUEUE_LOW_WATERMARK,
+    mode=QUEUE_OVERLOAD_MODE,
+)
 
 # Cache de categorias (NOVO - CRÍTICO!)
 category_cache = get_category_cache()
+CATEGORY_EVENT_PREFIX = "product_category."
 
-# Fila de eventos
-event_queue = queue.Queue()
+# Campos estáveis dos produtos (código/categoria) vistos em payloads e na API
+product_cache = ProductSnapshotCache(
+    max_size=PRODUCT_CACHE_SIZE, ttl_seconds=PRODUCT_CACHE_TTL
+)
 
+# Métricas do caminho de webhook (exportadas em /metrics)
+metrics = get_registry()
+ingest_latency = metrics.histogram(
+    "bling_webhook_ingest_seconds",
+    "Tempo entre o recebimento do webhook e o envio da resposta",
+)
+ingest_requests = metrics.counter(
+    "bling_webhook_requests_total", "Requisições de webhook por status HTTP"
+)
+event_processing = metrics.histogram(
+    "bling_event_processing_seconds",
+    "Tempo de processamento por tipo de evento e resultado",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+event_resolution = metrics.counter(
+    "bling_event_resolution_total",
+    "Eventos decididos só com payload/cache (local) ou consultando a API",
+)
+event_api_calls = metrics.histogram(
+    "bling_event_api_calls",
+    "Requisições à API Bling por evento processado",
+    buckets=(0, 1, 2, 3, 5, 8, 13, 20),
+)
 
 def verify_hmac_signature(payload_bytes, signature):
     """
@@ -62,142 +153,401 @@ def verify_hmac_signature(payload_bytes, signature):
     return hmac.compare_digest(signature, expected)
 
 
-@app.route("/webhook/bling", methods=["POST"])
-def webhook_handler():
+def parse_webhook(body, signature):
     """
-    Endpoint principal de recepção de webhooks.
-    DEVE responder em < 5 segundos.
-    """
-    # Validar assinatura HMAC
-    signature = request.headers.get("X-Bling-Signature-256", "")
+    Validação barata do webhook (HMAC + JSON), sem acesso a disco.
 
-    if not verify_hmac_signature(request.get_data(), signature):
+    Returns:
+        (payload, None) ou (None, resposta_de_erro)
+    """
+    if not verify_hmac_signature(body, signature):
         log.error("❌ Assinatura HMAC inválida!")
-        return jsonify({"error": "Invalid signature"}), 401
+        return None, (401, {"error": "Invalid signature"}, {})
 
-    # Parsear payload
     try:
-        payload = request.get_json()
+        payload = json.loads(body)
     except Exception as e:
         log.error(f"❌ Erro ao parsear JSON: {e}")
-        return jsonify({"error": "Invalid JSON"}), 400
+        return None, (400, {"error": "Invalid JSON"}, {})
 
-    event_id = payload.get("eventId")
-    event_type = payload.get("event")
+    if not isinstance(payload, dict):
+        log.error("❌ Payload não é um objeto JSON")
+        return None, (400, {"error": "Invalid JSON"}, {})
 
-    if not event_id or not event_type:
+    if not payload.get("eventId") or not payload.get("event"):
         log.error("❌ Payload sem eventId ou event")
-        return jsonify({"error": "Missing eventId or event"}), 400
+        return None, (400, {"error": "Missing eventId or event"}, {})
+
+    return payload, None
+
+
+def accept_webhook(payload):
+    """
+    Idempotência, backpressure e gravação na fila durável.
+
+    Returns:
+        (status_code, corpo, headers)
+    """
+    event_id = payload["eventId"]
+    event_type = payload["event"]
 
     # Verificar idempotência
     if db.is_event_processed(event_id):
         log.info(f"ℹ️  Evento {event_id} já processado anteriormente (idempotência)")
-        return jsonify({"status": "already_processed"}), 200
+        return 200, {"status": "already_processed"}, {}
 
-    # Enfileirar para processamento assíncrono
-    event_queue.put(payload)
+    # Backpressure: recusar (retentável) quando a fila está saturada
+    accepted, reason = backpressure.admit(
+        EVENT_LANES.get(event_type, "normal"),
+        event_store.approx_depth(),
+        db.writer.queue_size() if db.writer else 0,
+    )
+    if not accepted:
+        log.warning(f"⏳ Webhook recusado por sobrecarga ({reason}): {event_type}")
+        return (
+            503,
+            {"status": "overloaded", "reason": reason},
+            {"Retry-After": str(WEBHOOK_RETRY_AFTER)},
+        )
+
+    # Gravar na fila durável (COMMIT confirmado antes de responder)
+    status = event_store.enqueue(payload)
+    if status == "duplicate":
+        log.info(f"ℹ️  Evento {event_id} já está na fila (idempotência)")
+        return 200, {"status": "already_queued"}, {}
 
     log.info(f"✅ Webhook recebido e enfileirado: {event_type} (eventId: {event_id})")
+    return 200, {"status": status}, {}
+
+
+def _json_response(status_code, body, headers):
+    response = jsonify(body)
+    response.headers.update(headers)
+    return response, status_code
+
+
+@app.route("/webhook/bling", methods=["POST"])
+def webhook_handler():
+    """
+    Endpoint principal de recepção de webhooks.
+    DEVE responder em < 5 segundos.
+    """
+    started = time.perf_counter()
+    payload, error = parse_webhook(
+        request.get_data(), request.headers.get("X-Bling-Signature-256", "")
+    )
+    result = error or accept_webhook(payload)
+
+    ingest_latency.observe(time.perf_counter() - started, frontend="flask")
+    ingest_requests.inc(frontend="flask", status=result[0])
 
     # Responder rapidamente (<5s)
-    return jsonify({"status": "queued"}), 200
+    return _json_response(*result)
+
+
+def _db_snapshot():
+    """Consultas pesadas (COUNT/GROUP BY) dos endpoints de saúde."""
+    depth = event_store.depth()
+    # Corrige desvios da contagem em memória (ex.: replay feito por outro processo)
+    event_store.sync_depth(depth)
+    return {
+        "db_stats": db.get_stats(),
+        "lanes": event_store.lane_stats(),
+        "queue_depth": depth,
+        "dead_letters": event_store.dead_letter_count(),
+        "stock_candidates": stock_index.refresh_gauge(),
+    }
+
+
+# Snapshots com TTL: probes frequentes não disputam o banco com os workers
+health_snapshot = CachedSnapshot(_db_snapshot, ttl=HEALTH_CACHE_TTL)
+stats_snapshot = CachedSnapshot(_db_snapshot, ttl=STATS_CACHE_TTL)
+stats_rate_limit = RateLimitWindow(max_calls=STATS_RATE_LIMIT, window=60)
+
+# Sinalizado ao fim de start_processing (readiness)
+processing_started = threading.Event()
+
+
+@app.route("/health/live", methods=["GET"])
+def liveness_check():
+    """Liveness: o processo responde (sem acesso ao banco)."""
+    return jsonify({"status": "alive"}), 200
+
+
+@app.route("/health/ready", methods=["GET"])
+def readiness_check():
+    """Readiness: componentes em memória prontos para receber eventos."""
+    checks = {
+        "started": processing_started.is_set(),
+        "categories_loaded": category_cache.is_loaded(),
+        "db_writer": bool(db.writer and db.writer.is_running()),
+        "workers": worker_pool.is_running(),
+        "dispatcher": dispatcher.is_running(),
+    }
+    ready = all(checks.values())
+    return jsonify(
+        {
+            "status": "ready" if ready else "not_ready",
+            "checks": checks,
+            "shedding": backpressure.shedding,
+        }
+    ), (200 if ready else 503)
 
 
 @app.route("/health", methods=["GET"])
 def health_check():
-    """Endpoint de health check."""
-    stats = db.get_stats()
+    """Endpoint de health check (contagens do banco vêm de snapshot com TTL)."""
+    snapshot = health_snapshot.get()
     return jsonify(
         {
             "status": "healthy",
-            "queue_size": event_queue.qsize(),
+            "queue_size": event_store.approx_depth(),
             "categories_loaded": category_cache.is_loaded(),
-            "db_stats": stats,
+            "db_stats": snapshot["db_stats"],
+            "dead_letters": snapshot["dead_letters"],
+            "stock_candidates": snapshot["stock_candidates"],
+            "snapshot_age": round(health_snapshot.age() or 0, 3),
+            "inflight": dispatcher.inflight(),
+            "backpressure": {
+                "shedding": backpressure.shedding,
+                "mode": backpressure.mode,
+            },
         }
     ), 200
 
 
-def process_stock_event(data):
-    """Processa evento de estoque (stock.updated)."""
+@app.route("/stats", methods=["GET"])
+def stats_endpoint():
+    """Estatísticas detalhadas (limitadas a STATS_RATE_LIMIT chamadas/minuto)."""
+    allowed, retry_in = stats_rate_limit.allow()
+    if not allowed:
+        response = jsonify({"error": "Too many requests"})
+        response.headers["Retry-After"] = str(int(retry_in) + 1)
+        return response, 429
+
+    snapshot = stats_snapshot.get()
+    return jsonify(
+        {
+            "queue_size": snapshot["queue_depth"],
+            "queue_size_approx": event_store.approx_depth(),
+            "dead_letters": snapshot["dead_letters"],
+            "categories_loaded": category_cache.is_loaded(),
+            "categories": category_cache.stats(),
+            "db_stats": snapshot["db_stats"],
+            "stock_candidates": snapshot["stock_candidates"],
+            "snapshot_age": round(stats_snapshot.age() or 0, 3),
+            "db_writer": db.writer.stats() if db.writer else None,
+            "db_maintenance": maintenance.status(),
+            "monitor": (
+                monitor_scheduler.status()
+                if monitor_scheduler
+                else published_status(db, "monitor")
+            ),
+            "workers": worker_pool.stats(),
+            "inflight": dispatcher.inflight(),
+            "events": event_store.stats(),
+            "resolution": {
+                "/".join(v for _, v in key): count
+                for key, count in event_resolution.snapshot().items()
+            },
+            "product_cache_size": len(product_cache),
+            "lanes": snapshot["lanes"],
+            "backpressure": backpressure.stats(),
+            "ingest": ingest_server.stats() if ingest_server else None,
+        }
+    ), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Métricas no formato texto do Prometheus."""
+    metrics.gauge("bling_queue_depth", "Eventos na fila durável").set(
+        event_store.approx_depth()
+    )
+    metrics.gauge("bling_worker_queue_size", "Itens aguardando nos workers").set(
+        worker_pool.qsize()
+    )
+    metrics.gauge(
+        "bling_dispatcher_inflight", "Eventos reservados em processamento"
+    ).set(dispatcher.inflight())
+    if db.writer:
+        metrics.gauge(
+            "bling_db_writer_queue_size", "Escritas aguardando o escritor write-behind"
+        ).set(db.writer.queue_size())
+    return Response(render_prometheus(metrics), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def payload_is_fresh(event_ts):
+    """Campos voláteis do payload (estoque, código) só valem para eventos recentes."""
+    return event_ts is None or time.time() - event_ts <= PAYLOAD_MAX_AGE
+
+
+def _has_field(product, field):
+    if field == "categoria":
+        return bool((product.get("categoria") or {}).get("id"))
+    if field == "estoque":
+        return (product.get("estoque") or {}).get("saldoVirtualTotal") is not None
+    return field in product
+
+
+def resolve_product(product_id, payload_fields, needed):
+    """
+    Monta o produto a partir do payload do webhook + cache local e só consulta
+    a API quando falta algum dos campos em `needed`.
+
+    Returns:
+        (produto, origem: "local" | "api")
+    """
+    cached = product_cache.get(product_id) or {}
+    product = {**cached, **payload_fields, "id": product_id}
+
+    # Código atribuído depois do evento (por nós) prevalece sobre payload vazio
+    if cached.get("codigo") and not product.get("codigo"):
+        product["codigo"] = cached["codigo"]
+
+    missing = [field for field in needed if not _has_field(product, field)]
+    if not missing:
+        return product, "local"
+
+    log.info(f"   🌐 Consultando produto na API (faltando: {', '.join(missing)})")
+    product = api.get_product(product_id).get("data", {})
+    product_cache.remember(product)
+    return product, "api"
+
+
+def process_stock_event(data, event_ts=None):
+    """
+    Processa evento de estoque (stock.updated).
+
+    Returns:
+        Origem dos dados usados na decisão ("local" ou "api")
+    """
 
     product_info = data.get("produto", {})
     product_id = product_info.get("id")
 
     if not product_id:
         log.warning("⚠️  Evento de estoque sem ID de produto")
-        return
+        return None
 
     log.info(f"📦 Processando evento de estoque para produto {product_id}")
 
     # Garantir que cache está carregado
     if not category_cache.is_loaded():
         log.info("📦 Carregando cache de categorias sob demanda...")
-        category_cache.load(api)
+        category_cache.load(api, db=db)
 
     try:
-        # Buscar produto completo
-        response = api.get_product(product_id)
-        product = response.get("data", {})
+        # Saldo vindo no próprio payload (descartado se o evento for antigo)
+        payload_fields = {}
+        if product_info.get("categoria"):
+            payload_fields["categoria"] = product_info["categoria"]
+        if data.get("saldoVirtualTotal") is not None and payload_is_fresh(event_ts):
+            payload_fields["estoque"] = {"saldoVirtualTotal": data["saldoVirtualTotal"]}
+
+        # Estoque > 0 pelo payload: nada a fazer, sem consultar a API
+        stock = payload_fields.get("estoque", {}).get("saldoVirtualTotal")
+        if stock is not None and stock > 0:
+            stock_index.observe(product_id, stock)
+            log.info(f"   ✅ Estoque > 0 ({stock}), nada a fazer")
+            return "local"
+
+        product, source = resolve_product(
+            product_id, payload_fields, ("estoque", "categoria")
+        )
+
+        # Saldo atualizado no índice de candidatos do monitor (test.py);
+        # produto inativo não é candidato
+        stock = product.get("estoque", {}).get("saldoVirtualTotal", 0)
+        if product.get("situacao") == "I":
+            stock_index.forget(product_id)
+            log.info("   ⏭️  Produto já inativo, nada a fazer")
+            return source
+        stock_index.observe(product_id, stock)
 
-        # Verificar se deve ignorar
+        # Verificar se deve ignorar (erro na busca da categoria sobe)
         should_ignore, reason = should_ignore_product(product, category_cache)
         if should_ignore:
+            if stock <= 0:
+                stock_index.record(product_id, "ignored")
             log.info(f"   ⏭️  Ignorando produto: {reason}")
-            return
+            return source
 
         # Verificar estoque
-        stock = product.get("estoque", {}).get("saldoVirtualTotal", 0)
-
         if stock > 0:
             log.info(f"   ✅ Estoque > 0 ({stock}), nada a fazer")
-            return
+            return source
 
         # Verificar se zerou por vendas
-        is_depleted, details = check_stock_depleted_by_sales(api, product_id)
+        # Erro na consulta sobe: o evento volta à fila (retry/dead letter)
+        is_depleted, details = check_stock_depleted_by_sales(
+            api, product_id, raise_errors=True
+        )
 
         if is_depleted:
             log.warning("   🔴 Desativando produto (zerado por vendas)")
             api.update_product_situation(product_id, "I")
+            product_cache.remember({"id": product_id, "situacao": "I"})
+            stock_index.forget(product_id)
             log.info("   ✅ Produto desativado")
         else:
+            stock_index.record(product_id, "not_depleted")
             log.info(f"   ℹ️  Não desativar: {details['reason']}")
+        return source
 
     except Exception as e:
         log.error(f"   ❌ Erro ao processar evento de estoque para produto {product_id}: {e}")
+        raise
 
 
-def process_product_event(data):
-    """Processa evento de produto (product.created, product.updated)."""
+def process_product_event(data, event_ts=None):
+    """
+    Processa evento de produto (product.created, product.updated).
+
+    Returns:
+        Origem dos dados usados na decisão ("local" ou "api")
+    """
 
     product_id = data.get("id")
 
     if not product_id:
         log.warning("⚠️  Evento de produto sem ID")
-        return
+        return None
 
     log.info(f"📦 Processando evento de produto {product_id}")
 
     # Garantir que cache está carregado
     if not category_cache.is_loaded():
         log.info("📦 Carregando cache de categorias sob demanda...")
-        category_cache.load(api)
+        category_cache.load(api, db=db)
 
     try:
+        # Campos estáveis do payload alimentam o cache local
+        product_cache.remember(data, observed_at=event_ts)
+
         # Se já tem código, ignora
         if data.get("codigo"):
             log.info(f"   ℹ️  Produto já possui código: {data.get('codigo')}")
-            return
-
-        # Buscar detalhes completos
-        response = api.get_product(product_id)
-        product = response.get("data", {})
+            return "local"
+
+        # Payload antigo: "codigo" vazio pode não valer mais
+        fresh = payload_is_fresh(event_ts)
+        payload_fields = {
+            field: data[field]
+            for field in ("codigo", "categoria")
+            if field in data and (fresh or field == "categoria")
+        }
+        product, source = resolve_product(
+            product_id, payload_fields, ("codigo", "categoria")
+        )
 
-        # Verificar se deve gerar código
+        # Verificar se deve gerar código (categoria fora do cache vai à API;
+        # erro na busca sobe e o evento volta à fila sem mark_applied)
         should_gen, reason, prefix = should_generate_code(product, category_cache)
 
         if not should_gen:
             log.info(f"   ⏭️  Não gerar código: {reason}")
-            return
+            return source
 
         # Gerar código
         category, subcategory, full, cat_id = extract_category_info(
@@ -211,74 +561,224 @@ def process_product_event(data):
 
         # Atualizar produto
         api.update_product(product_id, {"codigo": new_code})
+        product_cache.remember({"id": product_id, "codigo": new_code})
         log.info("   ✅ Código atribuído com sucesso")
+        return source
 
     except Exception as e:
         log.error(f"   ❌ Erro ao processar evento de produto {product_id}: {e}")
+        raise
 
 
-def event_processor_worker():
-    """Thread worker que processa eventos da fila."""
-    log.info("🔄 Worker de processamento de eventos iniciado")
+def process_category_event(event_type, data):
+    """Processa evento de categoria (product_category.*): atualiza o cache."""
+    if not data.get("id"):
+        log.warning("⚠️  Evento de categoria sem ID")
+        return
+    category_cache.apply_event(event_type, data)
 
-    while True:
-        try:
-            # Pega evento da fila (bloqueante)
-            payload = event_queue.get(timeout=1)
 
-            event_id = payload.get("eventId")
-            event_type = payload.get("event")
-            data = payload.get("data", {})
+def event_partition_key(payload):
+    """Chave de ordenação do evento: ID do produto (mesmo produto = mesma fila)."""
+    data = payload.get("data", {})
+    return data.get("id") or data.get("produto", {}).get("id")
 
-            log.info(f"🔄 Processando evento: {event_type} (ID: {event_id})")
 
-            # Marcar como processado
-            product_id = data.get("id") or data.get("produto", {}).get("id")
-            db.mark_event_processed(event_id, event_type, product_id, payload)
+def handle_event(payload, event_ts=None):
+    """
+    Roteia o evento para o processador específico.
 
-            # Rotear para processador específico
-            if event_type == "stock.updated":
-                process_stock_event(data)
+    Returns:
+        Origem dos dados da decisão ("local", "api" ou None)
+    """
+    event_type = payload.get("event")
+    data = payload.get("data", {})
 
-            elif event_type in ["product.created", "product.updated"]:
-                process_product_event(data)
+    if event_type == "stock.updated":
+        return process_stock_event(data, event_ts)
 
-            else:
-                log.warning(f"⚠️  Tipo de evento desconhecido recebido: {event_type}")
+    elif event_type in ["product.created", "product.updated"]:
+        return process_product_event(data, event_ts)
 
-            event_queue.task_done()
-            log.info(f"✅ Evento {event_id} processado com sucesso")
+    elif event_type.startswith(CATEGORY_EVENT_PREFIX):
+        process_category_event(event_type, data)
+        return "local"
 
-        except queue.Empty:
-            continue
+    else:
+        log.warning(f"⚠️  Tipo de evento desconhecido recebido: {event_type}")
+        return None
 
-        except Exception as e:
-            log.error(f"❌ Erro grave no worker de eventos: {e}")
 
+def process_event(item):
+    """
+    Processa um evento reservado da fila durável (executado pelos workers).
+    O evento só é marcado como processado (ack) após o sucesso do handler.
+    """
+    payload = item["payload"]
+    event_id = payload.get("eventId")
+    event_type = payload.get("event")
 
-def start_server():
-    """Inicia servidor de webhooks."""
+    log.info(
+        f"🔄 Processando evento: {event_type} (ID: {event_id}, tentativa {item['attempts']})"
+    )
+
+    started = time.perf_counter()
+    api_calls = api.thread_call_count()
+    outcome = "ok"
+    try:
+        # Estado mais novo do produto já foi aplicado depois deste evento
+        if event_store.is_stale(item):
+            log.info(f"⏭️  Evento {event_id} obsoleto (estado mais recente já aplicado)")
+            event_store.ack(event_id, stale=True)
+            outcome = "stale"
+            return
+
+        started_ts = time.time()
+        # Qualquer erro do handler (inclusive na busca de categoria) cai no
+        # fail() abaixo: o estado aplicado só avança após uma decisão completa
+        resolution = handle_event(payload, item.get("event_ts"))
+        # Só uma leitura da API cobre eventos até started_ts; decisão tomada
+        # com o payload vale apenas até o horário do próprio evento
+        if resolution == "api":
+            event_store.mark_applied(item, started_ts)
+        elif resolution == "local" and item.get("event_ts") is not None:
+            event_store.mark_applied(item, item["event_ts"])
+    except Exception as e:
+        outcome = "retryable" if isinstance(e, RetryableAPIError) else "error"
+        action, delay = event_store.fail(
+            item, e, retry_after=getattr(e, "retry_after", None)
+        )
+        if action == "retry":
+            log.error(
+                f"❌ Evento {event_id} falhou, nova tentativa em {delay:.0f}s: {e}"
+            )
+        return
+    finally:
+        dispatcher.done()
+        event_processing.observe(
+            time.perf_counter() - started, event_type=event_type, outcome=outcome
+        )
+        event_api_calls.observe(
+            api.thread_call_count() - api_calls, event_type=event_type
+        )
+
+    event_store.ack(event_id, resolution=resolution)
+    if resolution:
+        event_resolution.inc(event_type=event_type, source=resolution)
+    log.info(f"✅ Evento {event_id} processado com sucesso ({resolution or '-'})")
+
+
+# Pool de workers com filas particionadas por produto
+worker_pool = PartitionedWorkerPool(
+    process_event, num_workers=WEBHOOK_WORKERS, name="event-worker"
+)
+
+# Entrega eventos reservados da fila durável ao pool
+dispatcher = QueueDispatcher(
+    event_store, worker_pool, event_partition_key, max_inflight=WEBHOOK_WORKERS * 4
+)
+
+
+# Front-end asyncio (opcional, ver start_async_server)
+ingest_server = None
+
+# Monitor de estoque zerado embutido (opcional, ver EMBEDDED_MONITOR)
+monitor_scheduler = None
+
+
+def start_embedded_monitor():
+    """
+    Agenda os ciclos do test.py em background, com o limitador de requisições,
+    o banco e o índice de candidatos deste processo (cota compartilhada).
+    """
+    global monitor_scheduler
+
+    import test as monitor
+
+    monitor.attach(api, db, stock_index)
+    monitor_scheduler = monitor.create_scheduler(initial_delay_minutes=5).start()
+    log.info("🔁 Monitor de estoque zerado embutido (agenda adaptativa)")
+
+
+def _log_banner(frontend):
     log.info(f"{'=' * 80}")
-    log.info("🚀 INICIANDO SERVIDOR DE WEBHOOKS BLING")
+    log.info(f"🚀 INICIANDO SERVIDOR DE WEBHOOKS BLING ({frontend})")
     log.info(f"{'=' * 80}")
     log.info("🌐 Host: 0.0.0.0")
     log.info(f"🔌 Porta: {WEBHOOK_PORT}")
     log.info("📍 Endpoint: http://<your-domain>/webhook/bling")
-    log.info("❤️  Health: http://<your-domain>/health")
+    log.info("❤️  Health: http://<your-domain>/health (/health/live, /health/ready)")
+    log.info("📊 Stats: http://<your-domain>/stats | Métricas: /metrics")
     log.info(f"{'=' * 80}")
 
-    # Carregar cache de categorias na inicialização
+
+def start_processing():
+    """Inicia cache, escritor, manutenção, fila durável e workers."""
+    # Carregar cache de categorias (warm start pelo banco + refresh periódico)
     log.info("📦 Pré-carregando cache de categorias...")
-    category_cache.load(api)
+    category_cache.load(api, db=db)
+    category_cache.start_auto_refresh()
+
+    # Agrupar escritas do caminho de webhook em transações
+    db.start_write_behind(
+        max_batch_size=WRITE_BATCH_SIZE, max_delay=WRITE_BATCH_DELAY_MS / 1000
+    )
+    atexit.register(db.stop_write_behind)
+
+    # Arquivamento + ANALYZE/vacuum/integridade periódicos
+    if MAINTENANCE_INTERVAL_HOURS > 0:
+        maintenance.start()
+
+    if EMBEDDED_MONITOR:
+        start_embedded_monitor()
+
+    # Reprocessar eventos que ficaram na fila durável (reinício/crash)
+    event_store.recover()
+
+    # Iniciar workers (eventos do mesmo produto permanecem ordenados)
+    worker_pool.start()
+    dispatcher.start()
+    processing_started.set()
 
-    # Iniciar worker thread
-    worker_thread = threading.Thread(target=event_processor_worker, daemon=True)
-    worker_thread.start()
+
+def start_server():
+    """Inicia servidor de webhooks."""
+    _log_banner("Flask")
+    start_processing()
 
     # Iniciar Flask
     # O log do Flask/Werkzeug já vai para o console, não precisamos logar isso
     app.run(host="0.0.0.0", port=WEBHOOK_PORT, debug=False, threaded=True)
 
 
+def start_async_server():
+    """
+    Alternativa a start_server com recepção em asyncio.
+
+    HMAC e JSON são validados no event loop; idempotência e gravação na fila
+    durável rodam em threads via canal limitado. Demais rotas (/health) são
+    atendidas pelo app Flask.
+    """
+    global ingest_server
+
+    _log_banner("asyncio")
+    start_processing()
+
+    ingest_server = AsyncIngestServer(
+        parse_webhook,
+        accept_webhook,
+        app,
+        host="0.0.0.0",
+        port=WEBHOOK_PORT,
+        channel_size=INGEST_CHANNEL_SIZE,
+        ack_workers=INGEST_ACK_WORKERS,
+        retry_after=WEBHOOK_RETRY_AFTER,
+    )
+    ingest_server.run()
+
+
 if __name__ == "__main__":
-    start_server()
+    if WEBHOOK_FRONTEND == "asyncio":
+        start_async_server()
+    else:
+        start_server()